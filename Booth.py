@@ -1,20 +1,58 @@
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except ImportError:  # Not on a Raspberry Pi; Booth then needs a gpio backend such as Booth_sim.SimulatedGPIO
+    GPIO = None
+import os
 import time
 import numpy as np
 import pygame as pg
-import csv
 import re
 from glob import glob
+from Booth_input import SwitchInput
+from Booth_events import SwitchEventLog
+from Booth_actuators import Actuator
+from Booth_audio import open_player
+from Booth_bundle import resident_memory
+from Booth_writer import TrialWriter
+from Booth_store import TrialStore, layout_for_title
+from Booth_database import TrialDatabase
+from Booth_stimuli import StimulusManifest
+from Booth_synth import spec_label
+from Booth_timing import TrialTimer, DeadlineScheduler, SYSTEM_CLOCK
+from Booth_metrics import PerformanceMetrics, make_rules
+from Booth_journal import SessionJournal
+from Booth_trials import TrialSchedule, TRIAL_TYPES, OUTCOME_COLUMNS
 
 __author__ = 'Matheus Macedo-Lima'
 __version__ = '04/28/19'
 
 
 class Booth:
-    def __init__(self, subject_paradigm_id):
+    PIN_NAMES = ("PUFFER_PIN", "REWARD_PIN", "SWITCH_PIN", "LED_PIN")
+    # The keyword arguments a booth or protocol definition can set (see Booth_multi.booth_settings)
+    SETTINGS = ("pins", "audio_device", "audio_output", "audio_frequency", "audio_buffer", "debounce_time")
+
+    def __init__(self, subject_paradigm_id, pins=None, audio_device=None, gpio=None, clock=None, switch=None,
+                 player=None, audio_output="stream", audio_frequency=44100, audio_buffer=256, debounce_time=0.01):
+        """
+        pins overrides the default pin of any of PIN_NAMES, e.g. {"SWITCH_PIN": 22, "LED_PIN": 18}, so that
+        several booths can be wired to one Pi (see Booth_multi.py).
+        audio_device is the name of the output device for this booth's stimuli; None uses the system default.
+        audio_output, audio_frequency and audio_buffer choose the player (see Booth_audio.open_player): "stream"
+        starts stimuli within one device buffer of the peck and logs onsets as the first sample reached the device;
+        "mixer" is pygame's mixer (the only one with pygame 1.9). audio_buffer is in samples per channel (256 is
+        5.8 ms at 44100 Hz); raise it if stimuli click.
+        debounce_time (s): switch edges this soon after a press or release are bounces (see Booth_input.py).
+
+        The hardware backends default to the real ones: gpio to RPi.GPIO, clock to real time, switch to a
+        SwitchInput on SWITCH_PIN and player to the AUDIO_OUTPUT player (see Booth_audio.open_player). Booth_sim.py
+        has simulated replacements for running sessions without a Pi.
+        """
         self.subject_paradigm_id = subject_paradigm_id  # use this to describe your
 
-        GPIO.setmode(GPIO.BOARD)  # set up GPIO pin numeration to ordinal
+        self.gpio = GPIO if gpio is None else gpio
+        self.clock = SYSTEM_CLOCK if clock is None else clock
+        self.gpio.setmode(self.gpio.BOARD)  # set up GPIO pin numeration to ordinal
 
         self.TIMER = 0
 
@@ -26,11 +64,28 @@ class Booth:
         self.NULL_TIME = 6  # Wait time after a miss or correct rejection
         self.PUNISHMENT_NULL_TIME = 16  # Wait time after a punishment
         self.DELAY_TIME = 0  # Delay between end of tone and chance of response
+        self.METRICS_WINDOW = 100  # Sliding window (trials) of the online performance metrics
+        self.DEBOUNCE_TIME = debounce_time  # Switch edges this soon after a press or release are bounces
+        self.STEP_OUT_TIME = 1  # How long the bird has to stay off the perch between trials
+
+        # How often trial data files are flushed to disk (see TrialWriter). None disables that trigger
+        self.FLUSH_EVERY_ROWS = 1
+        self.FLUSH_EVERY_SECONDS = None
+        self.FSYNC = False  # also wait for every flush to reach the SD card
+        self.BINARY_STORE = True  # also keep trial outcomes in a compact <title>.trials file (see Booth_store.py)
+        self.DATABASE = None  # also keep trials in this SQLite database, e.g. "booth.db" (see Booth_database.py)
 
         # Load sound file names. They can also be set in the functions
         self.GO_SOUND = "GO.wav"
         self.NOGO_SOUND = "NOGO.wav"
         self.WN_SOUND = "GNG_WN.wav"
+        # Play scene_discrimination's stimulus folders from memory-mapped bundles rather than holding them all in
+        # memory (see Booth_bundle.py; the "stream" output only, the mixer always plays from its cache)
+        self.MAP_STIMULI = True
+        # Audio output (see Booth_audio.py)
+        self.AUDIO_OUTPUT = audio_output
+        self.AUDIO_FREQUENCY = audio_frequency
+        self.AUDIO_BUFFER = audio_buffer
 
         # Assign pins to hardware
         # self.LIGHTS_PIN_1 = 11
@@ -41,18 +96,69 @@ class Booth:
         self.SWITCH_PIN = 15
         self.LED_PIN = 16  # For visual cuing
 
+        if pins is not None:
+            for pin_name, pin in pins.items():
+                if pin_name not in self.PIN_NAMES:
+                    raise ValueError("Unknown pin " + pin_name + "; expected one of " + ", ".join(self.PIN_NAMES))
+                setattr(self, pin_name, pin)
+
         # Initiate the GPIO pins
         # GPIO.setup(self.LIGHTS_PIN_1, GPIO.OUT)
         # GPIO.output(self.LIGHTS_PIN_1, 1)
         # GPIO.setup(self.LIGHTS_PIN_2, GPIO.OUT)
         # GPIO.output(self.LIGHTS_PIN_2, 1)
-        GPIO.setup(self.PUFFER_PIN, GPIO.OUT)
-        GPIO.output(self.PUFFER_PIN, 1)
-        GPIO.setup(self.REWARD_PIN, GPIO.OUT)
-        GPIO.output(self.REWARD_PIN, 1)
-        GPIO.setup(self.SWITCH_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(self.LED_PIN, GPIO.OUT)
-        GPIO.output(self.LED_PIN, 0)
+        self.gpio.setup(self.PUFFER_PIN, self.gpio.OUT)
+        self.gpio.output(self.PUFFER_PIN, 1)
+        self.gpio.setup(self.REWARD_PIN, self.gpio.OUT)
+        self.gpio.output(self.REWARD_PIN, 1)
+        self.gpio.setup(self.SWITCH_PIN, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.gpio.setup(self.LED_PIN, self.gpio.OUT)
+        self.gpio.output(self.LED_PIN, 0)
+
+        # Outputs are pulsed with timed off-edges, so outcomes do not block watching the switch
+        self.reward_valve = Actuator(self.gpio, self.REWARD_PIN, 0, self.clock)
+        self.puffer = Actuator(self.gpio, self.PUFFER_PIN, 0, self.clock)
+        self.led = Actuator(self.gpio, self.LED_PIN, 1, self.clock)
+        self.outcome_log_started = False
+
+        # Switch edges are delivered by RPi.GPIO's event thread; prompts block on them instead of polling
+        self.switch = SwitchInput(self.gpio, self.SWITCH_PIN, debounce_time=self.DEBOUNCE_TIME, clock=self.clock) \
+            if switch is None else switch
+        self.last_peck_time = None
+        # Every debounced switch edge, whatever the paradigm is doing, is kept in <session>_switch_events.events
+        self.switch_events = SwitchEventLog(self.subject_paradigm_id + '_switch_events.events')
+        self.switch.event_log = self.switch_events
+
+        # The audio output stays open for the whole session and stimuli are played from memory
+        if player is None:
+            player = open_player(self.AUDIO_OUTPUT, audio_device, self.AUDIO_FREQUENCY, self.AUDIO_BUFFER)
+        self.player = player
+        self.onset_log_started = False
+        self.trial_event_log_started = False
+
+        self.writers = {}  # csv title -> TrialWriter, opened on first write
+        self.database = None  # TrialDatabase, opened on the first trial row if DATABASE is set
+
+        # Per-trial phase timestamps, written to <session>_timing.csv (see Booth_timing.py for the report)
+        timing_title = self.subject_paradigm_id + '_timing'
+        self.timing = TrialTimer(lambda row: self.write_csv(timing_title, row), self.clock,
+                                 write_header=lambda row: self.write_csv_header(timing_title, row))
+        # Every timed wait, with its scheduled and actual time, written to <session>_schedule.csv
+        schedule_title = self.subject_paradigm_id + '_schedule'
+        self.schedule = DeadlineScheduler(lambda row: self.write_csv(schedule_title, row), self.clock,
+                                          write_header=lambda row: self.write_csv_header(schedule_title, row))
+
+        # Running hit/false alarm rates and d' of the current go/no-go paradigm (see Booth_metrics.py)
+        self.metrics = None
+        self.rules = []
+
+        # Paradigm starts, stimulus schedules and completed trials, for resuming after a crash (see Booth_journal.py);
+        # opened by the first paradigm that journals, so other paradigms leave no journal behind
+        self.journal = None
+
+        # Operator pause/resume/abort between trials (see Booth_control.py); attached by Booth_driver.py
+        self.control = None
+        self.CONTROL_CHECK_INTERVAL = 0.5  # how long an initiating prompt waits before checking the control again
 
     """
     Now a bunch of redundant helper functions for controlling the hardware follows.
@@ -71,117 +177,419 @@ class Booth:
 
     # If visual cue is used
     def led_on(self):
-        GPIO.output(self.LED_PIN, 1)
+        self.led.on()
 
     def led_off(self):
-        GPIO.output(self.LED_PIN, 0)
+        self.led.off()
 
     def reward_on(self):
-        GPIO.output(self.REWARD_PIN, 0)
+        self.reward_valve.on()
+        self.timing.mark("valve_open")
 
     def reward_off(self):
-        GPIO.output(self.REWARD_PIN, 1)
+        self.reward_valve.off()
+        self.timing.mark("valve_close")
 
-    def apply_reward(self, duration=None):
+    def apply_reward(self, duration=None, block=True):
+        """
+        Opens the valve for duration s; it is closed by a timer. By default the switch is watched until then (see
+        wait_for_outcome); with block=False the Pulse is returned at once.
+        """
         if duration is None:
             duration = self.REWARD_TIME
-        self.reward_on()
-        time.sleep(duration)
-        self.reward_off()
+        pulse = self.reward_valve.pulse(duration)
+        self.timing.mark("valve_open", pulse.start)
+        if block:
+            self.wait_for_outcome(pulse.deadline, "reward")
+            self.timing.mark("valve_close", pulse.wait())
+            self.schedule.record("reward", pulse.deadline, pulse.off_time)
+        return pulse
 
     def apply_punishment(self, duration=None, step_out=False, apply_wn_too=False):
-        if step_out:
-            GPIO.output(self.PUFFER_PIN, 0)
+        if duration is None:
+            duration = self.PUNISHMENT_TIME
+        if step_out:  # puff until the bird hops off
+            self.puffer.on()
             self.step_out_prompt()
-            GPIO.output(self.PUFFER_PIN, 1)
-        else:
-            if duration is None:
-                duration = self.PUNISHMENT_TIME
-            GPIO.output(self.PUFFER_PIN, 0)
+            self.puffer.off()
+            if apply_wn_too:
+                self.play_sound(self.WN_SOUND)
+            return
+        # The puff lasts through the white noise and duration s after it
+        puff_end = self.clock.monotonic() + duration
         if apply_wn_too:
-            self.play_sound(self.WN_SOUND)
-            time.sleep(duration)
-            GPIO.output(self.PUFFER_PIN, 1)
+            puff_end = self.play_sound(self.WN_SOUND, block=False).expected_offset + duration
+        pulse = self.puffer.pulse(puff_end - self.clock.monotonic())
+        self.wait_for_outcome(pulse.deadline, "punishment")
+        self.schedule.record("puff", pulse.deadline, pulse.wait())
 
     def apply_sleep_punishment(self, duration=None, wn_sound=None, apply_wn_too=False):
         if duration is None:
             duration = self.PUNISHMENT_TIME
         self.led_off()
         if apply_wn_too:
-            self.play_sound(wn_sound)
-            time.sleep(duration)
+            # Lights-out time starts when the white noise ends
+            punishment_end = self.play_sound(wn_sound, block=False).expected_offset + duration
+            self.schedule.record("punishment", punishment_end, self.wait_for_outcome(punishment_end, "punishment"))
 
-    @staticmethod
-    def write_csv(title, row):
-        """This is a helper function for creating and writing data on a csv file"""
-        file = open(title + '.csv', 'a')
-        writer = csv.writer(file, delimiter=',')
-        writer.writerow(row)
-        file.close()
+    def wait_for_outcome(self, deadline, outcome):
+        """
+        Returns at the monotonic time deadline (returning the actual time), writing every peck made until then to
+        <session>_outcome_pecks.csv, so switch activity during rewards, punishments and null times is kept.
+        """
+        while True:
+            remaining = deadline - self.clock.monotonic()
+            if remaining <= 0:
+                break
+            if self.switch.is_pressed():
+                self.switch.wait_for_release(timeout=remaining)
+            elif self.switch.wait_for_press(timeout=remaining) is not None:
+                if not self.outcome_log_started:
+                    self.write_csv_header(self.subject_paradigm_id + '_outcome_pecks',
+                                          ["Paradigm"] + ["Trial_number"] + ["Outcome"] + ["Time_s"])
+                    self.outcome_log_started = True
+                self.write_csv(self.subject_paradigm_id + '_outcome_pecks',
+                               [self.timing.paradigm] + [self.timing.trial_number] + [outcome] +
+                               [self.clock.monotonic() - self.timing.session_start])
+        return self.clock.monotonic()
+
+    def csv_writer(self, title):
+        """The TrialWriter of title's csv, opened (with a binary store, for trial layouts) on first use"""
+        if title not in self.writers:
+            layout_name = layout_for_title(title)
+            store = None
+            if self.BINARY_STORE and layout_name is not None:
+                try:
+                    store = TrialStore(title, layout_name)
+                except ValueError as error:
+                    print "Not keeping a binary store: " + str(error)
+            self.writers[title] = TrialWriter(title + '.csv', flush_every_rows=self.FLUSH_EVERY_ROWS,
+                                              flush_every_seconds=self.FLUSH_EVERY_SECONDS, fsync=self.FSYNC,
+                                              store=store)
+        return self.writers[title]
+
+    def write_csv_header(self, title, header):
+        """
+        Writes header as the first row of title's csv. A csv that already has rows (a resumed session, or one run
+        again under the same id) is continued under the header it has.
+        """
+        if title not in self.writers and os.path.exists(title + '.csv') and os.path.getsize(title + '.csv'):
+            return
+        self.csv_writer(title).write(header)
+
+    def write_csv(self, title, row):
+        """
+        This is a helper function for creating and writing data on a csv file.
+        The file is kept open for the session and the row is written in the background.
+        """
+        self.csv_writer(title).write(row)
+        if self.DATABASE is not None and layout_for_title(title) is not None:
+            if self.database is None:
+                self.database = TrialDatabase(self.DATABASE)
+            self.database.write(title, row)
 
     """
     Functions for playing audio
     """
 
-    @staticmethod
-    def play_sound(sound):
-        pg.mixer.init()
-        pg.mixer.music.load(sound)  # Load go sound
-        pg.mixer.music.play()
-        while pg.mixer.music.get_busy():  # Keep on hold while playing
-            continue
-        pg.mixer.quit()
+    def play_sound(self, sound, block=True):
+        """
+        Plays sound from the session's stimulus cache and returns its Playback handle.
+        With block=False it returns at onset, and the handle's wait() blocks until the sound ends.
+        """
+        playback = self.player.play(sound, block=block)
+
+        # Log the delay between the peck that triggered the sound and its onset
+        if not self.onset_log_started:
+            self.write_csv_header(self.subject_paradigm_id + '_stimulus_onsets',
+                                  ["Stimulus"] + ["Load_time_s"] + ["Peck_to_onset_s"])
+            self.onset_log_started = True
+        if self.last_peck_time is not None:
+            peck_to_onset = self.player.last_onset - self.last_peck_time
+        else:
+            peck_to_onset = "NA"
+        self.write_csv(self.subject_paradigm_id + '_stimulus_onsets',
+                       [sound] + [self.player.last_load_time] + [peck_to_onset])
+        self.last_peck_time = None
+        return playback
+
+    def present_stimulus(self, sound, response_window="delay", delay_time=0):
+        """
+        Plays sound and returns when the response window should open, along with the number of pecks made
+        before that.
+        response_window sets when the window opens: at stimulus "onset", at its "offset", or at offset +
+        delay_time ("delay", the default).
+        """
+        presses_before = self.switch.press_count
+        playback = self.play_sound(sound, block=False)
+        self.timing.mark("load", self.player.last_loaded)
+        self.timing.mark("onset", playback.onset)
+        if response_window != "onset":
+            offset = playback.wait()
+            self.timing.mark("offset", offset)
+            if response_window == "delay":
+                self.schedule.wait(delay_time, "delay", start=offset)
+        else:
+            self.timing.mark("offset", playback.expected_offset)
+        return self.switch.press_count - presses_before
 
-    def peck_prompt(self, duration=None, step_out=False):
+    def peck_prompt(self, duration=None, step_out=False, new_press=False):
         """
         Program waits for a peck forever or for a specified duration.
         Returns response time if pecked, and None otherwise.
+        With new_press, a switch still held down (by the peck that started the trial) is not a peck: it has to be
+        let go and pressed again.
         """
         if not step_out:  # Only turn led on if this is not a step-out check
             self.led_on()  # if visual cuing is used
 
-        if duration is not None:
-            start_time = time.time()
-            current_time = 0
-            while current_time < duration:
-                if GPIO.input(self.SWITCH_PIN) == 0:
-                    return current_time
-                current_time = time.time() - start_time
-            return None
-        # If duration is not specified
-        else:
-            start_time = time.time()
-            current_time = 0
-            while True:
-                if GPIO.input(self.SWITCH_PIN) == 0:
-                    return current_time
-                time.sleep(0.001)
-                current_time = time.time() - start_time
+        released = 0
+        if new_press and self.switch.is_pressed():
+            released = self.switch.wait_for_release(duration)
+            if released is None:
+                return None
+        response_time = self.switch.wait_for_press(None if duration is None else duration - released)
+        if response_time is not None:
+            response_time += released
+            self.last_peck_time = self.clock.monotonic()
+        return response_time
+
+    def initiation_prompt(self, duration=None):
+        """
+        peck_prompt for the peck that starts a trial. With a session control attached, pauses and aborts take
+        effect here, also while waiting, so a paused bird cannot start a trial.
+        """
+        if self.control is None:
+            return self.peck_prompt(duration=duration)
+        start_time = self.clock.monotonic()
+        while True:
+            self.checkpoint()
+            remaining = self.CONTROL_CHECK_INTERVAL
+            if duration is not None:
+                remaining = min(remaining, start_time + duration - self.clock.monotonic())
+                if remaining <= 0:
+                    return None
+            if self.peck_prompt(duration=remaining) is not None:
+                return self.last_peck_time - start_time
+
+    def checkpoint(self):
+        """
+        Between trials: blocks while the session is paused from its control, and raises
+        Booth_control.SessionAborted once it has been aborted
+        """
+        if self.control is None:
+            return
+        if self.control.is_paused():
+            self.led_off()
+        self.control.checkpoint()
 
     def switch_test(self):
         """This function is for troubleshooting the functionality of the switch"""
         while True:
-            print "Unstuck"
-            self.peck_prompt()
-            stuck = self.peck_prompt(duration=0.05)
-            if stuck is not None:
-                print "Stuck?"
-            self.step_out_prompt()
+            self.initiation_prompt()
+            while self.switch.wait_for_release(timeout=5) is None:
+                print "Stuck? Pressed for %.0f s" % self.switch.tracker.on_for()
+            print self.switch.tracker.report()
+            for warning in self.switch.tracker.warnings():
+                print warning
 
     def step_out_prompt(self):
-        # Bird has to hop off the perch
-        step_out_flag = 0
-        time_out = 1
-        while step_out_flag is not None:
-            step_out_flag = self.peck_prompt(duration=time_out, step_out=True)
-            if step_out_flag is not None:
-                self.led_off()
+        # Bird has to hop off the perch and stay off for STEP_OUT_TIME seconds. Time it has already spent off
+        # counts, so a bird that left during the outcome is not held up
+        while True:
+            remaining = self.STEP_OUT_TIME - self.switch.tracker.off_for()
+            if remaining <= 0 or self.switch.wait_for_press(timeout=remaining) is None:
+                break
+            self.led_off()
+            self.switch.wait_for_release()
+        self.timing.mark("step_out")
+
+    def close(self):
+        """
+        Switches every output off, releases the audio device and the switch and writes out pending data at the end
+        of a session
+        """
+        for actuator in (self.reward_valve, self.puffer, self.led):
+            actuator.close()
+        self.player.close()
+        for warning in self.switch.tracker.warnings():
+            print warning
+        self.switch.close()
+        self.switch_events.close()
+        if self.journal is not None:
+            self.journal.close()
+        for writer in self.writers.values():
+            writer.close()
+        if self.database is not None:
+            self.database.close()
+
+    """
+    Online performance metrics
+    """
+
+    def start_journal(self, paradigm, arguments, resume=False):
+        """
+        Journals the start of paradigm, called with arguments (its locals() on entry), and returns None.
+        With resume, returns the Booth_journal.ResumeState of the paradigm's unfinished run instead, if the journal
+        has one.
+        """
+        if self.journal is None:
+            self.journal = SessionJournal(self.subject_paradigm_id + '.journal')
+        if resume:
+            resume_state = self.journal.unfinished(paradigm)
+            if resume_state is not None:
+                print "Resuming " + paradigm + " after " + str(len(resume_state.trials())) + " trials"
+                return resume_state
+            print "No unfinished " + paradigm + " to resume; starting it anew"
+        self.journal.begin(paradigm, dict((name, value) for name, value in arguments.items()
+                                          if name not in ("self", "resume")))
+        return None
+
+    def end_journal(self, result=None):
+        """Marks the paradigm's run as finished and returns result"""
+        self.journal.end(result)
+        return result
+
+    def record_outcome(self, phase, trial_number, time_start, outcome=None, snr=None):
+        """Counts a trial's outcome in the online metrics and journals the trial as done"""
+        if outcome is not None:
+            self.metrics.update(outcome, snr)
+        self.journal.trial(phase, trial_number, self.clock.monotonic() - time_start, outcome, snr)
+
+    def start_metrics(self, rules=None):
+        """rules are Booth_metrics.Rules (or their keyword dicts) checked after every trial"""
+        self.rules = make_rules(rules)
+        self.metrics = PerformanceMetrics(windows=set([self.METRICS_WINDOW] +
+                                                      [rule.window for rule in self.rules if rule.window is not None]))
+
+    def check_rules(self):
+        """Returns the action of the first rule met by the metrics so far, or None to carry on"""
+        for rule in self.rules:
+            if rule.check(self.metrics):
+                print "Rule met: " + str(rule) + "; " + \
+                      ("ending the session" if rule.action == "stop" else "advancing to the next stage")
+                print self.metrics.report()
+                return rule.action
+        return None
 
     def apply_null_time(self, duration=None):
         if duration is None:
             duration = self.NULL_TIME
         self.led_off()
-        time.sleep(duration)
+        null_end = self.clock.monotonic() + duration
+        self.schedule.record("null", null_end, self.wait_for_outcome(null_end, "null"))
+
+    """
+    Trial engine
+    """
+
+    def trial_schedule(self, phase, resume_state, time_start, go_stimuli, nogo_stimuli, probability, **settings):
+        """
+        The Booth_trials.TrialSchedule of phase: the journaled one, rebuilt, when resuming an unfinished run that has
+        one, and otherwise a new one drawn with settings and journaled
+        """
+        record = None if resume_state is None else resume_state.last_schedule(phase)
+        if record is not None:
+            return TrialSchedule(**record["settings"])
+        schedule = TrialSchedule(go_stimuli, nogo_stimuli, probability, **settings)
+        self.journal.schedule(phase, self.clock.monotonic() - time_start, settings=schedule.settings())
+        return schedule
+
+    def go_nogo_row(self, trial_number, trial, stimulus, response_time, outcome, trial_time):
+        return [trial_number] + [TRIAL_TYPES[trial.go]] + ["NA" if response_time is None else response_time] + \
+               OUTCOME_COLUMNS[outcome] + [trial_time] + [stimulus]
+
+    def classical_row(self, trial_number, trial, stimulus, response_time, outcome, trial_time):
+        return [trial_number] + [TRIAL_TYPES[trial.go]] + [trial_time] + [stimulus]
+
+    def write_trial_events(self, phase, trial_number, stimulus_pecks, first_event):
+        """
+        Logs, in <session>_trial_events.csv, the pecks a trial's stimulus got before its response window opened and
+        the index of its first switch event (see Booth_events.py), keeping the paradigm csv layouts as they are
+        """
+        if not self.trial_event_log_started:
+            self.write_csv_header(self.subject_paradigm_id + '_trial_events',
+                                  ["Phase"] + ["Trial_number"] + ["Stimulus_pecks"] + ["First_event"])
+            self.trial_event_log_started = True
+        self.write_csv(self.subject_paradigm_id + '_trial_events',
+                       [phase] + [trial_number] + [stimulus_pecks] + [first_event])
+
+    def run_trials(self, phase, schedule, csv_name, row, time_start, first_trial=1, trial_cap=None, duration=None,
+                   initiated=True, response_window="delay", delay_time=0, max_response_time=None, wn_sound=None,
+                   snrs=None, paradigm=None):
+        """
+        The trial loop of every go/no-go paradigm. Runs trials first_trial, first_trial + 1, ... of schedule (a
+        Booth_trials.TrialSchedule), with their stimulus and outcome times, until trial_cap trials or duration s
+        from time_start.
+        Initiated trials start with a peck, then the stimulus and the response prompt: a peck after Go is rewarded
+        (hit), a peck after No-go punished (false alarm) and no peck followed by the null time. Otherwise (classical
+        conditioning) each trial starts after its ITI, and Go stimuli are followed by the reward and No-go stimuli by
+        a wait as long, with no response.
+        row(trial_number, trial, stimulus, response_time, outcome, trial_time) gives a trial's row of csv_name; its
+        stimulus pecks and first switch event go to write_trial_events. Trials are journaled under phase, with their
+        stimulus's SNR from snrs, and timed under paradigm (phase by default).
+        Returns the action of the rule that ended the trials, or None.
+        """
+        if paradigm is None:
+            paradigm = phase
+        trial_number = first_trial
+        current_time = self.clock.monotonic() - time_start
+        while (duration is None or current_time <= duration) and (trial_cap is None or trial_number <= trial_cap):
+            trial = schedule.trial(trial_number)
+            stimulus = schedule.stimulus(trial)
+            first_event = self.switch_events.next_index  # this trial's switch events start here
+            if initiated:
+                # Birds initiate all trials!
+                start_peck = self.initiation_prompt(duration=None if duration is None else duration - current_time)
+                if start_peck is None:
+                    current_time = self.clock.monotonic() - time_start
+                    continue
+                self.timing.start_trial(paradigm, trial_number, self.last_peck_time)
+                stimulus_pecks = self.present_stimulus(stimulus, response_window, delay_time)
+                t0 = self.clock.monotonic()  # Registers current time
+                # With an onset window the bird can still be on the initiating peck
+                response_time = self.peck_prompt(duration=max_response_time, new_press=response_window == "onset")
+                if response_time is not None:
+                    self.timing.mark("response", self.last_peck_time)
+                    outcome = "hit" if trial.go else "false_alarm"
+                else:
+                    outcome = "miss" if trial.go else "reject"
+            else:
+                self.checkpoint()
+                self.schedule.wait(trial.iti, "iti")
+                self.timing.start_trial(paradigm, trial_number)
+                stimulus_pecks = self.present_stimulus(stimulus, response_window="offset")
+                t0 = self.clock.monotonic()
+                response_time = outcome = None
+
+            self.write_csv(csv_name, row(trial_number, trial, stimulus, response_time, outcome, t0 - time_start))
+            self.write_trial_events(phase, trial_number, stimulus_pecks, first_event)
+            self.record_outcome(phase, trial_number, time_start, outcome, None if snrs is None else snrs[stimulus])
+            if outcome == "hit" or (outcome is None and trial.go):  # Hit! :)
+                self.apply_reward(duration=trial.reward_time)
+            elif outcome == "false_alarm":  # False alarm :(
+                # self.apply_punishment()
+                self.apply_sleep_punishment(trial.punishment_null_time, wn_sound=wn_sound,
+                                            apply_wn_too=True)  # Some birds might feel "demotivated" with harsh punishment...
+            elif outcome is None:
+                # just apply a sleep timer for the duration of the reward time
+                self.schedule.wait(trial.reward_time, "reward_time")
+            else:  # Miss :( or correct rejection! :)
+                self.apply_null_time(duration=trial.null_time)
+            trial_number += 1
+            if trial_cap is None or trial_number <= trial_cap:  # page a mapped next stimulus in meanwhile
+                self.player.prefetch(schedule.stimulus(schedule.trial(trial_number)))
+
+            if initiated:
+                # Bird has to hop off the perch to reactivate switch
+                self.step_out_prompt()
+            self.timing.end_trial()
+            if initiated:
+                action = self.check_rules()
+                if action is not None:
+                    return action
+            current_time = self.clock.monotonic() - time_start
+        return None
 
     """
     Paradigms
@@ -205,16 +613,24 @@ class Booth:
             reward_time = self.REWARD_TIME
 
         trial = 1
-        self.write_csv(self.subject_paradigm_id + '_introduction', ["Number_of_trials"] + ["Time.from_start"])
+        self.write_csv_header(self.subject_paradigm_id + '_introduction',
+                              ["Number_of_trials"] + ["Time.from_start"])
         self.reward_off()  # just to make sure the reward is not on at the beginning of the paradigm
-        t0 = time.time()
+        t0 = self.clock.monotonic()
         current_time = 0
+        # Each trial is scheduled from the previous one's deadline, so wait overheads do not add up over the session
+        deadline = t0
         while current_time < duration:
+            self.checkpoint()
             # self.led_on()
-            time.sleep(np.random.uniform(iti_range[0], iti_range[1]))
+            deadline += np.random.uniform(iti_range[0], iti_range[1])
+            self.schedule.wait_until(deadline, "iti")
+            self.timing.start_trial("introduction", trial)
             self.apply_reward(reward_time)
-            current_time = time.time() - t0
+            deadline += reward_time
+            current_time = self.clock.monotonic() - t0
             self.write_csv(self.subject_paradigm_id + '_introduction', [trial] + [current_time])
+            self.timing.end_trial()
             trial += 1
             # self.led_off()
 
@@ -231,22 +647,24 @@ class Booth:
         if reward_time is None:
             reward_time = self.REWARD_TIME
 
-        self.write_csv(self.subject_paradigm_id + '_shaping', ["Trial_number"] + ["Time_s"])
+        self.write_csv_header(self.subject_paradigm_id + '_shaping', ["Trial_number"] + ["Time_s"])
 
         self.reward_off()  # just to make sure the reward is not on at the beginning of the paradigm
 
         pecks = 0
-        t_start = time.time()
+        t_start = self.clock.monotonic()
         current_time = 0
         while current_time <= duration:  # "IIIIIIIIIt's TIME!"(Buffer, Bruce)
-            start_peck = self.peck_prompt(duration=(duration - current_time))  # Birds initiate all trials!
-            current_time = time.time() - t_start
+            start_peck = self.initiation_prompt(duration=(duration - current_time))  # Birds initiate all trials!
+            current_time = self.clock.monotonic() - t_start
             if start_peck is not None:
+                self.timing.start_trial("shaping", pecks + 1, self.last_peck_time)
                 self.apply_reward(reward_time)
                 pecks += 1
                 self.write_csv(self.subject_paradigm_id + '_shaping', [pecks] + [current_time])
                 # Bird has to hop off the perch to reenable switch
                 self.step_out_prompt()
+                self.timing.end_trial()
                 self.apply_null_time()
         self.led_off()
 
@@ -257,21 +675,23 @@ class Booth:
         but there is a minimum interval of 2 s (rough duration of a song).
         It is used to encourage more pecking
         """
-        t0 = time.time()
-        self.write_csv(self.subject_paradigm_id + '_shaping_two_pecks', ["Trial_number"] + ["Time_first_s"] +
-                       ["Time_second_s"])
+        t0 = self.clock.monotonic()
+        self.write_csv_header(self.subject_paradigm_id + '_shaping_two_pecks',
+                              ["Trial_number"] + ["Time_first_s"] + ["Time_second_s"])
 
         self.reward_off()  # just to make sure the reward is not on at the beginning of the paradigm
 
         pecks = 0
 
         while True:  # "IIIIIIIIIt's TIME!"(Buffer, Bruce)
-            self.peck_prompt()  # Birds initiate all trials!
-            time_first = time.time() - t0
+            self.initiation_prompt()  # Birds initiate all trials!
+            self.timing.start_trial("shaping_two_pecks", pecks + 2, self.last_peck_time)
+            time_first = self.clock.monotonic() - t0
             pecks += 1
-            time.sleep(2)  # duration of a song
+            self.schedule.wait(2, "song", start=self.last_peck_time)  # duration of a song
             self.peck_prompt()
-            time_second = time.time() - t0
+            self.timing.mark("response", self.last_peck_time)
+            time_second = self.clock.monotonic() - t0
             pecks += 1
             if pecks % 2 == 0:
                 self.apply_reward(self.REWARD_TIME)
@@ -279,6 +699,7 @@ class Booth:
 
             # Bird has to hop off the perch to reenable switch
             self.step_out_prompt()
+            self.timing.end_trial()
             self.apply_null_time()
 
     def shaping_timed(self, response_time=None):
@@ -292,38 +713,44 @@ class Booth:
         if response_time is None:
             response_time = self.RESPONSE_TIME
 
-        t0 = time.time()
-        self.write_csv(self.subject_paradigm_id + '_shaping_timed',
-                       ["Trial_number"] + ["Time_first_s"] + ["Time_second_s"] + ["Reward"])
+        t0 = self.clock.monotonic()
+        self.write_csv_header(self.subject_paradigm_id + '_shaping_timed',
+                              ["Trial_number"] + ["Time_first_s"] + ["Time_second_s"] + ["Reward"])
 
         self.reward_off()  # just to make sure the reward is not on at the beginning of the paradigm
 
         pecks = 0
 
         while True:  # "IIIIIIIIIt's TIME!"(Buffer, Bruce)
-            self.peck_prompt()  # Birds initiate all trials!
-            time_first = time.time() - t0
+            self.initiation_prompt()  # Birds initiate all trials!
+            self.timing.start_trial("shaping_timed", pecks + 1, self.last_peck_time)
+            time_first = self.clock.monotonic() - t0
             pecks += 1
 
-            time.sleep(2)  # duration of a song
+            self.schedule.wait(2, "song", start=self.last_peck_time)  # duration of a song
 
             second_peck = self.peck_prompt(duration=response_time)  # prompt for a timed second peck
 
             if second_peck is not None:
-                time_second = time.time() - t0
+                self.timing.mark("response", self.last_peck_time)
+                time_second = self.clock.monotonic() - t0
                 pecks += 1
+                self.timing.trial_number = pecks  # rows are numbered by the second peck
                 self.write_csv(self.subject_paradigm_id + '_shaping_timed', [pecks] + [time_first] + [time_second] +
                                ["YES"])
                 self.apply_reward(self.REWARD_TIME)
 
                 # Bird has to hop off the perch to reenable switch
                 self.step_out_prompt()
+                self.timing.end_trial()
                 self.apply_null_time()
             else:
                 self.write_csv(self.subject_paradigm_id + '_shaping_timed', [pecks] + [time_first] + ["NA"] + ["NO"])
+                self.timing.end_trial()
 
     def go_nogo(self, go_sound=None, nogo_sound=None, wn_sound=None, probability=0.5, duration=39600,
-                max_response_time=None, reward_time=None, punishment_time=None, null_time=None, delay_time=None):
+                max_response_time=None, reward_time=None, null_time=None, delay_time=None, response_window="delay",
+                rules=None, block_size=None, max_run=None, punishment_null_time=None, resume=False):
         """
         Go/No-go paradigm
         Akin Gess et al., 2011
@@ -334,11 +761,18 @@ class Booth:
         If Go sound plays -> Peck -> reward
                           -> No Peck -> Null time
 
-        If No-go sound plays -> Peck -> punishment
+        If No-go sound plays -> Peck -> punishment (punishment_null_time s of lights out)
                              -> No peck -> Null time
+
+        Each trial is Go with probability; with block_size, every block of block_size trials has exactly
+        probability * block_size Go trials instead. max_run caps trials of the same type in a row.
+        rules (see Booth_metrics.Rule) can end the session early; the action of the rule that ended it is returned.
+        resume continues the session's unfinished go_nogo from the journal (see Booth_journal.py).
         """
-        self.write_csv(self.subject_paradigm_id + '_go_nogo', ["Trial_number"] + ["Trial_type"] + ["Response_time_s"] +
-                       ["Hit"] + ["Miss"] + ["Reject"] + ["False_alarm"] + ["Time_from_start"] + ["Stimulus"])
+        resume_state = self.start_journal("go_nogo", locals(), resume)
+        self.write_csv_header(self.subject_paradigm_id + '_go_nogo',
+                              ["Trial_number"] + ["Trial_type"] + ["Response_time_s"] + ["Hit"] + ["Miss"] +
+                              ["Reject"] + ["False_alarm"] + ["Time_from_start"] + ["Stimulus"])
 
         # Set defaults if not specified
         if go_sound is None:
@@ -349,8 +783,8 @@ class Booth:
             max_response_time = self.RESPONSE_TIME
         if reward_time is None:
             reward_time = self.REWARD_TIME
-        if punishment_time is None:
-            punishment_time = self.PUNISHMENT_TIME
+        if punishment_null_time is None:
+            punishment_null_time = self.PUNISHMENT_NULL_TIME
         if null_time is None:
             null_time = self.NULL_TIME
         if delay_time is None:
@@ -358,110 +792,54 @@ class Booth:
         if wn_sound is None:
             wn_sound = self.WN_SOUND
 
-        # Flags
-        go_trial = False
-        nogo_trial = False
-
-        trial_number = 1  # Trial counter
-
+        self.player.preload([go_sound, nogo_sound, wn_sound])
+        self.start_metrics(rules)
         self.reward_off()  # just to make sure the reward is not on at the beginning of the paradigm
 
-        """
-        This is the main loop
-        """
-        curr_stimulus = ""
-        time_start = time.time()
-        current_time = 0
-        while current_time <= duration:  # "IIIIIIIIIt's TIME!"(Buffer, Bruce)
-            # Birds initiate all trials!
-            start_peck = self.peck_prompt(duration=(duration - current_time))  # Birds initiate all trials!
-
-            if start_peck is not None:
-                # Choose Go or No-go song depending on the probability
-                if np.random.binomial(1, probability) == 1:
-                    self.play_sound(go_sound)
-                    curr_stimulus = go_sound
-                    go_trial = True
-
-                else:
-                    self.play_sound(nogo_sound)
-                    curr_stimulus = nogo_sound
-                    nogo_trial = True
-
-                time.sleep(delay_time)
-
-                if go_trial:
-                    t0 = time.time()  # Registers current time
-                    response_time = self.peck_prompt(duration=max_response_time)
-                    if response_time is not None:  # Hit! :)
-                        self.write_csv(self.subject_paradigm_id + '_go_nogo',
-                                       [trial_number] + ["GO"] + [response_time] + [1] + [0] * 3 +
-                                       [t0 - time_start] + [curr_stimulus])
-                        self.apply_reward(duration=reward_time)
-                    else:  # Miss :(
-                        self.write_csv(self.subject_paradigm_id + '_go_nogo',
-                                       [trial_number] + ["GO"] + ["NA"] + [0] + [1] + [0] * 2 +
-                                       [t0 - time_start] + [curr_stimulus])
-                        self.apply_null_time(duration=null_time)
-                    go_trial = False
-
-                if nogo_trial:
-                    t0 = time.time()
-                    response_time = self.peck_prompt(duration=max_response_time)
-                    if response_time is not None:  # False alarm :(
-                        self.write_csv(self.subject_paradigm_id + '_go_nogo',
-                                       [trial_number] + ["NOGO"] + [response_time] + [0] * 3 + [1] +
-                                       [t0 - time_start] + [curr_stimulus])
-                        # self.apply_punishment()
-                        self.apply_sleep_punishment(16, wn_sound=wn_sound,
-                                                    apply_wn_too=True)  # Some birds might feel "demotivated" with harsh punishment...
-                    else:  # Correct rejection! :)
-                        self.write_csv(self.subject_paradigm_id + '_go_nogo',
-                                       [trial_number] + ["NOGO"] + ["NA"] + [0] * 2 + [1] + [0] +
-                                       [t0 - time_start] + [curr_stimulus])
-                        self.apply_null_time(duration=null_time)
-                    nogo_trial = False
-                trial_number += 1
-                # Bird has to hop off the perch to reactivate switch
-                self.step_out_prompt()
-
-            current_time = time.time() - time_start
+        time_start = self.clock.monotonic()
+        first_trial = 1
+        if resume_state is not None:
+            first_trial = resume_state.next_trial("go_nogo")
+            time_start -= resume_state.elapsed()  # the session time already run counts towards duration
+            resume_state.replay(self.metrics)
+        schedule = self.trial_schedule("go_nogo", resume_state, time_start, [go_sound], [nogo_sound], probability,
+                                       block_size=block_size, max_run=max_run, reward_time=reward_time,
+                                       punishment_null_time=punishment_null_time, null_time=null_time)
+
+        action = self.run_trials("go_nogo", schedule, self.subject_paradigm_id + '_go_nogo', self.go_nogo_row,
+                                 time_start, first_trial=first_trial, duration=duration,
+                                 response_window=response_window, delay_time=delay_time,
+                                 max_response_time=max_response_time, wn_sound=wn_sound)
+        return self.end_journal(action)
 
     def scene_discrimination(self, go_path, nogo_path, wn_sound=None, block_size=60,
                              probability=0.5, duration=14400,
-                             max_response_time=None, reward_time=None, punishment_time=None, null_time=None,
-                             delay_time=None):
+                             max_response_time=None, reward_time=None, null_time=None, delay_time=None,
+                             response_window="delay", rules=None, max_run=None, punishment_null_time=None,
+                             resume=False):
         """
         Modified from Schneider and Woolley, 2013. Neuron
-        Stimuli of different SNRs/intensities are presorted as a block. Once the block finishes, a new block is
-        sorted.
+        Stimuli of different SNRs/intensities are presorted as a block: probability * block_size Go trials spread
+        evenly over the Go files, and the rest over the No-go files. Once the block finishes, a new block is sorted.
+        max_run caps trials of the same type in a row.
+        rules (see Booth_metrics.Rule) can end the session early; the action of the rule that ended it is returned.
+        resume continues the session's unfinished scene_discrimination from the journal (see Booth_journal.py),
+        in the middle of its stimulus block.
         """
-
-        def sort_stimulus_block(go_path, nogo_path, block_size):
-            go_files = glob(go_path + r'/*.wav')  # there are 6 files in each path
-            nogo_files = glob(nogo_path + r'/*.wav')
-
-            rep_go_files = np.repeat(go_files, (block_size / 2) / len(go_files))
-            rep_nogo_files = np.repeat(nogo_files, (block_size / 2) / len(nogo_files))
-
-            ordered_concat = np.append(rep_go_files, rep_nogo_files)
-
-            concat_block_indices = np.arange(0, len(ordered_concat))
-            np.random.shuffle(concat_block_indices)
-            return ordered_concat, concat_block_indices  # indices higher than block_size/2 are nogo
+        resume_state = self.start_journal("scene_discrimination", locals(), resume)
 
         file_identifier = self.subject_paradigm_id + '_scene'
-        self.write_csv(file_identifier, ["Trial_number"] + ["Trial_type"] + ["Sound_file"] + ["Trial SNR/dB"]
-                       + ["Response_time_s"] +
-                       ["Hit"] + ["Miss"] + ["Reject"] + ["False_alarm"] + ["Time_from_start"])
+        self.write_csv_header(file_identifier, ["Trial_number"] + ["Trial_type"] + ["Sound_file"] + ["Trial SNR/dB"]
+                              + ["Response_time_s"] +
+                              ["Hit"] + ["Miss"] + ["Reject"] + ["False_alarm"] + ["Time_from_start"])
 
         # Set defaults if not specified
         if max_response_time is None:
             max_response_time = self.RESPONSE_TIME
         if reward_time is None:
             reward_time = self.REWARD_TIME
-        if punishment_time is None:
-            punishment_time = self.PUNISHMENT_TIME
+        if punishment_null_time is None:
+            punishment_null_time = self.PUNISHMENT_NULL_TIME
         if null_time is None:
             null_time = self.NULL_TIME
         if delay_time is None:
@@ -469,135 +847,77 @@ class Booth:
         if wn_sound is None:
             wn_sound = self.WN_SOUND
 
-        # Flags
-        go_trial = False
-        nogo_trial = False
-
-        trial_number = 1  # Trial counter
-        block_counter = 1  # keep track of how many blocks of sounds needed to be preshuffled
-        block_index = 0
+        # The folders are listed and their file names parsed once; trials only look stimuli up in the manifests
+        go_manifest = StimulusManifest(go_path)  # there are 6 files in each path
+        nogo_manifest = StimulusManifest(nogo_path)
+        stimuli = dict(go_manifest.by_path)
+        stimuli.update(nogo_manifest.by_path)
+        if self.MAP_STIMULI:
+            unmapped = self.player.map_folder(go_manifest) + self.player.map_folder(nogo_manifest)
+            memory = resident_memory()
+            print "Mapped %.1f MiB of stimuli%s" % (self.player.mapped_bytes() / 2.0 ** 20, "" if memory is None else
+                                                  "; resident memory %.1f MiB" % (memory / 2.0 ** 20))
+            self.player.preload(unmapped + [wn_sound])
+        else:
+            self.player.preload(go_manifest.paths() + nogo_manifest.paths() + [wn_sound])
+        self.start_metrics(rules)
         self.reward_off()  # just to make sure the reward is not on at the beginning of the paradigm
 
-        """
-        This is the main loop
-        """
-        time_start = time.time()
-        current_time = 0
-        while current_time <= duration:  # "IIIIIIIIIt's TIME!"(Buffer, Bruce)
-
-            curr_block, shuffled_indices = sort_stimulus_block(go_path, nogo_path, block_size)
-            block_index = 0
-            while trial_number < len(curr_block) * block_counter:
-                # Birds initiate all trials!
-                start_peck = self.peck_prompt(duration=(duration - current_time))  # Birds initiate all trials!
-
-                if start_peck is not None:
-                    # Play cur_sound in the pre shuffled list based on the trial number
-                    cur_sound_file = curr_block[shuffled_indices[block_index]]
-                    cur_short_sound_file_name = re.split("/", cur_sound_file)[-1]
-                    snr_value = int(re.findall(r'-?\d+', re.split("\)", cur_short_sound_file_name)[1])[0])
-
-                    self.play_sound(cur_sound_file)
-                    if shuffled_indices[block_index] < block_size / 2:
-                        go_trial = True
-                    else:
-                        nogo_trial = True
-
-                    time.sleep(delay_time)
-
-                    if go_trial:
-                        t0 = time.time()  # Registers current time
-                        response_time = self.peck_prompt(duration=max_response_time)
-                        if response_time is not None:  # Hit! :)
-                            # ["Trial_number"] + ["Trial_type"] + ["Sound_file"] + ["Trial SNR/dB"]
-                            # + ["Response_time_s"] +
-                            # ["Hit"] + ["Miss"] + ["Reject"] + ["False_alarm"] + ["Time_from_start"]
-
-                            self.write_csv(file_identifier,
-                                           [trial_number] + ["GO"] + [cur_short_sound_file_name] + [snr_value] +
-                                           [response_time] +
-                                           [1] + [0] * 3 +  # 1, 0, 0, 0
-                                           [t0 - time_start])
-                            self.apply_reward(duration=reward_time)
-                        else:  # Miss :(
-                            self.write_csv(file_identifier,
-                                           [trial_number] + ["GO"] + [cur_short_sound_file_name] + [snr_value]
-                                           + ["NA"] +
-                                           [0] + [1] + [0] * 2 +
-                                           [t0 - time_start])
-                            self.apply_null_time(duration=null_time)
-                        go_trial = False
-
-                    if nogo_trial:
-                        t0 = time.time()
-                        response_time = self.peck_prompt(duration=max_response_time)
-                        if response_time is not None:  # False alarm :(
-                            self.write_csv(file_identifier,
-                                           [trial_number] + ["NOGO"] + [cur_short_sound_file_name] + [snr_value] +
-                                           [response_time] +
-                                           [0] * 3 + [1] +
-                                           [t0 - time_start])
-                            # self.apply_punishment()
-                            self.apply_sleep_punishment(16, wn_sound=wn_sound,
-                                                        apply_wn_too=True)  # Some birds might feel "demotivated" with harsh punishment...
-                        else:  # Correct rejection! :)
-                            self.write_csv(file_identifier,
-                                           [trial_number] + ["NOGO"] + [cur_short_sound_file_name] + [snr_value] +
-                                           ["NA"] +
-                                           [0] * 2 + [1] + [0] +
-                                           [t0 - time_start])
-                            self.apply_null_time(duration=null_time)
-                        nogo_trial = False
-                    trial_number += 1
-                    block_index += 1
-                    # Bird has to hop off the perch to reactivate switch
-                    self.step_out_prompt()
-
-                current_time = time.time() - time_start
-                if current_time > duration:
-                    break
-            block_counter += 1
+        def scene_row(trial_number, trial, stimulus, response_time, outcome, trial_time):
+            return [trial_number] + [TRIAL_TYPES[trial.go]] + [stimuli[stimulus].short_name] + \
+                   [stimuli[stimulus].snr] + ["NA" if response_time is None else response_time] + \
+                   OUTCOME_COLUMNS[outcome] + [trial_time]
+
+        time_start = self.clock.monotonic()
+        first_trial = 1
+        if resume_state is not None:
+            first_trial = resume_state.next_trial("scene")
+            time_start -= resume_state.elapsed()  # the session time already run counts towards duration
+            resume_state.replay(self.metrics)
+        schedule = self.trial_schedule("scene", resume_state, time_start, go_manifest.paths(), nogo_manifest.paths(),
+                                       probability, block_size=block_size, max_run=max_run, reward_time=reward_time,
+                                       punishment_null_time=punishment_null_time, null_time=null_time)
+
+        action = self.run_trials("scene", schedule, file_identifier, scene_row, time_start,
+                                 first_trial=first_trial, duration=duration, response_window=response_window,
+                                 delay_time=delay_time, max_response_time=max_response_time, wn_sound=wn_sound,
+                                 snrs=dict((path, stimulus.snr) for path, stimulus in stimuli.items()),
+                                 paradigm="scene_discrimination")
+        return self.end_journal(action)
 
     def classical_to_operant_conditioning(self, go_sound, nogo_sound, wn_sound,
                                           classical_probability, operant_probability, iti_range=(30, 60),
                                           classical_conditioning_trial_cap=30, operant_conditioning_trial_cap=100,
                                           max_trial_duration=14400, max_response_time=None, reward_time=None,
-                                          punishment_null_time=None, null_time=None, delay_time=None):
+                                          punishment_null_time=None, null_time=None, delay_time=None,
+                                          response_window="delay", rules=None, max_run=None, resume=False):
         """
         Train with classical conditioning (preexposure), test with operant conditioning
+        Each phase is presorted so that animals are exposed to EXACTLY probability * trial cap Go trials, e.g. at
+        50% probability, in 100 trials, animals will get exactly 50 GOs, in pseudorandom order. max_run caps trials
+        of the same type in a row. max_trial_duration bounds both phases together.
+        rules (see Booth_metrics.Rule) can end the operant phase early; the action of the rule that ended it is
+        returned.
+        resume continues the session's unfinished run from the journal (see Booth_journal.py), in whichever phase it
+        was, with the same presorted stimulus orders.
         """
-        def shuffle_stimuli(trial_cap, go_probability):
-            """
-            This function preshuffles go/no-go stimuli order in order to assert that the number
-                    of stimuli type corresponds to probability * trial_cap.
-                    e.g. at 50% probability, in 100 trials, animals will get exactly 50 GOs, in pseudorandom order
-            """
-            go_repetitions_n = go_probability*trial_cap
-            nogo_repetitions_n = trial_cap - go_repetitions_n
-
-            rep_go_files = np.repeat('go', go_repetitions_n)
-            rep_nogo_files = np.repeat('nogo', nogo_repetitions_n)
-
-            ordered_concat = np.append(rep_go_files, rep_nogo_files)
-
-            shuffled_indices = np.arange(0, len(ordered_concat))
-            np.random.shuffle(shuffled_indices)
-            return ordered_concat, shuffled_indices  # indices higher than block_size/2 are nogo
+        resume_state = self.start_journal("classical_to_operant_conditioning", locals(), resume)
 
         classical_conditioning_csv_name = self.subject_paradigm_id + \
-                                          '_go' + go_sound[:-4] + \
-                                          '_nogo' + nogo_sound[:-4] + \
+                                          '_go' + spec_label(go_sound) + \
+                                          '_nogo' + spec_label(nogo_sound) + \
                                           '_prob' + str(classical_probability * 100) + \
                                           '_classical_conditioning'
-        self.write_csv(classical_conditioning_csv_name, ["Trial_number"] + ["Trial_type"] +
-                       ["Time_from_start"] + ["Stimulus"])
+        self.write_csv_header(classical_conditioning_csv_name, ["Trial_number"] + ["Trial_type"] +
+                              ["Time_from_start"] + ["Stimulus"])
         operant_conditioning_csv_name = self.subject_paradigm_id + \
-                                        '_go' + go_sound[:-4] + \
-                                        '_nogo' + nogo_sound[:-4] + \
+                                        '_go' + spec_label(go_sound) + \
+                                        '_nogo' + spec_label(nogo_sound) + \
                                         '_prob' + str(operant_probability * 100) + \
                                         '_operant_conditioning'
-        self.write_csv(operant_conditioning_csv_name, ["Trial_number"] + ["Trial_type"] + ["Response_time_s"] +
-                       ["Hit"] + ["Miss"] + ["Reject"] + ["False_alarm"] + ["Time_from_start"] + ["Stimulus"])
+        self.write_csv_header(operant_conditioning_csv_name,
+                              ["Trial_number"] + ["Trial_type"] + ["Response_time_s"] + ["Hit"] + ["Miss"] +
+                              ["Reject"] + ["False_alarm"] + ["Time_from_start"] + ["Stimulus"])
 
         # Set defaults if not specified
         if go_sound is None:
@@ -619,129 +939,43 @@ class Booth:
         if iti_range is None:
             iti_range = self.ITI_RANGE
 
-        # Flags
-        go_trial = False
-        nogo_trial = False
-
-        trial_idx = 0  # Trial counter
-
-        # I'm presorting the trial counts so that animals are exposed to EXACTLY probability * trial count
-        # For example, at 50% probability, in 100 trials, animals will get exactly 50 GOs, in pseudorandom order
-        classical_ordered_concat, classical_shuffled_indices = \
-            shuffle_stimuli(classical_conditioning_trial_cap, classical_probability)
-
+        self.player.preload([go_sound, nogo_sound, wn_sound])
+        self.start_metrics(rules)
         self.reward_off()  # just to make sure the reward is not on at the beginning of the paradigm
 
         """
-        This is the main classical conditioning loop
+        Classical conditioning: a stimulus after every ITI; Go stimuli are followed by reward and No-go stimuli by the
+        same wait
         """
-        time_start = time.time()
-        while trial_idx < classical_conditioning_trial_cap:  # "IIIIIIIIIt's TIME!"(Buffer, Bruce)
-            time.sleep(np.random.uniform(iti_range[0], iti_range[1]))
-            # Choose Go or No-go song depending on the probability
-            if classical_ordered_concat[classical_shuffled_indices[trial_idx]] == 'go':
-                self.play_sound(go_sound)
-                curr_stimulus = go_sound
-                go_trial = True
-
-            else:
-                self.play_sound(nogo_sound)
-                curr_stimulus = nogo_sound
-                nogo_trial = True
-
-            if go_trial:
-                t0 = time.time()  # Registers current time
-                self.write_csv(classical_conditioning_csv_name,
-                               [trial_idx + 1] + ["GO"] +
-                               [t0 - time_start] + [curr_stimulus])
-                self.apply_reward(duration=reward_time)
-                go_trial = False
-
-            if nogo_trial:
-                t0 = time.time()  # Registers current time
-                self.write_csv(classical_conditioning_csv_name,
-                               [trial_idx + 1] + ["NOGO"] +
-                               [t0 - time_start] + [curr_stimulus])
-                # just apply a sleep timer for the duration of the reward time
-                time.sleep(reward_time)
-                nogo_trial = False
-
-            trial_idx += 1
-
-        # Flags
-        go_trial = False
-        nogo_trial = False
-
-        trial_idx = 0  # Restart trial counter
-
-        # I'm presorting the trial counts so that animals are exposed to EXACTLY probability * trial count
-        # For example, at 50% probability, in 100 trials, animals will get exactly 50 GOs, in pseudorandom order
-        operant_ordered_concat, operant_shuffled_indices = \
-            shuffle_stimuli(operant_conditioning_trial_cap, operant_probability)
-
-        self.reward_off()  # just to make sure the reward is not on at the beginning of the paradigm
+        time_start = self.clock.monotonic()
+        first_trial = 1
+        if resume_state is not None:
+            first_trial = resume_state.next_trial("classical_conditioning")
+            time_start -= resume_state.elapsed()  # the session time already run counts towards max_trial_duration
+            resume_state.replay(self.metrics)
+        schedule = self.trial_schedule("classical_conditioning", resume_state, time_start, [go_sound], [nogo_sound],
+                                       classical_probability, trials=classical_conditioning_trial_cap,
+                                       max_run=max_run, iti_range=iti_range, reward_time=reward_time)
+        self.run_trials("classical_conditioning", schedule, classical_conditioning_csv_name, self.classical_row,
+                        time_start, first_trial=first_trial, trial_cap=classical_conditioning_trial_cap,
+                        initiated=False)
 
         """
-        This is the main operant conditioning loop
+        Operant conditioning: go/no-go trials initiated by the bird
         """
-        curr_stimulus = ""
-        operant_time_start = time.time()
-        current_time = time.time() - time_start
-        while (current_time <= max_trial_duration) and (
-                trial_idx < operant_conditioning_trial_cap):  # "IIIIIIIIIt's TIME!"(Buffer, Bruce)
-            # Birds initiate all trials!
-            start_peck = self.peck_prompt(duration=(max_trial_duration - current_time))  # Birds initiate all trials!
-
-            if start_peck is not None:
-                if operant_ordered_concat[operant_shuffled_indices[trial_idx]] == 'go':
-                    self.play_sound(go_sound)
-                    curr_stimulus = go_sound
-                    go_trial = True
-
-                else:
-                    self.play_sound(nogo_sound)
-                    curr_stimulus = nogo_sound
-                    nogo_trial = True
-
-                time.sleep(delay_time)
-
-                if go_trial:
-                    t0 = time.time()  # Registers current time
-                    response_time = self.peck_prompt(duration=max_response_time)
-                    if response_time is not None:  # Hit! :)
-                        self.write_csv(operant_conditioning_csv_name,
-                                       [trial_idx + 1] + ["GO"] + [response_time] + [1] + [0] * 3 +
-                                       [t0 - time_start] + [curr_stimulus])
-                        self.apply_reward(duration=reward_time)
-                    else:  # Miss :(
-                        self.write_csv(operant_conditioning_csv_name,
-                                       [trial_idx + 1] + ["GO"] + ["NA"] + [0] + [1] + [0] * 2 +
-                                       [t0 - time_start] + [curr_stimulus])
-                        self.apply_null_time(duration=null_time)
-                    go_trial = False
-
-                if nogo_trial:
-                    t0 = time.time()
-                    response_time = self.peck_prompt(duration=max_response_time)
-                    if response_time is not None:  # False alarm :(
-                        self.write_csv(operant_conditioning_csv_name,
-                                       [trial_idx + 1] + ["NOGO"] + [response_time] + [0] * 3 + [1] +
-                                       [t0 - time_start] + [curr_stimulus])
-                        # self.apply_punishment()
-                        self.apply_sleep_punishment(punishment_null_time, wn_sound=wn_sound,
-                                                    apply_wn_too=True)  # Some birds might feel "demotivated" with harsh punishment...
-                    else:  # Correct rejection! :)
-                        self.write_csv(operant_conditioning_csv_name,
-                                       [trial_idx + 1] + ["NOGO"] + ["NA"] + [0] * 2 + [1] + [0] +
-                                       [t0 - time_start] + [curr_stimulus])
-                        self.apply_null_time(duration=null_time)
-                    nogo_trial = False
-                trial_idx += 1
-                # Bird has to hop off the perch to reactivate switch
-                self.step_out_prompt()
-
-            current_time = time.time() - operant_time_start
-
+        first_trial = 1
+        if resume_state is not None:
+            first_trial = resume_state.next_trial("operant_conditioning")
+        schedule = self.trial_schedule("operant_conditioning", resume_state, time_start, [go_sound], [nogo_sound],
+                                       operant_probability, trials=operant_conditioning_trial_cap, max_run=max_run,
+                                       reward_time=reward_time, punishment_null_time=punishment_null_time,
+                                       null_time=null_time)
+        self.reward_off()  # just to make sure the reward is not on at the beginning of the paradigm
+        action = self.run_trials("operant_conditioning", schedule, operant_conditioning_csv_name, self.go_nogo_row,
+                                 time_start, first_trial=first_trial, trial_cap=operant_conditioning_trial_cap,
+                                 duration=max_trial_duration, response_window=response_window,
+                                 delay_time=delay_time, max_response_time=max_response_time, wn_sound=wn_sound)
+        return self.end_journal(action)
 
 if __name__ == "__main__":
     print "THIS FILE SHOULD NOT BE RUN DIRECTLY; RUN BOOTH_DRIVER.PY INSTEAD"
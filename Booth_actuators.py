@@ -0,0 +1,104 @@
+"""
+Non-blocking outputs: the reward valve, the air puffer and the cue LED.
+A pulse switches its output on and schedules the off-edge on the clock's timer (Booth_timing.TimerThread in real
+time), so the pin goes off on time whatever the paradigm is doing, and the paradigm can keep watching the switch in
+the meantime. Every actuator is switched off when its Booth closes, and at interpreter exit if an exception ended
+the session first.
+"""
+import atexit
+import threading
+
+_live_actuators = set()
+
+
+class Pulse:
+    def __init__(self, start, deadline):
+        """An output switched on at start (monotonic s) and due off at deadline"""
+        self.start = start
+        self.deadline = deadline
+        self.off_time = None
+        self._done = threading.Event()
+
+    def finish(self, off_time):
+        self.off_time = off_time
+        self._done.set()
+
+    def wait(self):
+        """Returns the time the output actually went off, once it has"""
+        self._done.wait()
+        return self.off_time
+
+
+class Actuator:
+    def __init__(self, gpio, pin, on_level, clock):
+        """An output pin that is on at on_level (0 for the active-low valve and puffer relays)"""
+        self.gpio = gpio
+        self.pin = pin
+        self.on_level = on_level
+        self.clock = clock
+        self.pulse_in_progress = None
+        self._timer_entry = None
+        self._lock = threading.Lock()
+        _live_actuators.add(self)
+
+    def _cancel_pulse(self):
+        if self._timer_entry is not None:
+            self.clock.cancel(self._timer_entry)
+            self._timer_entry = None
+        if self.pulse_in_progress is not None:
+            self.pulse_in_progress.finish(self.clock.monotonic())
+            self.pulse_in_progress = None
+
+    def on(self):
+        with self._lock:
+            self._cancel_pulse()
+            self.gpio.output(self.pin, self.on_level)
+
+    def off(self):
+        with self._lock:
+            self._cancel_pulse()
+            self.gpio.output(self.pin, 1 - self.on_level)
+
+    def pulse(self, duration, start=None):
+        """
+        Switches the output on now and off duration s after start (a monotonic time; now by default), and returns
+        the Pulse at once. A new pulse, on() or off() replaces a pulse in progress.
+        """
+        with self._lock:
+            self._cancel_pulse()
+            if start is None:
+                start = self.clock.monotonic()
+            self.gpio.output(self.pin, self.on_level)
+            pulse = Pulse(start, start + duration)
+            self.pulse_in_progress = pulse
+        # Outside the lock: a virtual clock can run the off-edge right away
+        entry = self.clock.call_at(pulse.deadline, lambda t: self._end_pulse(pulse, t))
+        with self._lock:
+            if self.pulse_in_progress is pulse:
+                self._timer_entry = entry
+        return pulse
+
+    def _end_pulse(self, pulse, t):
+        with self._lock:
+            if self.pulse_in_progress is not pulse:
+                return  # replaced or cancelled meanwhile
+            self._timer_entry = None
+            self.pulse_in_progress = None
+            try:
+                self.gpio.output(self.pin, 1 - self.on_level)
+            finally:
+                pulse.finish(t)
+
+    def close(self):
+        """Switches the output off for good; errors from an already cleaned-up GPIO are ignored"""
+        _live_actuators.discard(self)
+        try:
+            self.off()
+        except (RuntimeError, KeyError):
+            pass
+
+
+@atexit.register
+def close_all_actuators():
+    for actuator in list(_live_actuators):
+        actuator.close()
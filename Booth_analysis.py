@@ -0,0 +1,231 @@
+"""
+Batch analysis of session csv files across subjects and days.
+Every paradigm csv found under the given folders is parsed into NumPy arrays in a process pool. Parsed files are
+cached by modification time and size, so re-running over a growing data folder only parses the new sessions.
+Prints and writes (to the --output folder) per-subject learning curves, response time distributions and
+psychometric functions of SNR.
+Run as: python Booth_analysis.py <data folder> ... [--output folder] [--processes n]
+"""
+import cPickle as pickle
+import csv
+import multiprocessing
+import os
+import re
+import sys
+from datetime import datetime
+import numpy as np
+from Booth_metrics import OUTCOMES, summarize
+
+CACHE_FILE_NAME = os.path.expanduser("~/.booth_analysis_cache.pickle")
+
+# Longest first, so _shaping_timed is not taken for _shaping
+PARADIGMS = ("shaping_two_pecks", "shaping_timed", "classical_conditioning", "operant_conditioning", "introduction",
+             "go_nogo", "shaping", "scene")
+GO_NOGO_PARADIGMS = ("go_nogo", "scene", "operant_conditioning")  # the files with Hit/Miss/Reject/False_alarm
+
+
+def parse_session(path):
+    """
+    Returns (paradigm, session id, subject, date) for a paradigm csv path, or None if it is not one.
+    Session ids follow subject_YYMMDD (Booth_driver.py's daily repetitions); date is None if there is none.
+    """
+    name = os.path.basename(path)[:-len('.csv')]
+    for paradigm in PARADIGMS:
+        if name.endswith('_' + paradigm):
+            break
+    else:
+        return None
+    session_id = name[:-len(paradigm) - 1]
+    # classical/operant files also carry the stimuli and probability: <id>_go<sound>_nogo<sound>_prob<p>
+    session_id = re.sub(r'_go.*_nogo.*_prob[\d.]+$', '', session_id)
+    parts = session_id.split('_')
+    for index in range(1, len(parts)):
+        try:
+            date = datetime.strptime(parts[index], '%y%m%d')
+        except ValueError:
+            continue
+        return paradigm, session_id, '_'.join(parts[:index]), date
+    return paradigm, session_id, session_id, None
+
+
+def parse_file(path):
+    """Reads one csv into a dict of column name -> array (floats with NaN for "NA" where possible, else strings)"""
+    with open(path) as csv_file:
+        rows = list(csv.reader(csv_file))
+    header = rows[0] if rows else []
+    # Sessions run again under the same id used to write their header again
+    rows = [row for row in rows[1:] if len(row) == len(header) and row != header]
+    columns = {}
+    for index, column in enumerate(header):
+        values = [row[index] for row in rows]
+        try:
+            columns[column] = np.array([np.nan if value in ("NA", "") else float(value) for value in values])
+        except ValueError:
+            columns[column] = np.array(values)
+    return columns
+
+
+def outcome_codes(columns):
+    """Index into OUTCOMES of every trial of a go/no-go type file"""
+    if "Hit" not in columns or not len(columns["Hit"]):
+        return np.zeros(0, dtype=int)
+    return np.argmax(np.column_stack([columns[column] for column in ("Hit", "Miss", "Reject", "False_alarm")]),
+                     axis=1)
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE_NAME, 'rb') as cache_file:
+            return pickle.load(cache_file)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return {}
+
+
+def save_cache(cache):
+    try:
+        with open(CACHE_FILE_NAME, 'wb') as cache_file:
+            pickle.dump(cache, cache_file, pickle.HIGHEST_PROTOCOL)
+    except IOError:
+        pass
+
+
+def find_sessions(folders):
+    """Returns a list of (path, paradigm, session id, subject, date) for every paradigm csv under folders"""
+    sessions = []
+    for folder in folders:
+        for directory, _, file_names in os.walk(folder):
+            for file_name in sorted(file_names):
+                if file_name.endswith('.csv'):
+                    parsed = parse_session(os.path.join(directory, file_name))
+                    if parsed is not None:
+                        sessions.append((os.path.join(directory, file_name),) + parsed)
+    return sessions
+
+
+def load_sessions(folders, processes=None):
+    """
+    Returns (sessions, data): the find_sessions list and a dict of path -> parsed columns.
+    Only files that changed since the last run are parsed, in parallel.
+    """
+    sessions = find_sessions(folders)
+    cache = load_cache()
+    stamps = {}
+    for session in sessions:
+        file_stat = os.stat(session[0])
+        stamps[session[0]] = (file_stat.st_mtime, file_stat.st_size)
+    to_parse = [path for path in stamps if path not in cache or cache[path][0] != stamps[path]]
+    if to_parse:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for path, columns in zip(to_parse, pool.map(parse_file, to_parse)):
+                cache[path] = (stamps[path], columns)
+        finally:
+            pool.close()
+            pool.join()
+        save_cache(cache)
+    print "%d session files (%d parsed, %d unchanged)" % (len(sessions), len(to_parse), len(sessions) - len(to_parse))
+    return sessions, dict((path, cache[path][1]) for path in stamps)
+
+
+def learning_curves(sessions, data):
+    """One row per go/no-go type session: subject, date, session id, paradigm, trials, hit rate, fa rate, d', c"""
+    curves = []
+    for path, paradigm, session_id, subject, date in sessions:
+        if paradigm not in GO_NOGO_PARADIGMS:
+            continue
+        counts = np.bincount(outcome_codes(data[path]), minlength=len(OUTCOMES))
+        if not counts.sum():
+            continue
+        statistics = summarize(list(counts))
+        curves.append([subject, date.strftime('%y%m%d') if date else "NA", session_id, paradigm,
+                       statistics["trials"], statistics["hit_rate"], statistics["false_alarm_rate"],
+                       statistics["d_prime"], statistics["criterion"]])
+    return sorted(curves)
+
+
+def response_times(sessions, data, percentiles=(10, 25, 50, 75, 90)):
+    """Per subject and response type (hit, false_alarm): n, mean and percentiles of the response time in s"""
+    by_subject = {}
+    for path, paradigm, session_id, subject, date in sessions:
+        if paradigm not in GO_NOGO_PARADIGMS or not len(outcome_codes(data[path])):
+            continue
+        codes = outcome_codes(data[path])
+        for outcome in ("hit", "false_alarm"):
+            times = data[path]["Response_time_s"][codes == OUTCOMES.index(outcome)]
+            by_subject.setdefault((subject, outcome), []).append(times[~np.isnan(times)])
+    rows = []
+    for (subject, outcome), times in sorted(by_subject.items()):
+        times = np.concatenate(times)
+        if len(times):
+            rows.append([subject, outcome, len(times), times.mean()] + list(np.percentile(times, percentiles)))
+    return rows
+
+
+def psychometric(sessions, data):
+    """Per subject and SNR of the scene sessions: GO and NOGO trials, response probabilities, d' and c"""
+    by_subject = {}
+    for path, paradigm, session_id, subject, date in sessions:
+        if paradigm != "scene" or not len(outcome_codes(data[path])):
+            continue
+        codes = outcome_codes(data[path])
+        snrs = data[path]["Trial SNR/dB"]
+        for snr in np.unique(snrs[~np.isnan(snrs)]):
+            counts = np.bincount(codes[snrs == snr], minlength=len(OUTCOMES))
+            by_subject[(subject, snr)] = by_subject.get((subject, snr), 0) + counts
+    rows = []
+    for (subject, snr), counts in sorted(by_subject.items()):
+        go_trials = counts[0] + counts[1]
+        nogo_trials = counts[2] + counts[3]
+        if go_trials and nogo_trials:
+            statistics = summarize(list(counts))
+            sensitivity = [statistics["d_prime"], statistics["criterion"]]
+        else:  # d' needs both GO and NOGO stimuli at this SNR
+            sensitivity = ["NA", "NA"]
+        rows.append([subject, int(snr), go_trials, nogo_trials,
+                     counts[0] / float(go_trials) if go_trials else "NA",
+                     counts[3] / float(nogo_trials) if nogo_trials else "NA"] + sensitivity)
+    return rows
+
+
+def write_table(file_name, header, rows):
+    with open(file_name, 'w') as csv_file:
+        writer = csv.writer(csv_file, delimiter=',')
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+
+
+def analyze(folders, output=".", processes=None):
+    sessions, data = load_sessions(folders, processes)
+    tables = [("learning_curves.csv",
+               ["Subject", "Date", "Session", "Paradigm", "Trials", "Hit_rate", "False_alarm_rate", "d_prime",
+                "Criterion"], learning_curves(sessions, data)),
+              ("response_times.csv",
+               ["Subject", "Response", "N", "Mean_s", "P10_s", "P25_s", "P50_s", "P75_s", "P90_s"],
+               response_times(sessions, data)),
+              ("psychometric.csv",
+               ["Subject", "SNR_dB", "GO_trials", "NOGO_trials", "P_response_GO", "P_response_NOGO", "d_prime",
+                "Criterion"], psychometric(sessions, data))]
+    for file_name, header, rows in tables:
+        print
+        print file_name[:-len('.csv')].replace('_', ' ').capitalize()
+        print "  " + "  ".join("%-12s" % column for column in header)
+        for row in rows:
+            print "  " + "  ".join("%-12.3f" % value if isinstance(value, (float, np.floating)) else
+                                   "%-12s" % value for value in row)
+        write_table(os.path.join(output, file_name), header, rows)
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    output_folder = "."
+    process_count = None
+    if "--output" in arguments:
+        index = arguments.index("--output")
+        output_folder = arguments[index + 1]
+        del arguments[index:index + 2]
+    if "--processes" in arguments:
+        index = arguments.index("--processes")
+        process_count = int(arguments[index + 1])
+        del arguments[index:index + 2]
+    analyze(arguments or ["."], output_folder, process_count)
@@ -0,0 +1,296 @@
+"""
+Stimulus playback for Booth.
+The mixer is opened once per session and every stimulus is decoded (or synthesized from its spec, see
+Booth_synth.py) once into a pygame.mixer.Sound kept in memory, so playing a trial's stimulus does no disk access or
+device setup. Two outputs play them:
+    - StimulusPlayer: pygame's mixer, opened with a configurable buffer and kept busy with silence
+    - StreamPlayer: an audio stream of our own (pygame 2), which starts every sound at the start of the next device
+      buffer and knows when that buffer was handed to the device, so onsets are logged as the first sample reached it.
+      It can also play large stimulus folders straight from memory-mapped bundles (see Booth_bundle.py), without
+      copying them; a mixer Sound always holds a copy of its samples, so the mixer plays every stimulus from the cache.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+import numpy as np
+import pygame as pg
+from Booth_bundle import StimulusBundle, read_pcm
+from Booth_synth import is_spec, synthesize
+from Booth_timing import monotonic
+
+try:
+    from pygame._sdl2.sdl2 import init_subsystem, INIT_AUDIO
+    from pygame._sdl2.audio import AudioDevice, AUDIO_S16, get_audio_device_name
+except ImportError:  # pygame 1.9 has only the mixer
+    AudioDevice = None
+
+OUTPUTS = ("stream", "mixer")
+
+
+class Playback:
+    """Handle to a sound that is playing, returned by StimulusPlayer.play(block=False)"""
+    def __init__(self, channel, onset, length):
+        self.channel = channel
+        self.onset = onset
+        self.expected_offset = onset + length
+        self.offset = None
+
+    def is_playing(self):
+        return self.channel is not None and self.channel.get_busy()
+
+    def wait(self):
+        """Sleeps until the sound has finished and returns the time it ended"""
+        remaining = self.expected_offset - monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        while self.is_playing():  # the device may still be draining its buffer
+            time.sleep(0.001)
+        if self.offset is None:
+            self.offset = monotonic()
+        return self.offset
+
+    def stop(self):
+        if self.channel is not None:
+            self.channel.stop()
+
+
+class StimulusPlayer:
+    def __init__(self, max_cache_bytes=256 * 1024 * 1024, audio_device=None, frequency=44100, buffer_frames=512,
+                 keep_alive=True):
+        """
+        max_cache_bytes bounds the decoded audio kept in memory; the least recently played sounds are dropped
+        first when it is exceeded.
+        audio_device names the output device to open (needs pygame 2); None opens the default one.
+        buffer_frames is the size of the device buffer in samples per channel. A sound starts with the next buffer,
+        so a smaller one starts it sooner but underruns (clicks) sooner on a busy CPU; pygame 1.9 defaults to 4096
+        (93 ms at 44.1 kHz).
+        keep_alive plays silence on a reserved channel for the whole session, so the output never idles and an onset
+        does not wait for the device (or an HDMI sink) to wake up.
+        """
+        self.max_cache_bytes = max_cache_bytes
+        self.cache_bytes = 0
+        self._cache = OrderedDict()  # file name -> (Sound, size in bytes), least recently used first
+        self._mapped = {}  # file name -> StimulusBundle it is mapped from
+
+        # Timing of the last play() call, in monotonic() seconds
+        self.last_load_time = None  # seconds spent loading, 0 when the sound was cached
+        self.last_loaded = None
+        self.last_onset = None
+
+        self._open(audio_device, frequency, buffer_frames)
+        self.buffer_period = buffer_frames / float(frequency)
+        if keep_alive:
+            pg.mixer.set_reserved(1)  # Sound.play() leaves channel 0 to the silence
+            frequency, size, channels = self.format()
+            silence = pg.mixer.Sound(buffer=b"\0" * (buffer_frames * channels * abs(size) // 8))
+            pg.mixer.Channel(0).play(silence, loops=-1)
+
+    def _open(self, audio_device, frequency, buffer_frames):
+        if audio_device is None:
+            pg.mixer.init(frequency, -16, 2, buffer_frames)
+        else:
+            pg.mixer.init(frequency, -16, 2, buffer_frames, devicename=audio_device)
+
+    def format(self):
+        """(sample rate, sample size in bits, negative if signed, channels) of the output"""
+        return pg.mixer.get_init()
+
+    def _sound_bytes(self, sound):
+        frequency, size, channels = self.format()
+        return int(sound.get_length() * frequency * channels * abs(size) / 8)
+
+    def synthesize_samples(self, spec):
+        """Returns a stimulus spec synthesized as frames x channels of signed 16-bit samples"""
+        frequency, size, channels = self.format()
+        if size != -16:
+            raise ValueError("Synthesized stimuli need a signed 16-bit mixer, not %d bits" % size)
+        samples = np.round(synthesize(spec, frequency) * 32767).astype(np.int16)
+        return np.repeat(samples[:, np.newaxis], channels, axis=1)
+
+    def synthesize(self, spec):
+        """Returns a stimulus spec synthesized into a Sound in the mixer's format"""
+        return pg.mixer.Sound(buffer=self.synthesize_samples(spec).tostring())  # channels interleaved
+
+    def _decode(self, sound_file):
+        return self.synthesize(sound_file) if is_spec(sound_file) else pg.mixer.Sound(sound_file)
+
+    def map_folder(self, manifest):
+        """
+        Plays the stimuli of a folder (its Booth_stimuli.StimulusManifest) from a memory-mapped StimulusBundle instead
+        of the cache, where the output can (see StreamPlayer). Returns the files that are not mapped, to be preloaded
+        as usual: all of them for the mixer, which would copy every stimulus out of the map on its trial.
+        """
+        return manifest.paths()
+
+    def mapped_bytes(self):
+        return sum(bundle.frames[sound_file].nbytes for sound_file, bundle in self._mapped.items())
+
+    def prefetch(self, sound_file):
+        """Starts reading a mapped sound_file's pages into the page cache in the background, ahead of its trial"""
+        if sound_file in self._mapped:
+            thread = threading.Thread(target=self._mapped[sound_file].prefetch, args=(sound_file,))
+            thread.daemon = True
+            thread.start()
+
+    def load(self, sound_file):
+        """Returns the decoded sound for sound_file (a file name or a stimulus spec), decoding it on a cache miss"""
+        if sound_file in self._mapped:  # not cached
+            return self._mapped[sound_file].pcm(sound_file)
+        if sound_file in self._cache:
+            entry = self._cache.pop(sound_file)
+            self._cache[sound_file] = entry  # mark as most recently used
+            return entry[0]
+
+        sound = self._decode(sound_file)
+        sound_bytes = self._sound_bytes(sound)
+        self._cache[sound_file] = (sound, sound_bytes)
+        self.cache_bytes += sound_bytes
+        while self.cache_bytes > self.max_cache_bytes and len(self._cache) > 1:
+            _, (_, evicted_bytes) = self._cache.popitem(last=False)
+            self.cache_bytes -= evicted_bytes
+        return sound
+
+    def preload(self, sound_files):
+        for sound_file in sound_files:
+            self.load(sound_file)
+
+    def play(self, sound_file, block=True):
+        """
+        Plays sound_file and returns its Playback handle.
+        If block is True, only returns once the sound has finished; otherwise returns right after onset.
+        """
+        t0 = monotonic()
+        sound = self.load(sound_file)
+        self.last_loaded = monotonic()
+        self.last_load_time = self.last_loaded - t0
+        channel = sound.play()
+        self.last_onset = monotonic()
+        playback = Playback(channel, self.last_onset, sound.get_length())
+        if block:
+            playback.wait()
+        return playback
+
+    def close(self):
+        self._cache.clear()
+        self._mapped.clear()
+        self.cache_bytes = 0
+        pg.mixer.quit()
+
+
+class Voice:
+    """A sound in a StreamPlayer's stream; takes the place of a mixer Channel in its Playback"""
+    def __init__(self, frames):
+        self.frames = frames
+        self.position = 0  # next frame to hand to the device
+        self.onset = None  # when its first buffer was handed to the device, in monotonic() seconds
+        self.started = threading.Event()
+        self.stopped = False
+
+    def get_busy(self):
+        return not self.stopped and self.position < len(self.frames)
+
+    def stop(self):
+        self.stopped = True
+
+
+class StreamPlayer(StimulusPlayer):
+    def __init__(self, max_cache_bytes=256 * 1024 * 1024, audio_device=None, frequency=44100, buffer_frames=256):
+        """
+        Plays stimuli on an output stream that is opened once and runs (silent between sounds) for the whole session.
+        Every device buffer is filled here, from the sounds playing, so a sound starts at the beginning of the next
+        buffer and play() returns once it has been handed to the device. Sounds are decoded into NumPy arrays, and
+        mapped stimuli are played straight from their map. Needs pygame 2.
+        """
+        if AudioDevice is None:
+            raise RuntimeError("StreamPlayer needs pygame 2; use StimulusPlayer")
+        self._starting = deque()  # voices play() has handed over, started by the next buffer
+        self._voices = []  # only touched by the stream's thread
+        StimulusPlayer.__init__(self, max_cache_bytes, audio_device, frequency, buffer_frames, keep_alive=False)
+
+    def _open(self, audio_device, frequency, buffer_frames):
+        init_subsystem(INIT_AUDIO)
+        if audio_device is None:
+            audio_device = get_audio_device_name(0, False)
+        # allowed_changes=0: SDL converts to the device's format if it differs
+        self.device = AudioDevice(audio_device, False, frequency, AUDIO_S16, 2, buffer_frames, 0, self._fill)
+        self.device.pause(0)
+
+    def format(self):
+        return self.device.frequency, -16, self.device.numchannels
+
+    def _fill(self, device, stream):
+        """Stream callback: mixes the next buffer of every playing voice into stream"""
+        now = monotonic()
+        output = np.asarray(stream).view(np.int16).reshape(-1, self.device.numchannels)
+        output.fill(0)
+        while self._starting:
+            voice = self._starting.popleft()
+            voice.onset = now
+            self._voices.append(voice)
+            voice.started.set()
+        if not self._voices:
+            return
+        mix = output if len(self._voices) == 1 else np.zeros(output.shape, dtype=np.int32)
+        for voice in self._voices:
+            chunk = voice.frames[voice.position:voice.position + len(output)]
+            mix[:len(chunk)] += chunk
+            voice.position += len(chunk)
+        if mix is not output:  # several sounds at once (e.g. punishment noise over a stimulus) are summed
+            output[:] = np.clip(mix, -32768, 32767)
+        self._voices = [voice for voice in self._voices if voice.get_busy()]
+
+    def _sound_bytes(self, frames):
+        return frames.nbytes
+
+    def synthesize(self, spec):
+        return self.synthesize_samples(spec)
+
+    def _decode(self, sound_file):
+        if is_spec(sound_file):
+            return self.synthesize(sound_file)
+        frequency, size, channels = self.format()
+        return read_pcm(sound_file, frequency, channels)
+
+    def map_folder(self, manifest):
+        """Mapped stimuli are played straight from their map; its pages are read as the stream reaches them"""
+        frequency, size, channels = self.format()
+        bundle = StimulusBundle(manifest.folder, frequency, channels, manifest)
+        for sound_file in bundle.frames:
+            self._mapped[sound_file] = bundle
+        return bundle.unmapped
+
+    def play(self, sound_file, block=True):
+        """
+        Plays sound_file and returns its Playback handle, once its first buffer has reached the device (its onset).
+        If block is True, only returns once the sound has finished.
+        """
+        t0 = monotonic()
+        frames = self.load(sound_file)
+        self.last_loaded = monotonic()
+        self.last_load_time = self.last_loaded - t0
+        voice = Voice(frames)
+        self._starting.append(voice)
+        if not voice.started.wait(max(1.0, 4 * self.buffer_period)):  # the stream has stalled
+            voice.onset = monotonic()
+        self.last_onset = voice.onset
+        playback = Playback(voice, voice.onset, len(frames) / float(self.device.frequency))
+        if block:
+            playback.wait()
+        return playback
+
+    def close(self):
+        self.device.pause(1)
+        self.device.close()
+        self._cache.clear()
+        self._mapped.clear()
+        self.cache_bytes = 0
+        pg.mixer.quit()  # also quits the SDL audio subsystem _open started; the mixer cannot open while it runs
+
+
+def open_player(output="stream", audio_device=None, frequency=44100, buffer_frames=256):
+    """A StreamPlayer, or (output="mixer", or with pygame 1.9) a StimulusPlayer, with the given device buffer"""
+    if output not in OUTPUTS:
+        raise ValueError("output must be one of " + ", ".join(OUTPUTS))
+    if output == "stream" and AudioDevice is not None:
+        return StreamPlayer(audio_device=audio_device, frequency=frequency, buffer_frames=buffer_frames)
+    return StimulusPlayer(audio_device=audio_device, frequency=frequency, buffer_frames=buffer_frames)
@@ -0,0 +1,490 @@
+"""
+Benchmarks for the Booth hardware and I/O paths, runnable without a Raspberry Pi.
+Run as: python Booth_benchmark.py <benchmark name>
+"""
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import wave
+import threading
+import time
+import numpy as np
+import pygame as pg
+from Booth_sim import SimulatedGPIO, VirtualClock
+from Booth_input import SwitchInput
+from Booth_audio import StimulusPlayer, StreamPlayer, AudioDevice
+from Booth_bundle import StimulusBundle, resident_memory
+from Booth_writer import TrialWriter
+from Booth_timing import read_timing_csv, monotonic, DeadlineScheduler
+from Booth_stimuli import StimulusManifest
+from Booth_trials import TrialSchedule
+
+SWITCH_PIN = 15
+
+
+def cpu_time():
+    user, system = os.times()[:2]
+    return user + system
+
+
+def summarize(name, latencies, cpu, wall):
+    latencies = np.array(latencies) * 1000
+    print "%-12s n=%-4d latency ms: mean %7.3f  p50 %7.3f  p95 %7.3f  max %7.3f   CPU %5.1f%%" % \
+          (name, len(latencies), latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 95),
+           latencies.max(), 100 * cpu / wall)
+
+
+def poll_peck_prompt(gpio, pin, duration):
+    """The busy-poll loop Booth.peck_prompt used before the edge-event input layer"""
+    start_time = time.time()
+    current_time = 0
+    while current_time < duration:
+        if gpio.input(pin) == 0:
+            return current_time
+        current_time = time.time() - start_time
+    return None
+
+
+def simulated_pecks(gpio, pin, press_times, n_pecks, iti_range, hold_time):
+    for _ in range(n_pecks):
+        time.sleep(np.random.uniform(iti_range[0], iti_range[1]))
+        press_times.append(time.time())
+        gpio.press(pin)
+        time.sleep(hold_time)
+        gpio.release(pin)
+
+
+def bench_switch(n_pecks=100, iti_range=(0.02, 0.1), hold_time=0.02):
+    """Detection latency and CPU use of the polling path versus SwitchInput, with a bird pecking in a thread"""
+    for name in ("polling", "edge-event"):
+        gpio = SimulatedGPIO()
+        gpio.setup(SWITCH_PIN, gpio.IN, pull_up_down=gpio.PUD_UP)
+        if name == "polling":
+            def wait_for_press():
+                return poll_peck_prompt(gpio, SWITCH_PIN, 10)
+
+            def wait_for_release():
+                while gpio.input(SWITCH_PIN) == 0:
+                    continue
+        else:
+            switch = SwitchInput(gpio, SWITCH_PIN)
+            wait_for_press = lambda: switch.wait_for_press(10)
+            wait_for_release = switch.wait_for_release
+
+        press_times = []
+        bird = threading.Thread(target=simulated_pecks,
+                                args=(gpio, SWITCH_PIN, press_times, n_pecks, iti_range, hold_time))
+        latencies = []
+        wall_start = time.time()
+        cpu_start = cpu_time()
+        bird.start()
+        for _ in range(n_pecks):
+            wait_for_press()
+            latencies.append(time.time() - press_times[-1])
+            wait_for_release()
+        bird.join()
+        summarize(name, latencies, cpu_time() - cpu_start, time.time() - wall_start)
+
+
+def bench_audio(n_trials=40, sound_files=("2000HZ_TONE.wav", "3000HZ_TONE.wav", "GNG_WN.wav")):
+    """
+    Peck-to-onset latency of the per-trial mixer init/load/quit path versus StimulusPlayer.
+    Uses SDL's dummy audio driver, so onset is when playback has been handed to the mixer.
+    """
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+    def play_per_trial(sound_file):
+        pg.mixer.init()
+        pg.mixer.music.load(sound_file)
+        pg.mixer.music.play()
+        onset = time.time()
+        pg.mixer.music.stop()
+        pg.mixer.quit()
+        return onset
+
+    def play_cached(sound_file):
+        sound = player.load(sound_file)
+        channel = sound.play()
+        onset = time.time()
+        channel.stop()
+        return onset
+
+    player = None
+    for name, play in (("per-trial", play_per_trial), ("cached", play_cached)):
+        if play is play_cached:
+            player = StimulusPlayer()
+            player.preload(sound_files)
+        latencies = []
+        wall_start = time.time()
+        cpu_start = cpu_time()
+        for trial in range(n_trials):
+            peck_time = time.time()  # the peck prompt has just returned
+            latencies.append(play(sound_files[trial % len(sound_files)]) - peck_time)
+        summarize(name, latencies, cpu_time() - cpu_start, time.time() - wall_start)
+    player.close()
+
+
+def bench_onset(n_trials=50, buffer_sizes=(64, 128, 256, 512, 1024), sound_file="2000HZ_TONE.wav"):
+    """
+    Peck-to-onset latency per device buffer size, as Booth logs it in <session>_stimulus_onsets.csv: from
+    Booth.peck_prompt returning on a simulated peck to the stimulus's first buffer reaching the sink (StreamPlayer),
+    with SDL's dummy audio driver as the sink, so no loopback cable is needed. For StimulusPlayer (the mixer), when the
+    first sample reaches the sink cannot be seen; its onset is the hand-off to the mixer.
+    """
+    from Booth import Booth
+
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    sound_file = os.path.abspath(sound_file)
+    directory = os.path.abspath(tempfile.mkdtemp(dir="."))
+    working_directory = os.getcwd()
+    os.chdir(directory)  # the booths write their logs here
+    try:
+        for output in ("stream", "mixer"):
+            if output == "stream" and AudioDevice is None:
+                print "stream output needs pygame 2"
+                continue
+            for buffer_frames in buffer_sizes:
+                if output == "stream":
+                    player = StreamPlayer(buffer_frames=buffer_frames)
+                else:
+                    player = StimulusPlayer(buffer_frames=buffer_frames)
+                player.preload([sound_file])
+                gpio = SimulatedGPIO()
+                session_id = "%s_%d" % (output, buffer_frames)
+                booth = Booth(session_id, gpio=gpio, player=player)
+                bird = threading.Thread(target=simulated_pecks,
+                                        args=(gpio, booth.SWITCH_PIN, [], n_trials, (0.06, 0.12), 0.01))
+                bird.daemon = True
+                wall_start = time.time()
+                cpu_start = cpu_time()
+                bird.start()
+                for _ in range(n_trials):
+                    booth.peck_prompt(duration=10)
+                    booth.play_sound(sound_file, block=False).stop()
+                    booth.switch.wait_for_release(10)
+                cpu = cpu_time() - cpu_start
+                wall = time.time() - wall_start
+                bird.join()
+                booth.close()
+                with open(session_id + "_stimulus_onsets.csv") as onsets_file:
+                    latencies = [float(row["Peck_to_onset_s"]) for row in csv.DictReader(onsets_file)
+                                 if row["Peck_to_onset_s"] != "NA"]  # a peck missed while the last sound started
+                summarize("%s %d" % (output, buffer_frames), latencies, cpu, wall)
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(directory)
+
+
+def bench_synth(tone_count=50, sound_file="2000HZ_TONE.wav"):
+    """
+    Session-start cost of a frequency-discrimination stimulus set: tone_count 2 s tones synthesized into the player
+    (see Booth_synth.py) versus the one WAV file decoded from disk
+    """
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    player = StimulusPlayer()
+    specs = ["tone %dHz" % frequency for frequency in np.linspace(1000, 4000, tone_count)]
+    start = time.time()
+    player.preload(specs)
+    synthesized = time.time() - start
+    start = time.time()
+    player.load(sound_file)
+    decoded = time.time() - start
+    print "%d tones synthesized in %.0f ms (%.1f ms each, %.1f MiB); %s decoded in %.1f ms" % \
+          (tone_count, synthesized * 1000, synthesized * 1000 / tone_count, player.cache_bytes / 2.0 ** 20,
+           sound_file, decoded * 1000)
+    player.close()
+
+
+def bench_writer(n_rows=500):
+    """Per-row latency of opening, appending and closing the CSV for every trial versus TrialWriter"""
+    row = [1] + ["GO"] + [0.53] + [1] + [0] * 3 + [1234.5] + ["2000HZ_TONE.wav"] + [0]
+    directory = tempfile.mkdtemp(dir=".")
+
+    def write_reopen(file_name):
+        def write(row):
+            file = open(file_name, 'a')
+            writer = csv.writer(file, delimiter=',')
+            writer.writerow(row)
+            file.close()
+        return write, lambda: None
+
+    def write_trial_writer(file_name, **policy):
+        writer = TrialWriter(file_name, **policy)
+        return writer.write, writer.close
+
+    paths = [("reopen", write_reopen, {}),
+             ("per-row", write_trial_writer, {}),
+             ("per-row+sync", write_trial_writer, {"fsync": True}),
+             ("every-50", write_trial_writer, {"flush_every_rows": 50}),
+             ("every-1s", write_trial_writer, {"flush_every_rows": None, "flush_every_seconds": 1})]
+    try:
+        for name, make_writer, policy in paths:
+            write, close = make_writer(os.path.join(directory, name + ".csv"), **policy)
+            latencies = []
+            wall_start = time.time()
+            cpu_start = cpu_time()
+            for _ in range(n_rows):
+                t0 = time.time()
+                write(row)
+                latencies.append(time.time() - t0)
+            close()
+            summarize(name, latencies, cpu_time() - cpu_start, time.time() - wall_start)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_scheduler(n_waits=200, interval=0.05, max_overhead=0.005):
+    """
+    Wake-up error of back-to-back timed waits, each after up to max_overhead s of work (standing in for GPIO, csv
+    and audio calls): chained time.sleep(interval) versus DeadlineScheduler deadlines, slept only or slept then
+    spun for the last 2 ms. Also reports how far the last wake-up drifted from the ideal schedule.
+    """
+    def run_chained_sleep(deadline):
+        time.sleep(interval)
+        return monotonic()
+
+    waits = [("sleep", run_chained_sleep),
+             ("deadline", DeadlineScheduler(spin_time=0).wait_until),
+             ("spin", DeadlineScheduler(spin_time=0.002).wait_until)]
+    for name, wait in waits:
+        errors = []
+        wall_start = time.time()
+        cpu_start = cpu_time()
+        start = monotonic()
+        woke = start
+        for index in range(1, n_waits + 1):
+            work_end = monotonic() + np.random.uniform(0, max_overhead)
+            while monotonic() < work_end:
+                continue
+            if wait is run_chained_sleep:
+                intended = monotonic() + interval  # what a chained sleep aims for
+                woke = wait(intended)
+            else:
+                intended = start + index * interval
+                woke = wait(intended, "wait")
+            errors.append(woke - intended)
+        summarize(name, errors, cpu_time() - cpu_start, time.time() - wall_start)
+        print "%-12s drift from the ideal schedule after %d waits: %8.3f ms" % \
+              ("", n_waits, (woke - (start + n_waits * interval)) * 1000)
+
+
+def bouncy_trace(n_presses, mean_bounces, max_bounce_interval, random, hold_range=(0.03, 0.3),
+                 gap_range=(0.2, 2)):
+    """
+    (time, level) edges of n_presses pecks on a switch whose contacts chatter on every press and release: a
+    Poisson(mean_bounces) number of bounces, each up to max_bounce_interval s long. Returns the edges and the true
+    press times.
+    """
+    edges = []
+    press_times = []
+    t = 0.0
+    for _ in range(n_presses):
+        t += random.uniform(*gap_range)
+        press_times.append(t)
+        for level, duration in ((0, random.uniform(*hold_range)), (1, 0)):
+            edge_time = t
+            for _ in range(random.poisson(mean_bounces)):
+                edges.append((edge_time, level))
+                edge_time += random.uniform(0, max_bounce_interval)
+                edges.append((edge_time, 1 - level))
+                edge_time += random.uniform(0, max_bounce_interval)
+            edges.append((edge_time, level))
+            t = edge_time + duration
+    return edges, press_times
+
+
+def bench_debounce(n_presses=2000, debounce_times=(0, 0.002, 0.005, 0.01, 0.02)):
+    """
+    Presses counted by SwitchInput for synthetic bouncy edge traces, driven through a SimulatedGPIO on a
+    VirtualClock, for several debounce windows: a good switch (short, rare bounces) and a failing one (long bursts).
+    Also reports the CPU time spent per edge and whether the PerchTracker flags the switch.
+    """
+    random = np.random.RandomState(0)
+    traces = [("good", bouncy_trace(n_presses, 1, 0.0005, random)),
+              ("failing", bouncy_trace(n_presses, 6, 0.001, random))]
+    for trace_name, (edges, press_times) in traces:
+        print "%s switch: %d presses, %d edges" % (trace_name, len(press_times), len(edges))
+        for debounce_time in debounce_times:
+            clock = VirtualClock()
+            gpio = SimulatedGPIO()
+            gpio.setup(SWITCH_PIN, gpio.IN, pull_up_down=gpio.PUD_UP)
+            switch = SwitchInput(gpio, SWITCH_PIN, debounce_time=debounce_time, clock=clock)
+            cpu_start = cpu_time()
+            for edge_time, level in edges:
+                clock.advance_to(edge_time)
+                gpio.set_input(SWITCH_PIN, level)
+            clock.advance_to(edges[-1][0] + 1)
+            cpu = cpu_time() - cpu_start
+            switch.close()
+            print "  debounce %4.1f ms: %5d presses counted, %5d bounces, %5.1f us CPU per edge%s" % \
+                  (debounce_time * 1000, switch.press_count, switch.tracker.bounce_count, 1e6 * cpu / len(edges),
+                   "; flagged" if switch.tracker.warnings() else "")
+
+
+def bench_trials(trial_counts=(1000, 40000), lookups=100000):
+    """
+    Time to draw a TrialSchedule up front (blocked, with and without a max_run constraint) and to look a trial up,
+    as the trial loop does once per trial. 40000 trials covers an 11 h session of 1 s trials.
+    """
+    stimuli = ["stimulus%d.wav" % index for index in range(6)]
+    for trial_count in trial_counts:
+        for max_run in (None, 4):
+            start = monotonic()
+            schedule = TrialSchedule(stimuli, stimuli, 0.5, block_size=60, trials=trial_count, max_run=max_run,
+                                     reward_time=6, punishment_null_time=16, null_time=6)
+            draw = monotonic() - start
+            start = monotonic()
+            for trial_number in xrange(1, lookups + 1):
+                schedule.stimulus(schedule.trial(trial_number % trial_count + 1))
+            lookup = (monotonic() - start) / lookups
+            print "%6d trials, max_run %-4s: drawn in %7.1f ms (%5.0f KiB), %5.2f us per lookup" % \
+                  (trial_count, max_run, draw * 1000, schedule.trials.nbytes / 1024.0, lookup * 1e6)
+
+
+def write_tone(file_name, frequency=2000, duration=0.2, sample_rate=44100):
+    samples = (0.5 * 32767 * np.sin(2 * np.pi * frequency * np.arange(int(duration * sample_rate)) / sample_rate))
+    tone_file = wave.open(file_name, "wb")
+    tone_file.setnchannels(1)
+    tone_file.setsampwidth(2)
+    tone_file.setframerate(sample_rate)
+    tone_file.writeframes(samples.astype(np.int16).tostring())
+    tone_file.close()
+
+
+def bench_mapped(stimulus_count=24, duration=10, n_trials=48):
+    """
+    Load-to-onset latency and resident memory of a scene-discrimination sized stimulus folder: pg.mixer.music.load
+    per trial, every stimulus decoded into memory up front (preload) on the mixer and on the stream output, and the
+    stream output playing a memory-mapped bundle without copying it (StreamPlayer.map_folder). The mixer copies every
+    stimulus into a Sound, so it has no mapped case. "process" memory leaves out file pages, like the map's, that the
+    kernel can drop.
+    """
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    directory = os.path.abspath(tempfile.mkdtemp(dir="."))
+    try:
+        for index in range(stimulus_count):
+            write_tone(os.path.join(directory, "Song%dPk43(-4)%dsnr.wav" % (index, index % 6)),
+                       frequency=500 + 100 * index, duration=duration)
+        manifest = StimulusManifest(directory)
+        start = time.time()
+        StimulusBundle(directory)
+        print "%d x %d s stimuli: bundle built in %.0f ms" % (stimulus_count, duration, (time.time() - start) * 1000)
+
+        def play_music(sound_file):
+            pg.mixer.music.load(sound_file)
+            pg.mixer.music.play()
+            pg.mixer.music.stop()
+
+        def play_sound(sound_file):
+            player.play(sound_file, block=False).stop()
+
+        for name in ("stream map", "stream load", "mixer load", "music.load"):
+            if name.startswith("stream") and AudioDevice is None:
+                print "%-12s needs pygame 2" % name
+                continue
+            player = StreamPlayer() if name.startswith("stream") else StimulusPlayer()
+            memory_before = resident_memory(), resident_memory("RssAnon")
+            start = time.time()
+            if name == "stream map":
+                player.preload(player.map_folder(manifest))
+            elif name != "music.load":
+                player.preload(manifest.paths())
+            play = play_music if name == "music.load" else play_sound
+            setup = time.time() - start
+            latencies = []
+            wall_start = time.time()
+            cpu_start = cpu_time()
+            for trial in range(n_trials):
+                sound_file = manifest.stimuli[trial % stimulus_count].path
+                start = time.time()
+                play(sound_file)
+                latencies.append(time.time() - start)
+            summarize(name, latencies, cpu_time() - cpu_start, time.time() - wall_start)
+            if None not in memory_before:
+                print "%-12s set up in %.0f ms; resident memory +%.1f MiB, of which process +%.1f MiB" % \
+                      ("", setup * 1000, (resident_memory() - memory_before[0]) / 2.0 ** 20,
+                       (resident_memory("RssAnon") - memory_before[1]) / 2.0 ** 20)
+            player.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_booths(booth_counts=(1, 2, 4, 8), duration=20, audio_frequency=44100, audio_buffer=256, margin_ms=2.0):
+    """
+    How many simulated booths one host can run at once while keeping every booth's p99 peck-to-onset latency
+    within one device buffer (audio_buffer samples at audio_frequency) plus margin_ms, and how much it grows over
+    the first (smallest) booth count's. Each booth runs go_nogo in its own process (Booth_multi.run_booths) with a
+    simulated GPIO, a bird pecking in a thread and SDL's dummy audio driver.
+    """
+    from Booth import Booth
+    from Booth_multi import booth_settings, run_booths
+
+    onset_bound_ms = 1000.0 * audio_buffer / audio_frequency + margin_ms
+    print "bound: %d-sample buffer at %d Hz + %.1f ms = %.3f ms" % (audio_buffer, audio_frequency, margin_ms,
+                                                                    onset_bound_ms)
+
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    directory = os.path.abspath(tempfile.mkdtemp(dir="."))
+    go_sound = os.path.join(directory, "go.wav")
+    write_tone(go_sound)
+    working_directory = os.getcwd()
+    os.chdir(directory)  # every booth writes its csv files here
+
+    def run_simulated_booth(booth):
+        gpio = SimulatedGPIO()
+        session = Booth(booth["session_id"], gpio=gpio, **booth_settings(booth))
+        bird = threading.Thread(target=simulated_pecks,
+                                args=(gpio, booth["pins"]["SWITCH_PIN"], [], 100000, (0.2, 1.6), 0.05))
+        bird.daemon = True
+        bird.start()
+        session.go_nogo(**booth["parameters"])
+        session.close()
+
+    baseline_p99 = None
+    try:
+        for booth_count in booth_counts:
+            booths = [{"session_id": "booth%d_of%d" % (booth_index, booth_count), "protocol": "go_nogo",
+                       "pins": {"PUFFER_PIN": 4 * booth_index + 1, "REWARD_PIN": 4 * booth_index + 2,
+                                "SWITCH_PIN": 4 * booth_index + 3, "LED_PIN": 4 * booth_index + 4},
+                       "audio_frequency": audio_frequency, "audio_buffer": audio_buffer,
+                       "parameters": {"go_sound": go_sound, "nogo_sound": go_sound, "wn_sound": go_sound,
+                                      "probability": 1, "duration": duration, "reward_time": 0.1,
+                                      "null_time": 0.1, "max_response_time": 0.5}}
+                      for booth_index in range(booth_count)]
+            run_booths(booths, target=run_simulated_booth)
+
+            p99s = []
+            for booth in booths:
+                marks = read_timing_csv(booth["session_id"] + "_timing.csv")
+                peck_to_onset = (marks["onset"] - marks["peck"]) * 1000
+                p99s.append(np.percentile(peck_to_onset[~np.isnan(peck_to_onset)], 99))
+            if baseline_p99 is None:
+                baseline_p99 = max(p99s)
+            print "%2d booths: worst p99 peck-to-onset %7.3f ms (%+.3f ms vs %d booths), mean p99 %7.3f ms -> %s" % \
+                  (booth_count, max(p99s), max(p99s) - baseline_p99, booth_counts[0], np.mean(p99s),
+                   "OK" if max(p99s) <= onset_bound_ms else "over bound")
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(directory)
+
+
+BENCHMARKS = {
+    "switch": bench_switch,
+    "debounce": bench_debounce,
+    "audio": bench_audio,
+    "onset": bench_onset,
+    "synth": bench_synth,
+    "mapped": bench_mapped,
+    "writer": bench_writer,
+    "scheduler": bench_scheduler,
+    "trials": bench_trials,
+    "booths": bench_booths,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or sorted(BENCHMARKS.keys())
+    for benchmark_name in names:
+        print "== " + benchmark_name + " =="
+        BENCHMARKS[benchmark_name]()
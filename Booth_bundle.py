@@ -0,0 +1,204 @@
+"""
+Memory-mapped stimulus bundles.
+Folders of many long stimuli (scene_discrimination's songs in noise, one file per song and SNR) do not fit in the
+StimulusPlayer's in-memory cache on a 1 GB Pi. Instead, the PCM data of every WAV in a folder is packed once, already
+in the output's format, into <folder>/.stimulus_bundle, which is memory-mapped. A stimulus is then a slice of the map,
+which Booth_audio.StreamPlayer plays as it is: nothing is decoded, parsed or copied per trial, and its pages are read
+from the SD card (or the page cache, which the kernel can drop again under memory pressure) as the stream reaches
+them. pygame's mixer cannot play from the map without copying each stimulus into a Sound, so it does not use bundles.
+The bundle is rebuilt whenever a file in the folder changes, like the stimulus manifest. In a folder that cannot be
+written, WAVs already in the mixer's format are mapped one by one instead.
+Run as: python Booth_bundle.py <folder> ... to build (or check) bundles ahead of a session.
+"""
+import json
+import os
+import struct
+import sys
+import wave
+import numpy as np
+from Booth_stimuli import StimulusManifest
+
+BUNDLE_FILE_NAME = ".stimulus_bundle"
+MAGIC = b"BOOTHSTM"
+PAGE_SIZE = 4096
+SAMPLE_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+def resident_memory(field="VmRSS"):
+    """
+    Resident set size of this process in bytes, or None where /proc is not available. field="RssAnon" counts only
+    the memory the process holds itself, leaving out file pages (mapped stimuli) the kernel can drop.
+    """
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
+
+def read_pcm(path, sample_rate, channels):
+    """Decodes path into int16 frames (frames x channels) at sample_rate, converting its format if it differs"""
+    wav = wave.open(path, 'rb')
+    try:
+        file_channels, sample_width, file_rate, frame_count = wav.getparams()[:4]
+        frames = wav.readframes(frame_count)
+    finally:
+        wav.close()
+    if sample_width not in SAMPLE_DTYPES:
+        raise ValueError(path + ": " + str(8 * sample_width) + "-bit samples are not supported")
+    samples = np.frombuffer(frames, dtype=SAMPLE_DTYPES[sample_width]).reshape(-1, file_channels)
+    if sample_width == 1:  # 8-bit WAVs are unsigned
+        samples = (samples.astype(np.int16) - 128) << 8
+    elif sample_width == 4:
+        samples = (samples >> 16).astype(np.int16)
+    if file_channels != channels:
+        samples = np.repeat(samples.mean(axis=1, keepdims=True), channels, axis=1).astype(np.int16)
+    if file_rate != sample_rate:  # linear interpolation is enough for the odd file at the wrong rate
+        times = np.arange(int(round(len(samples) * sample_rate / float(file_rate)))) * file_rate / float(sample_rate)
+        samples = np.column_stack([np.interp(times, np.arange(len(samples)), samples[:, channel])
+                                   for channel in range(channels)]).astype(np.int16)
+    return samples
+
+
+def build_bundle(manifest, bundle_path, sample_rate=44100, channels=2):
+    """Packs the stimuli of manifest (a Booth_stimuli.StimulusManifest) into bundle_path, in the given format"""
+    index = {"sample_rate": sample_rate, "channels": channels, "stimuli": {}}
+    frame_offset = 0
+    pcm = []
+    for stimulus in manifest.stimuli:
+        samples = read_pcm(stimulus.path, sample_rate, channels)
+        index["stimuli"][os.path.basename(stimulus.path)] = {"offset": frame_offset, "frames": len(samples),
+                                                             "size": stimulus.size, "mtime": stimulus.mtime}
+        frame_offset += len(samples)
+        pcm.append(samples)
+    header = json.dumps(index)
+    data_offset = -(-(len(MAGIC) + 8 + len(header)) // PAGE_SIZE) * PAGE_SIZE  # PCM starts on a page
+    temporary_path = bundle_path + ".tmp"
+    try:
+        with open(temporary_path, 'wb') as bundle_file:
+            bundle_file.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            bundle_file.write(b"\0" * (data_offset - bundle_file.tell()))
+            for samples in pcm:
+                bundle_file.write(samples.tostring())
+        os.rename(temporary_path, bundle_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+
+
+def read_index(bundle_path):
+    """Returns the index of bundle_path and the offset of its PCM data, or (None, None) if it is not a bundle"""
+    try:
+        with open(bundle_path, 'rb') as bundle_file:
+            if bundle_file.read(len(MAGIC)) != MAGIC:
+                return None, None
+            header_length, = struct.unpack("<Q", bundle_file.read(8))
+            index = json.loads(bundle_file.read(header_length))
+    except (IOError, ValueError, struct.error):
+        return None, None
+    return index, -(-(len(MAGIC) + 8 + header_length) // PAGE_SIZE) * PAGE_SIZE
+
+
+def is_current(index, manifest, sample_rate, channels):
+    """Whether a bundle index holds exactly manifest's files, unchanged, in the given format"""
+    if index is None or index["sample_rate"] != sample_rate or index["channels"] != channels:
+        return False
+    stimuli = index["stimuli"]
+    return len(stimuli) == len(manifest.stimuli) and all(
+        os.path.basename(stimulus.path) in stimuli and
+        stimuli[os.path.basename(stimulus.path)]["size"] == stimulus.size and
+        stimuli[os.path.basename(stimulus.path)]["mtime"] == stimulus.mtime for stimulus in manifest.stimuli)
+
+
+def map_wav(path, sample_rate, channels):
+    """Maps the PCM data of a 16-bit WAV in the given format as frames x channels, or returns None if it is not one"""
+    with open(path, 'rb') as wav_file:
+        if wav_file.read(12)[8:] != b"WAVE":
+            return None
+        file_format = None
+        while True:
+            chunk_header = wav_file.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id, chunk_size = chunk_header[:4], struct.unpack("<I", chunk_header[4:])[0]
+            if chunk_id == b"fmt ":
+                file_format = struct.unpack("<HHIIHH", wav_file.read(16))
+                wav_file.seek(chunk_size - 16 + chunk_size % 2, 1)
+            elif chunk_id == b"data":
+                break
+            else:
+                wav_file.seek(chunk_size + chunk_size % 2, 1)
+        data_offset = wav_file.tell()
+    # PCM, channels, rate, byte rate, block align, bits
+    if file_format is None or file_format[0] != 1 or file_format[1] != channels or file_format[2] != sample_rate \
+            or file_format[5] != 16:
+        return None
+    frame_count = min(chunk_size, os.path.getsize(path) - data_offset) // (2 * channels)
+    return np.memmap(path, dtype=np.int16, mode='r', offset=data_offset, shape=(frame_count, channels))
+
+
+class StimulusBundle:
+    def __init__(self, folder, sample_rate=44100, channels=2, manifest=None):
+        """
+        Maps the stimuli of folder in the given format: from its bundle, built or rebuilt first if need be, or WAV by
+        WAV if the folder cannot be written. Files that can be neither are left to the caller, in self.unmapped.
+        """
+        if manifest is None:
+            manifest = StimulusManifest(folder)
+        self.folder = folder
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = {}  # stimulus path -> read-only frames x channels view into a memory map
+        self.unmapped = []
+        self.built = False
+
+        bundle_path = os.path.join(folder, BUNDLE_FILE_NAME)
+        index, data_offset = read_index(bundle_path)
+        if not is_current(index, manifest, sample_rate, channels):
+            try:
+                build_bundle(manifest, bundle_path, sample_rate, channels)
+                self.built = True
+            except (IOError, OSError, ValueError):
+                index = None  # read-only folder, or a file that cannot be converted
+            else:
+                index, data_offset = read_index(bundle_path)
+        if index is not None and index["stimuli"]:
+            total_frames = sum(entry["frames"] for entry in index["stimuli"].values())
+            pcm = np.memmap(bundle_path, dtype=np.int16, mode='r', offset=data_offset,
+                            shape=(total_frames, channels))
+            for stimulus in manifest.stimuli:
+                entry = index["stimuli"][os.path.basename(stimulus.path)]
+                self.frames[stimulus.path] = pcm[entry["offset"]:entry["offset"] + entry["frames"]]
+        elif index is None:
+            for stimulus in manifest.stimuli:
+                frames = map_wav(stimulus.path, sample_rate, channels)
+                if frames is None:
+                    self.unmapped.append(stimulus.path)
+                else:
+                    self.frames[stimulus.path] = frames
+
+    def __contains__(self, path):
+        return path in self.frames
+
+    def pcm(self, path):
+        """The interleaved PCM of path, as a view of the map (no copy)"""
+        return self.frames[path]
+
+    def mapped_bytes(self):
+        return sum(frames.nbytes for frames in self.frames.values())
+
+    def prefetch(self, path):
+        """Reads one sample per page of path, so its pages are in the page cache before it plays"""
+        frames = self.frames[path].reshape(-1)
+        return int(frames[::PAGE_SIZE // frames.itemsize].sum())
+
+
+if __name__ == "__main__":
+    for bundle_folder in sys.argv[1:]:
+        bundle = StimulusBundle(bundle_folder)
+        print "%s: %d stimuli mapped (%.1f MiB)%s%s" % \
+              (bundle_folder, len(bundle.frames), bundle.mapped_bytes() / 2.0 ** 20, ", bundle built" if bundle.built
+               else "", ", not mappable: " + ", ".join(bundle.unmapped) if bundle.unmapped else "")
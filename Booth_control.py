@@ -0,0 +1,174 @@
+"""
+Operator control of a running session.
+Booth_driver.py serves a SessionControl on a UNIX socket for as long as it runs, through the countdown and the
+paradigm, so the session can be paused, resumed, aborted or queried without Ctrl-C. Each connection sends one
+command and gets one reply:
+    python Booth_control.py status
+    python Booth_control.py pause|resume|abort [socket path]
+Pauses and aborts take effect between trials (see Booth.checkpoint), and a paused bird cannot start a trial. Time
+spent paused counts towards the session's duration. status only reads the session's counters from the server thread,
+so it never holds up the trial loop.
+"""
+import os
+import socket
+import sys
+import threading
+import time
+
+CONTROL_SOCKET = "booth.sock"
+COMMANDS = ("status", "pause", "resume", "abort")
+
+
+class SessionAborted(Exception):
+    pass
+
+
+class SessionControl:
+    def __init__(self):
+        self.state = "idle"  # idle, countdown, running or paused
+        self.session = None
+        self.session_start = None  # wall-clock time the session was attached
+        self.countdown_end = None
+        self._resumed = threading.Event()  # clear while paused
+        self._resumed.set()
+        self._aborted = threading.Event()
+
+    def attach(self, session):
+        """Puts session (a Booth) under this control"""
+        session.control = self
+        self.session = session
+        self.session_start = time.time()
+        if self.state == "idle":
+            self.state = "running"
+
+    def detach(self):
+        """Called once the session has closed; clears any pause or abort left over from it"""
+        self.session = None
+        self.state = "idle"
+        self._aborted.clear()
+        self._resumed.set()
+
+    def is_paused(self):
+        return not self._resumed.is_set()
+
+    def pause(self):
+        if self.state not in ("running", "countdown"):
+            return "nothing to pause (" + self.state + ")"
+        self._resumed.clear()
+        self.state = "paused"
+        return "pausing before the next trial"
+
+    def resume(self):
+        if self.state != "paused":
+            return "not paused (" + self.state + ")"
+        self.state = "running"
+        self._resumed.set()
+        return "resumed"
+
+    def abort(self):
+        self._aborted.set()
+        self._resumed.set()  # a paused session has to wake up to end
+        return "aborting " + ("the countdown" if self.state == "countdown" else "the session")
+
+    def checkpoint(self):
+        """
+        Blocks while paused and raises SessionAborted after an abort. It waits in 0.5 s slices, because on Python 2 an
+        untimed wait cannot be interrupted by Ctrl-C.
+        """
+        while not self._resumed.wait(0.5):
+            pass
+        if self._aborted.is_set():
+            raise SessionAborted()
+
+    def countdown(self, seconds):
+        """Sleeps like time.sleep as part of a countdown, but raises SessionAborted as soon as it is aborted"""
+        if self.state == "idle":
+            self.state = "countdown"
+        self.countdown_end = time.time() + seconds
+        if self._aborted.wait(seconds):
+            raise SessionAborted()
+
+    def end_countdown(self):
+        self.countdown_end = None
+        if self.state == "countdown":
+            self.state = "running"
+
+    def status(self):
+        lines = ["state: " + self.state]
+        if self.countdown_end is not None:
+            lines.append("countdown: %.0f s left" % max(0, self.countdown_end - time.time()))
+        session = self.session
+        if session is not None:
+            lines.append("session: %s, attached %.0f s ago" % (session.subject_paradigm_id,
+                                                              time.time() - self.session_start))
+            if session.timing.paradigm is not None:
+                lines.append("paradigm: %s, trial %s" % (session.timing.paradigm, session.timing.trial_number))
+            lines.append("pecks: %d; perch %s" % (session.switch.press_count, session.switch.tracker.report()))
+            if session.metrics is not None:
+                lines.append(session.metrics.report())
+        return "\n".join(lines)
+
+    def handle(self, command):
+        if command not in COMMANDS:
+            return "unknown command " + repr(command) + "; expected one of " + ", ".join(COMMANDS)
+        return getattr(self, command)()
+
+
+class ControlServer:
+    def __init__(self, control, path=CONTROL_SOCKET):
+        """Serves control on a UNIX socket at path, from a daemon thread blocked in accept() between commands"""
+        self.control = control
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)  # left by a driver that was killed
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(path)
+        self.socket.listen(1)
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except socket.error:
+                return  # closed
+            try:
+                command = connection.makefile().readline().strip()
+                connection.sendall(self.control.handle(command) + "\n")
+            except socket.error:
+                pass
+            finally:
+                connection.close()
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def send_command(command, path=CONTROL_SOCKET):
+    """Sends one command to a ControlServer and returns its reply"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    try:
+        client.sendall(command + "\n")
+        reply = []
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            reply.append(data)
+    finally:
+        client.close()
+    return "".join(reply).rstrip("\n")
+
+
+if __name__ == "__main__":
+    print send_command(sys.argv[1] if len(sys.argv) > 1 else "status",
+                       sys.argv[2] if len(sys.argv) > 2 else CONTROL_SOCKET)
@@ -0,0 +1,299 @@
+"""
+SQLite storage of trials across sessions.
+Every trial of the paradigm csv layouts (see Booth_store.LAYOUTS) can also be kept in one local SQLite database, so
+questions across subjects and days ("all operant trials of bird X at SNR -4 in the last 30 days") are one indexed
+query instead of globbing and parsing hundreds of csv files:
+    sessions: one per paradigm csv (title), with its session id, subject, date (YYYY-MM-DD) and paradigm
+    stimuli: one per stimulus name, with the SNR its name gives (Booth_stimuli.parse_snr)
+    trials: one per trial, keyed by session and trial number; columns a csv lacks (e.g. Stimulus in files from
+        before it was logged) are NULL
+The database is in WAL mode, so analyses can read it while booths write to it. Booth (with DATABASE set) hands rows
+to a TrialDatabase, which inserts them in batches from a background thread, away from the trial's timed path.
+Existing csv files are imported with
+    python Booth_database.py booth.db <data folder or csv file> ...
+and queried with query_trials(), which returns a NumPy structured array.
+"""
+import atexit
+import csv
+import os
+import sqlite3
+import sys
+import threading
+import time
+import Queue
+from datetime import datetime
+import numpy as np
+from Booth_analysis import parse_session
+from Booth_metrics import OUTCOMES
+from Booth_stimuli import parse_snr
+from Booth_store import LAYOUTS, layout_header, layout_for_title
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (id INTEGER PRIMARY KEY, title TEXT NOT NULL UNIQUE, session_id TEXT NOT NULL,
+                                     subject TEXT NOT NULL, date TEXT, paradigm TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS stimuli (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, snr INTEGER);
+CREATE TABLE IF NOT EXISTS trials (session INTEGER NOT NULL REFERENCES sessions (id), trial_number INTEGER NOT NULL,
+                                   trial_type TEXT, stimulus INTEGER REFERENCES stimuli (id), snr INTEGER,
+                                   response_time REAL, outcome TEXT, time_from_start REAL,
+                                   PRIMARY KEY (session, trial_number));
+CREATE INDEX IF NOT EXISTS sessions_subject_date ON sessions (subject, date);
+CREATE INDEX IF NOT EXISTS sessions_date ON sessions (date);
+CREATE INDEX IF NOT EXISTS sessions_paradigm ON sessions (paradigm, date);
+CREATE INDEX IF NOT EXISTS stimuli_snr ON stimuli (snr);
+CREATE INDEX IF NOT EXISTS trials_stimulus ON trials (stimulus);
+"""
+TRIAL_FIELDS = ("trial_number", "trial_type", "stimulus", "snr", "response_time", "outcome", "time_from_start")
+# What query_trials returns; missing numbers are NaN (floats) or the type's minimum (ints), as in Booth_store
+QUERY_DTYPE = np.dtype([("subject", object), ("date", object), ("session_id", object), ("paradigm", object),
+                        ("trial_number", "<i4"), ("trial_type", object), ("stimulus", object), ("snr", "<f8"),
+                        ("response_time", "<f8"), ("outcome", object), ("time_from_start", "<f8")])
+
+_CLOSE = object()  # queue marker that stops the database thread
+_open_databases = set()
+
+
+def connect(file_name):
+    """Opens (creating if need be) a trial database in WAL mode"""
+    connection = sqlite3.connect(file_name, timeout=30)  # waits for other booths' writes to the same file
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent; only the last commits can be lost
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def row_values(layout_name, row, header=None):
+    """
+    The TRIAL_FIELDS values of one csv row of a layout. Columns are found by header (the file's own header row; the
+    layout's by default), and fields whose columns it lacks are None.
+    Raises ValueError for a row that cannot be read.
+    """
+    if header is None:
+        header = layout_header(LAYOUTS[layout_name])
+    if len(row) != len(header):
+        raise ValueError("%d columns instead of %d" % (len(row), len(header)))
+    positions = dict((column, index) for index, column in enumerate(header))
+    values = dict.fromkeys(TRIAL_FIELDS)
+    for name, kind, columns in LAYOUTS[layout_name]:
+        if not all(column in positions for column in columns):
+            continue
+        cells = [row[positions[column]] for column in columns]
+        if kind == "onehot":
+            flags = [int(cell) for cell in cells]
+            if flags.count(1) != 1:
+                raise ValueError("no single outcome among " + ", ".join(columns))
+            values[name] = OUTCOMES[flags.index(1)]
+        elif kind == "category":
+            values[name] = str(cells[0])
+        elif cells[0] in ("NA", "", None):
+            values[name] = None
+        else:
+            values[name] = float(cells[0]) if kind == "float" else int(cells[0])
+    if values["trial_number"] is None:
+        raise ValueError("no trial number")
+    return values
+
+
+class TrialInserter:
+    """Inserts the rows of paradigm csv titles into a connection, remembering session and stimulus ids"""
+    def __init__(self, connection):
+        self.connection = connection
+        self.sessions = {}  # title -> sessions.id
+        self.stimuli = {}  # name -> stimuli.id
+
+    def session(self, title, date=None):
+        """sessions.id of title, added with its session id, subject and date (date, if the title has none)"""
+        if title not in self.sessions:
+            paradigm, session_id, subject, title_date = parse_session(title + '.csv')
+            if title_date is not None:
+                date = title_date
+            self.connection.execute("INSERT OR IGNORE INTO sessions (title, session_id, subject, date, paradigm) "
+                                    "VALUES (?, ?, ?, ?, ?)", (title, session_id, subject,
+                                                               None if date is None else date.strftime('%Y-%m-%d'),
+                                                               paradigm))
+            self.sessions[title] = self.connection.execute("SELECT id FROM sessions WHERE title = ?",
+                                                           (title,)).fetchone()[0]
+        return self.sessions[title]
+
+    def stimulus(self, name):
+        if name not in self.stimuli:
+            self.connection.execute("INSERT OR IGNORE INTO stimuli (name, snr) VALUES (?, ?)",
+                                    (name, parse_snr(os.path.basename(name))))
+            self.stimuli[name] = self.connection.execute("SELECT id FROM stimuli WHERE name = ?",
+                                                         (name,)).fetchone()[0]
+        return self.stimuli[name]
+
+    def insert(self, title, rows, date=None):
+        """Inserts csv rows of a paradigm title; a trial inserted again is replaced"""
+        layout_name = layout_for_title(title)
+        return self.insert_values(title, [row_values(layout_name, row) for row in rows], date)
+
+    def insert_values(self, title, trials, date=None):
+        """Inserts trials (row_values dicts) of a paradigm title"""
+        session = self.session(title, date)
+        records = []
+        for values in trials:
+            if values["stimulus"] is not None:
+                values["stimulus"] = self.stimulus(values["stimulus"])
+            records.append((session,) + tuple(values[name] for name in TRIAL_FIELDS))
+        self.connection.executemany("INSERT OR REPLACE INTO trials (session, " + ", ".join(TRIAL_FIELDS) +
+                                    ") VALUES (" + ", ".join("?" * (len(TRIAL_FIELDS) + 1)) + ")", records)
+        return len(records)
+
+
+class TrialDatabase:
+    def __init__(self, file_name, batch_rows=50, batch_seconds=10):
+        """
+        Keeps the rows given to write() in file_name. They are inserted by a background thread, in one transaction
+        per batch: once batch_rows rows are waiting or the oldest has waited batch_seconds, and at close().
+        """
+        self.file_name = file_name
+        self.batch_rows = batch_rows
+        self.batch_seconds = batch_seconds
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        _open_databases.add(self)
+
+    def write(self, title, row):
+        """Queues one csv row of a paradigm title (see Booth_store.layout_for_title)"""
+        self._queue.put((title, row))
+
+    def _insert(self, inserter, pending):
+        by_title = {}
+        for title, row in pending:
+            by_title.setdefault(title, []).append(row)
+        try:
+            with inserter.connection:  # one transaction
+                for title, rows in by_title.items():
+                    inserter.insert(title, rows, datetime.now())
+        except (sqlite3.Error, ValueError) as error:  # the csv files still have the rows
+            print "Could not write " + str(len(pending)) + " trials to " + self.file_name + ": " + str(error)
+
+    def _run(self):
+        inserter = TrialInserter(connect(self.file_name))
+        pending = []
+        first_pending_time = None
+        while True:
+            timeout = None if not pending else max(0, first_pending_time + self.batch_seconds - time.time())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Queue.Empty:
+                item = None
+            if item is _CLOSE:
+                break
+            if item is not None:
+                if not pending:
+                    first_pending_time = time.time()
+                pending.append(item)
+            if pending and (len(pending) >= self.batch_rows or
+                            time.time() - first_pending_time >= self.batch_seconds):
+                self._insert(inserter, pending)
+                pending = []
+        if pending:
+            self._insert(inserter, pending)
+        inserter.connection.close()
+
+    def close(self):
+        """Inserts every queued row and closes the database"""
+        if self not in _open_databases:
+            return
+        _open_databases.discard(self)
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+
+@atexit.register
+def close_all_databases():
+    for database in list(_open_databases):
+        database.close()
+
+
+def import_csv(connection, path):
+    """
+    Imports one paradigm csv, of any layout it was written with: columns are found by the file's header row.
+    Returns (trials imported, problems), problems being (line number, message) for every row left out; a file whose
+    name has no trial layout, or whose header has no Trial_number, is left out whole, as line 1.
+    Sessions without a date in their id are dated by the file's modification time.
+    """
+    title = os.path.basename(path)[:-len('.csv')]
+    layout_name = layout_for_title(title)
+    if layout_name is None:
+        return 0, [(1, "not a paradigm csv with trials")]
+    with open(path) as csv_file:
+        rows = list(csv.reader(csv_file))
+    if not rows or "Trial_number" not in rows[0]:
+        return 0, [(1, "no Trial_number column in the header")]
+    trials = []
+    problems = []
+    for line_number, row in enumerate(rows[1:], 2):
+        if row == rows[0]:
+            continue  # sessions run again under the same id used to write their header again
+        try:
+            trials.append(row_values(layout_name, row, rows[0]))
+        except ValueError as error:
+            problems.append((line_number, str(error)))
+    with connection:
+        return TrialInserter(connection).insert_values(title, trials,
+                                                       datetime.fromtimestamp(os.path.getmtime(path))), problems
+
+
+def import_paths(file_name, paths):
+    """Imports every paradigm csv among paths (files or folders, searched recursively) into file_name"""
+    csv_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, file_names in os.walk(path):
+                csv_paths += [os.path.join(folder, name) for name in sorted(file_names) if name.endswith('.csv')]
+        else:
+            csv_paths.append(path)
+    connection = connect(file_name)
+    try:
+        for path in csv_paths:
+            if layout_for_title(os.path.basename(path)[:-len('.csv')]) is None:
+                continue  # timing, onset and other session logs
+            trial_count, problems = import_csv(connection, path)
+            print path + ": " + str(trial_count) + " trials" + \
+                ("" if not problems else ", " + str(len(problems)) + " rows left out")
+            for line_number, problem in problems:
+                print "    line " + str(line_number) + ": " + problem
+    finally:
+        connection.close()
+
+
+def query_trials(file_name, subject=None, paradigm=None, stimulus=None, snr=None, since=None, until=None):
+    """
+    Returns the trials matching every given condition as a QUERY_DTYPE array, in session date and trial order.
+    since and until (dates, datetimes or YYYY-MM-DD strings) bound the session date, both included; snr matches the
+    trial's SNR or, where the csv has none, its stimulus's.
+    """
+    conditions = []
+    arguments = []
+    for condition, value in (("sessions.subject = ?", subject), ("sessions.paradigm = ?", paradigm),
+                             ("stimuli.name = ?", stimulus), ("COALESCE(trials.snr, stimuli.snr) = ?", snr),
+                             ("sessions.date >= ?", since), ("sessions.date <= ?", until)):
+        if value is not None:
+            conditions.append(condition)
+            arguments.append(value.strftime('%Y-%m-%d') if hasattr(value, "strftime") else value)
+    connection = connect(file_name)
+    try:
+        rows = connection.execute(
+            "SELECT sessions.subject, sessions.date, sessions.session_id, sessions.paradigm, trials.trial_number, "
+            "trials.trial_type, stimuli.name, COALESCE(trials.snr, stimuli.snr), trials.response_time, "
+            "trials.outcome, trials.time_from_start "
+            "FROM trials JOIN sessions ON trials.session = sessions.id "
+            "LEFT JOIN stimuli ON trials.stimulus = stimuli.id" +
+            (" WHERE " + " AND ".join(conditions) if conditions else "") +
+            " ORDER BY sessions.date, sessions.title, trials.trial_number", arguments).fetchall()
+    finally:
+        connection.close()
+    missing = dict((name, np.nan if QUERY_DTYPE[name].kind == 'f' else np.iinfo(QUERY_DTYPE[name]).min)
+                   for name in QUERY_DTYPE.names if QUERY_DTYPE[name].kind in 'fi')
+    trials = np.zeros(len(rows), dtype=QUERY_DTYPE)
+    for index, name in enumerate(QUERY_DTYPE.names):
+        trials[name] = [missing.get(name) if row[index] is None else row[index] for row in rows]
+    return trials
+
+
+if __name__ == "__main__":
+    import_paths(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,136 @@
+"""
+Switch event log.
+Every debounced edge of the perch switch, whatever the paradigm is doing, is recorded with its monotonic time in ns:
+each press and release Booth_input.SwitchInput accepts, while bounces are only counted. Events go into a preallocated
+ring buffer (recording one is two array stores) and a background thread appends them in batches to
+<session>_switch_events.events. <session>_trial_events.csv gives the index of every trial's first event, so the pecks
+of any trial, outcome or ITI can be looked up offline.
+Running this file prints a summary of an event file:
+    python Booth_events.py subject_YYMMDD_switch_events.events
+"""
+import atexit
+import os
+import sys
+import threading
+import numpy as np
+
+MAGIC = b"BOOTHEVT"
+EVENT_DTYPE = np.dtype([("time_ns", "<i8"), ("pressed", "u1")])
+
+_open_logs = set()
+
+
+class SwitchEventLog:
+    def __init__(self, file_name, capacity=65536, flush_every=256, flush_interval=1.0):
+        """
+        Events are written to file_name (appended to if it exists) once flush_every of them are waiting, or
+        every flush_interval s. Events overwritten in the ring before they could be written are counted in dropped.
+        """
+        self.file_name = file_name
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.buffer = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self._times = self.buffer["time_ns"]  # field views, made once so record() allocates nothing
+        self._pressed = self.buffer["pressed"]
+        self.count = 0  # events recorded this session; the next event's index is first_index + count
+        self.flushed = 0
+        self.dropped = 0
+
+        is_new = not os.path.exists(file_name) or os.path.getsize(file_name) == 0
+        self._file = open(file_name, 'ab')
+        if is_new:
+            self._file.write(MAGIC)
+            self.first_index = 0
+        else:
+            self.first_index = (os.path.getsize(file_name) - len(MAGIC)) // EVENT_DTYPE.itemsize
+            # drop a half-written event left by a killed session, so new events stay aligned
+            self._file.truncate(len(MAGIC) + self.first_index * EVENT_DTYPE.itemsize)
+        self._closing = False
+        self._wake = threading.Event()
+        self._lock = threading.Lock()  # serializes flushes
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        _open_logs.add(self)
+
+    @property
+    def next_index(self):
+        """File index the next recorded event will get"""
+        return self.first_index + self.count
+
+    def record(self, time_ns, pressed):
+        """Called for every debounced edge; must stay cheap, it runs on the GPIO event thread"""
+        slot = self.count % self.capacity
+        self._times[slot] = time_ns
+        self._pressed[slot] = pressed
+        self.count += 1
+        if self.count - self.flushed >= self.flush_every:
+            self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            end = self.count
+            start = self.flushed
+            if end - start > self.capacity:
+                self.dropped += end - start - self.capacity
+                start = end - self.capacity
+            if start == end:
+                return
+            first_slot = start % self.capacity
+            last_slot = first_slot + (end - start)
+            if last_slot <= self.capacity:
+                self._file.write(self.buffer[first_slot:last_slot].tostring())
+            else:  # wraps around the end of the ring
+                self._file.write(self.buffer[first_slot:].tostring())
+                self._file.write(self.buffer[:last_slot - self.capacity].tostring())
+            self._file.flush()
+            self.flushed = end
+
+    def _run(self):
+        while not self._closing:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        if self not in _open_logs:
+            return
+        _open_logs.discard(self)
+        self._closing = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        self._file.close()
+
+
+@atexit.register
+def close_all_logs():
+    for log in list(_open_logs):
+        log.close()
+
+
+def read_events(file_name):
+    """Returns a read-only memory map of every complete event in file_name (fields time_ns and pressed)"""
+    with open(file_name, 'rb') as events_file:
+        if events_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(file_name + " is not a switch event file")
+    event_count = (os.path.getsize(file_name) - len(MAGIC)) // EVENT_DTYPE.itemsize
+    if event_count == 0:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    return np.memmap(file_name, dtype=EVENT_DTYPE, mode='r', offset=len(MAGIC), shape=(event_count,))
+
+
+def events_report(file_name):
+    events = read_events(file_name)
+    presses = events["time_ns"][events["pressed"] == 1]
+    print "%d events, %d presses" % (len(events), len(presses))
+    if len(presses) > 1:
+        intervals = np.diff(presses) / 1e6
+        print "inter-press interval ms: p1 %.1f  p50 %.1f  p99 %.1f; %d under 20 ms" % \
+              (np.percentile(intervals, 1), np.percentile(intervals, 50), np.percentile(intervals, 99),
+               np.count_nonzero(intervals < 20))
+
+
+if __name__ == "__main__":
+    events_report(sys.argv[1])
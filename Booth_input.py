@@ -0,0 +1,153 @@
+"""
+Edge-event input layer for the perch switch.
+RPi.GPIO watches the pin in its own thread and calls back on every edge, so waiting for a peck blocks on an Event
+instead of spinning on GPIO.input.
+Edges are debounced in software: the first edge of a press or release is taken at once, further edges within
+debounce_time are counted as bounces, and the level is read again when the window closes. A PerchTracker keeps the
+debounced perch state, how long it has been in it and the recent dwell times, so whether the bird has been off the
+perch long enough is a lookup rather than a timed wait.
+"""
+import threading
+from collections import deque
+from Booth_timing import SYSTEM_CLOCK
+
+
+class PerchTracker:
+    def __init__(self, clock, pressed=False, history=1000):
+        """Debounced perch state; the last history on and off dwell times (s) are kept"""
+        self.clock = clock
+        self.pressed = pressed
+        self.since = clock.monotonic()  # time of the last accepted transition
+        self.transition_count = 0
+        self.bounce_count = 0
+        self.on_dwells = deque(maxlen=history)
+        self.off_dwells = deque(maxlen=history)
+
+    def transition(self, t, pressed):
+        (self.on_dwells if self.pressed else self.off_dwells).append(t - self.since)
+        self.pressed = pressed
+        self.since = t
+        self.transition_count += 1
+
+    def on_for(self):
+        """How long the perch has been occupied without a break; 0 if it is free"""
+        return self.clock.monotonic() - self.since if self.pressed else 0
+
+    def off_for(self):
+        """How long the perch has been free; 0 if it is occupied"""
+        return 0 if self.pressed else self.clock.monotonic() - self.since
+
+    def warnings(self, max_bounce_ratio=5, stuck_time=300, min_transitions=20):
+        """
+        Signs of a failing switch: more than max_bounce_ratio bounce edges per press or release, or held down for
+        stuck_time s
+        """
+        warnings = []
+        if self.transition_count >= min_transitions and \
+                self.bounce_count > max_bounce_ratio * self.transition_count:
+            warnings.append("switch bouncing: %d bounces in %d transitions" %
+                            (self.bounce_count, self.transition_count))
+        if self.on_for() > stuck_time:
+            warnings.append("switch stuck? pressed for %.0f s" % self.on_for())
+        return warnings
+
+    def report(self):
+        on_dwells = sorted(self.on_dwells)
+        off_dwells = sorted(self.off_dwells)
+        return "%s for %.3f s; %d transitions, %d bounces; median dwell on %s s, off %s s" % \
+            ("on" if self.pressed else "off", self.clock.monotonic() - self.since, self.transition_count,
+             self.bounce_count, "%.3f" % on_dwells[len(on_dwells) // 2] if on_dwells else "NA",
+             "%.3f" % off_dwells[len(off_dwells) // 2] if off_dwells else "NA")
+
+
+class SwitchInput:
+    def __init__(self, gpio, pin, wait_slice=0.005, debounce_time=0.01, clock=SYSTEM_CLOCK):
+        """
+        gpio is the RPi.GPIO module (or anything with the same interface, see Booth_sim.SimulatedGPIO).
+        The pin must already be set up as an input with a pull-up; the switch is active low, so a peck reads 0.
+        wait_slice caps each blocking wait. On Python 2, Event.wait with a timeout polls internally with growing
+        sleeps, and the cap keeps detection latency within a few ms there.
+        debounce_time (s) can be changed at any time; 0 turns debouncing off.
+        """
+        self.gpio = gpio
+        self.pin = pin
+        self.wait_slice = wait_slice
+        self.debounce_time = debounce_time
+        self.clock = clock
+        self.edge_count = 0
+        self.press_count = 0
+        self.event_log = None  # a Booth_events.SwitchEventLog that gets every debounced edge, if set
+        self.tracker = PerchTracker(clock, self.read_level())
+
+        self._settle_time = None  # end of the debounce window of the last accepted edge
+        self._lock = threading.RLock()  # a virtual clock may run _settle from inside _accept
+        self._edge = threading.Event()
+        self.gpio.remove_event_detect(self.pin)  # in case a previous session left it enabled
+        self.gpio.add_event_detect(self.pin, self.gpio.BOTH, callback=self._on_edge)
+
+    def read_level(self):
+        """The raw, undebounced switch level"""
+        return self.gpio.input(self.pin) == 0
+
+    def _on_edge(self, channel):
+        edge_time = self.clock.monotonic()
+        with self._lock:
+            self.edge_count += 1
+            if self._settle_time is not None and edge_time < self._settle_time:
+                self.tracker.bounce_count += 1
+            elif self.read_level() == self.tracker.pressed:
+                self.tracker.bounce_count += 1  # a glitch over before the level was read
+            else:
+                self._accept(edge_time, not self.tracker.pressed)
+
+    def _accept(self, t, pressed):
+        self.tracker.transition(t, pressed)
+        if pressed:
+            self.press_count += 1
+        if self.event_log is not None:
+            self.event_log.record(int(t * 1e9), pressed)
+        self._edge.set()
+        if self.debounce_time > 0:
+            self._settle_time = t + self.debounce_time
+            self.clock.call_at(self._settle_time, self._settle)
+        else:
+            self._settle_time = None
+
+    def _settle(self, t):
+        """End of a debounce window: takes a level change hidden by the bounces"""
+        with self._lock:
+            self._settle_time = None
+            if self.read_level() != self.tracker.pressed:
+                self._accept(t, not self.tracker.pressed)
+
+    def is_pressed(self):
+        return self.tracker.pressed
+
+    def _wait_for_level(self, pressed, timeout):
+        start_time = self.clock.monotonic()
+        current_time = 0.0
+        while timeout is None or current_time < timeout:
+            # Clear before reading the level, so an edge landing in between still wakes the wait below
+            self._edge.clear()
+            if self.is_pressed() == pressed:
+                return current_time
+            if timeout is None:
+                self._edge.wait(self.wait_slice)
+            else:
+                self._edge.wait(min(timeout - current_time, self.wait_slice))
+            current_time = self.clock.monotonic() - start_time
+        return None
+
+    def wait_for_press(self, timeout=None):
+        """
+        Waits for the switch to be pressed, forever or for timeout seconds.
+        Returns the time waited if pressed (0 if it already was), and None otherwise.
+        """
+        return self._wait_for_level(True, timeout)
+
+    def wait_for_release(self, timeout=None):
+        """Same as wait_for_press, for the switch being let go"""
+        return self._wait_for_level(False, timeout)
+
+    def close(self):
+        self.gpio.remove_event_detect(self.pin)
@@ -0,0 +1,196 @@
+"""
+Crash-safe session journal.
+Every Booth appends to <session>.journal, one JSON record per line: the start of each paradigm with its parameters,
+every trial schedule (as the seed and settings it is drawn from, see Booth_trials.py) and every completed trial.
+A record costs one buffered write and flush on the trial thread. It reaches the SD card through an fsync on a
+background thread, so the trial loop never waits for the card.
+If the Pi reboots or the process dies, the paradigm's unfinished run can be rebuilt from the journal: its schedules,
+the trials already done, the elapsed session time and the online metrics. go_nogo, scene_discrimination and
+classical_to_operant_conditioning then continue from the next trial when called with resume=True. To resume a
+session by hand:
+    sudo python Booth_journal.py subject_YYMMDD
+"""
+import atexit
+import inspect
+import json
+import os
+import sys
+import threading
+
+RESUMABLE_PARADIGMS = ("go_nogo", "scene_discrimination", "classical_to_operant_conditioning")
+
+_open_journals = set()
+
+
+def _json_default(value):
+    """NumPy values and arrays as their Python equivalents, Booth_metrics.Rules as their keyword dicts"""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return value.__dict__
+
+
+def read_journal(file_name):
+    """Returns the records of file_name; a last line cut short by a crash is left out"""
+    records = []
+    if not os.path.exists(file_name):
+        return records
+    with open(file_name) as journal_file:
+        for line in journal_file:
+            if not line.endswith("\n"):
+                break
+            records.append(json.loads(line))
+    return records
+
+
+class ResumeState:
+    def __init__(self, start, records):
+        """The journal of one unfinished paradigm run: its start record and every record after it"""
+        self.paradigm = start["paradigm"]
+        self.parameters = start["parameters"]
+        self.records = records
+
+    def last_schedule(self, phase=None):
+        for record in reversed(self.records):
+            if record["type"] == "schedule" and (phase is None or record["phase"] == phase):
+                return record
+        return None
+
+    def trials(self, phase=None):
+        return [record for record in self.records
+                if record["type"] == "trial" and (phase is None or record["phase"] == phase)]
+
+    def next_trial(self, phase):
+        """Number of the first trial of phase still to do"""
+        trials = self.trials(phase)
+        return trials[-1]["trial"] + 1 if trials else 1
+
+    def elapsed(self):
+        """Paradigm time (s) at the last journaled trial or schedule"""
+        for record in reversed(self.records):
+            if "elapsed" in record:
+                return record["elapsed"]
+        return 0
+
+    def replay(self, metrics):
+        """Puts the outcomes of the trials already done back into metrics (a Booth_metrics.PerformanceMetrics)"""
+        for record in self.trials():
+            if record.get("outcome") is not None:
+                metrics.update(record["outcome"], record.get("snr"))
+
+
+class SessionJournal:
+    def __init__(self, file_name, fsync=True):
+        self.file_name = file_name
+        self.fsync = fsync
+        self._records = read_journal(file_name)
+        self._file = open(file_name, 'a')
+        self._file.truncate(self._complete_size())  # drops a record cut short by a crash
+        self._dirty = threading.Event()
+        self._closing = False
+        self._thread = threading.Thread(target=self._sync)
+        self._thread.daemon = True
+        self._thread.start()
+        _open_journals.add(self)
+
+    def _complete_size(self):
+        """Size of the journal up to the end of its last complete line"""
+        with open(self.file_name, 'rb') as journal_file:
+            return journal_file.read().rfind("\n") + 1
+
+    def write(self, record):
+        self._records.append(record)
+        self._file.write(json.dumps(record, default=_json_default, separators=(',', ':')) + "\n")
+        self._file.flush()
+        self._dirty.set()
+
+    def _sync(self):
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            if self._closing:
+                return
+            if self.fsync:
+                try:
+                    os.fsync(self._file.fileno())
+                except (OSError, ValueError):
+                    return  # closed meanwhile
+
+    def begin(self, paradigm, parameters):
+        self.write({"type": "start", "paradigm": paradigm, "parameters": parameters})
+
+    def schedule(self, phase, elapsed, **schedule):
+        """The trial schedule of phase, drawn elapsed s into the paradigm"""
+        record = {"type": "schedule", "phase": phase, "elapsed": elapsed}
+        record.update(schedule)
+        self.write(record)
+
+    def trial(self, phase, trial_number, elapsed, outcome=None, snr=None):
+        """Trial trial_number of phase is done (its csv row written); outcome is one of Booth_metrics.OUTCOMES"""
+        record = {"type": "trial", "phase": phase, "trial": trial_number, "elapsed": elapsed}
+        if outcome is not None:
+            record["outcome"] = outcome
+        if snr is not None:
+            record["snr"] = snr
+        self.write(record)
+
+    def end(self, result=None):
+        self.write({"type": "end", "result": result})
+
+    def unfinished(self, paradigm=None):
+        """ResumeState of the last paradigm run if it did not end (and is a run of paradigm), else None"""
+        for index in range(len(self._records) - 1, -1, -1):
+            record = self._records[index]
+            if record["type"] == "end":
+                return None
+            if record["type"] == "start":
+                if paradigm is not None and record["paradigm"] != paradigm:
+                    return None
+                return ResumeState(record, self._records[index + 1:])
+        return None
+
+    def close(self):
+        if self not in _open_journals:
+            return
+        _open_journals.discard(self)
+        self._closing = True
+        self._dirty.set()
+        self._thread.join()
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._file.close()
+
+
+@atexit.register
+def close_all_journals():
+    for journal in list(_open_journals):
+        journal.close()
+
+
+def resume_session(session_id):
+    """
+    Continues session_id's unfinished paradigm, with the parameters it was started with (but for any the paradigm no
+    longer takes, e.g. the unused punishment_time of journals from before its removal)
+    """
+    from Booth import Booth
+
+    records = read_journal(session_id + ".journal")
+    starts = [record for record in records if record["type"] in ("start", "end")]
+    if not starts or starts[-1]["type"] != "start":
+        print session_id + " has no unfinished paradigm to resume"
+        return None
+    if starts[-1]["paradigm"] not in RESUMABLE_PARADIGMS:
+        print starts[-1]["paradigm"] + " cannot be resumed; only " + ", ".join(RESUMABLE_PARADIGMS)
+        return None
+    names = inspect.getargspec(getattr(Booth, starts[-1]["paradigm"])).args
+    parameters = dict((name, value) for name, value in starts[-1]["parameters"].items() if name in names)
+    session = Booth(session_id)
+    try:
+        return getattr(session, starts[-1]["paradigm"])(resume=True, **parameters)
+    finally:
+        session.close()
+        session.gpio.cleanup()
+
+
+if __name__ == "__main__":
+    resume_session(sys.argv[1])
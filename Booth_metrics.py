@@ -0,0 +1,131 @@
+"""
+Online performance metrics for the go/no-go paradigms.
+Hits, misses, correct rejections and false alarms are counted as trials happen: over the whole session, over sliding
+windows of the last n trials and per SNR. Each update is O(1), so hit rate, false alarm rate, d' and criterion c are
+always current and stop/advance rules can be checked after every trial.
+Rates use the log-linear correction (0.5 added to every count, Hautus 1995), so d' stays finite at 0 or 100%.
+"""
+import math
+from collections import deque
+
+OUTCOMES = ("hit", "miss", "reject", "false_alarm")  # same order as the csv columns and the trial store codes
+STATISTICS = ("trials", "hit_rate", "false_alarm_rate", "d_prime", "criterion")
+COMPARISONS = {">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+               "<": lambda a, b: a < b, "<=": lambda a, b: a <= b}
+
+
+def norm_ppf(p):
+    """Inverse of the standard normal cdf (Acklam's rational approximation, relative error < 1.2e-9)"""
+    a = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+    b = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01)
+    c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+    d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00)
+    if p < 0.02425:
+        q = math.sqrt(-2 * math.log(p))
+        return (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+               ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1)
+    if p > 1 - 0.02425:
+        return -norm_ppf(1 - p)
+    q = p - 0.5
+    r = q * q
+    return (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / \
+           (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1)
+
+
+def summarize(counts):
+    """Returns a dict of STATISTICS for a [hits, misses, rejects, false alarms] list"""
+    hits, misses, rejects, false_alarms = counts
+    hit_rate = (hits + 0.5) / (hits + misses + 1.0)
+    false_alarm_rate = (false_alarms + 0.5) / (false_alarms + rejects + 1.0)
+    z_hit = norm_ppf(hit_rate)
+    z_false_alarm = norm_ppf(false_alarm_rate)
+    return {"trials": sum(counts), "hit_rate": hit_rate, "false_alarm_rate": false_alarm_rate,
+            "d_prime": z_hit - z_false_alarm, "criterion": -(z_hit + z_false_alarm) / 2}
+
+
+class SlidingCounts:
+    def __init__(self, size):
+        """Outcome counts of the last size trials"""
+        self.size = size
+        self.outcomes = deque()
+        self.counts = [0] * len(OUTCOMES)
+
+    def add(self, code):
+        self.outcomes.append(code)
+        self.counts[code] += 1
+        if len(self.outcomes) > self.size:
+            self.counts[self.outcomes.popleft()] -= 1
+
+
+class PerformanceMetrics:
+    def __init__(self, windows=(100,)):
+        """Keeps session counts, per-SNR counts and a sliding window for every size in windows"""
+        self.counts = [0] * len(OUTCOMES)
+        self.by_snr = {}
+        self.windows = dict((size, SlidingCounts(size)) for size in windows)
+
+    def update(self, outcome, snr=None):
+        """outcome is one of OUTCOMES"""
+        code = OUTCOMES.index(outcome)
+        self.counts[code] += 1
+        if snr is not None:
+            self.by_snr.setdefault(snr, [0] * len(OUTCOMES))[code] += 1
+        for window in self.windows.values():
+            window.add(code)
+
+    def summary(self, window=None, snr=None):
+        """Statistics of the session, of the last window trials or of one SNR"""
+        if window is not None:
+            return summarize(self.windows[window].counts)
+        if snr is not None:
+            return summarize(self.by_snr.get(snr, [0] * len(OUTCOMES)))
+        return summarize(self.counts)
+
+    def report(self):
+        lines = []
+        for label, statistics in [("session", self.summary())] + \
+                [("last %d" % size, self.summary(window=size)) for size in sorted(self.windows)] + \
+                [("SNR %d dB" % snr, self.summary(snr=snr)) for snr in sorted(self.by_snr)]:
+            lines.append("%-12s n=%4d hit=%.2f fa=%.2f d'=%5.2f c=%5.2f" %
+                         (label, statistics["trials"], statistics["hit_rate"], statistics["false_alarm_rate"],
+                          statistics["d_prime"], statistics["criterion"]))
+        return "\n".join(lines)
+
+
+class Rule:
+    def __init__(self, statistic, comparison, threshold, window=None, min_trials=0, action="stop"):
+        """
+        Fires once statistic (one of STATISTICS) compared with threshold holds, e.g.
+        Rule("d_prime", ">", 1.5, window=100, action="advance") for d' > 1.5 over the last 100 trials.
+        window=None uses the whole session. A windowed rule waits until its window is full, and no rule fires before
+        min_trials trials. action is "stop" (end the session) or "advance" (end it and move to the next stage).
+        """
+        if statistic not in STATISTICS:
+            raise ValueError("statistic must be one of " + ", ".join(STATISTICS))
+        if comparison not in COMPARISONS:
+            raise ValueError("comparison must be one of " + ", ".join(sorted(COMPARISONS)))
+        if action not in ("stop", "advance"):
+            raise ValueError("action must be stop or advance")
+        self.statistic = statistic
+        self.comparison = comparison
+        self.threshold = threshold
+        self.window = window
+        self.min_trials = max(min_trials, window or 0)
+        self.action = action
+
+    def check(self, metrics):
+        statistics = metrics.summary(window=self.window)
+        return sum(metrics.counts) >= self.min_trials and \
+            COMPARISONS[self.comparison](statistics[self.statistic], self.threshold)
+
+    def __str__(self):
+        return "%s %s %s over %s" % (self.statistic, self.comparison, self.threshold,
+                                     "the session" if self.window is None else "the last %d trials" % self.window)
+
+
+def make_rules(rules):
+    """Accepts Rules or their keyword dicts (as in JSON booth and protocol files)"""
+    return [rule if isinstance(rule, Rule) else Rule(**rule) for rule in rules or []]
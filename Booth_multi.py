@@ -0,0 +1,103 @@
+"""
+Runs several booths from one Raspberry Pi.
+Each booth has its own pins, audio output device and session id, and runs its session in its own process, so booths
+keep independent timing and output files and do not share the interpreter lock or the mixer.
+Run as: sudo python Booth_multi.py booths.json
+where booths.json holds a list of booth definitions, e.g.
+[{"session_id": "bird1_190428", "protocol": "go_nogo",
+  "pins": {"PUFFER_PIN": 11, "REWARD_PIN": 19, "SWITCH_PIN": 15, "LED_PIN": 16},
+  "audio_device": "USB Audio Device, USB Audio", "audio_buffer": 512,
+  "parameters": {"go_sound": "2000HZ_TONE.wav", "nogo_sound": "3000HZ_TONE.wav", "probability": 0.5,
+                 "rules": [{"statistic": "d_prime", "comparison": ">", "threshold": 1.5, "window": 100,
+                            "action": "advance"}]},
+  "advance_to": {"protocol": "scene_discrimination", "parameters": {"go_path": "go", "nogo_path": "nogo"}}},
+ ...]
+A booth can also set the Booth constructor's other SETTINGS ("audio_output", "audio_frequency", "audio_buffer",
+"debounce_time").
+A booth's optional "advance_to" stage (which can have its own "advance_to") starts as soon as a rule with the
+"advance" action ends the previous one.
+"""
+import json
+import multiprocessing
+import sys
+from Booth import Booth
+
+PROTOCOLS = ("switch_test", "introduction", "shaping", "shaping_two_pecks", "shaping_timed", "go_nogo",
+             "scene_discrimination", "classical_to_operant_conditioning")
+
+
+def check_booths(booths):
+    """Raises ValueError if a booth definition is incomplete or two booths share a session id or a pin"""
+    session_ids = set()
+    pin_owners = {}
+    for booth in booths:
+        session_id = booth.get("session_id")
+        if not session_id:
+            raise ValueError("Every booth needs a session_id")
+        if session_id in session_ids:
+            raise ValueError("Session id " + session_id + " is used by more than one booth")
+        session_ids.add(session_id)
+
+        stage = booth
+        while stage is not None:
+            if stage.get("protocol") not in PROTOCOLS:
+                raise ValueError(session_id + ": protocol must be one of " + ", ".join(PROTOCOLS))
+            stage = stage.get("advance_to")
+
+        pins = booth.get("pins", {})
+        for pin_name in Booth.PIN_NAMES:
+            if pin_name not in pins:
+                raise ValueError(session_id + ": missing " + pin_name + "; booths sharing a Pi must set every pin")
+            pin = pins[pin_name]
+            if pin in pin_owners:
+                raise ValueError(session_id + ": pin " + str(pin) + " is already used by " + pin_owners[pin])
+            pin_owners[pin] = session_id
+
+
+def booth_settings(booth):
+    """The Booth keyword arguments (SETTINGS) a booth definition sets"""
+    return dict((key, booth[key]) for key in Booth.SETTINGS if booth.get(key) is not None)
+
+
+def run_booth(booth, gpio=None):
+    """Runs one booth's session to the end; this is the body of each booth's process"""
+    session = Booth(booth["session_id"], gpio=gpio, **booth_settings(booth))
+    stage = booth
+    try:
+        while stage is not None:
+            result = getattr(session, stage["protocol"])(**stage.get("parameters", {}))
+            stage = stage.get("advance_to") if result == "advance" else None
+    except KeyboardInterrupt:
+        pass
+    finally:
+        session.close()
+        # Only release this booth's pins; the other booths are still running
+        session.gpio.cleanup([booth["pins"][pin_name] for pin_name in Booth.PIN_NAMES])
+
+
+def run_booths(booths, target=run_booth):
+    """
+    Starts one process per booth running target(booth) and waits for all of them.
+    Returns a dict of session id -> process exit code.
+    """
+    check_booths(booths)
+    processes = [multiprocessing.Process(target=target, args=(booth,), name=booth["session_id"])
+                 for booth in booths]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:  # Ctrl-C reaches every booth process too; let them write out their data
+        for process in processes:
+            process.join()
+    return dict((process.name, process.exitcode) for process in processes)
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1]) as booths_file:
+        booth_definitions = json.load(booths_file)
+    exit_codes = run_booths(booth_definitions)
+    for booth_session_id in sorted(exit_codes):
+        print booth_session_id + ": " + ("finished" if exit_codes[booth_session_id] == 0 else
+                                         "failed (exit code " + str(exit_codes[booth_session_id]) + ")")
@@ -0,0 +1,175 @@
+"""
+Preflight validation of stimulus files.
+Every WAV a session will play is decoded and checked (format, sample rate, channels, duration and clipping) in a
+process pool before the session starts, and one summary report is printed. Measurements are cached by content hash,
+so files that have not changed since an earlier run are not decoded again. Stimulus specs (see Booth_synth.py) are
+synthesized and checked the same way.
+Run as: python Booth_preflight.py <wav file, folder or stimulus spec> ...
+"""
+import json
+import multiprocessing
+import os
+import sys
+import wave
+import numpy as np
+from Booth_stimuli import StimulusManifest, file_hash
+from Booth_synth import is_spec, synthesize
+
+CACHE_FILE_NAME = os.path.expanduser("~/.booth_preflight_cache.json")
+
+SAMPLE_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+def measure_wav(path):
+    """
+    Decodes path and returns its measurements, or a dict with an "error" message if it cannot be decoded.
+    Runs in the pool's worker processes.
+    """
+    try:
+        wav = wave.open(path, 'rb')
+        try:
+            channels, sample_width, sample_rate, frame_count = wav.getparams()[:4]
+            frames = wav.readframes(frame_count)
+        finally:
+            wav.close()
+    except (wave.Error, EOFError, IOError) as error:
+        return {"error": str(error) or type(error).__name__}
+    if sample_width not in SAMPLE_DTYPES:
+        return {"error": str(8 * sample_width) + "-bit samples are not supported"}
+
+    samples = np.frombuffer(frames, dtype=SAMPLE_DTYPES[sample_width])
+    if sample_width == 1:  # 8-bit WAVs are unsigned
+        samples = samples.astype(np.int16) - 128
+    full_scale = 2 ** (8 * sample_width - 1)
+    peak = int(np.abs(samples.astype(np.int64)).max()) if len(samples) else 0
+    clipped = int(np.count_nonzero((samples >= full_scale - 1) | (samples <= -full_scale))) if len(samples) else 0
+    return {"channels": channels, "sample_width": sample_width, "sample_rate": sample_rate,
+            "duration": frame_count / float(sample_rate), "peak": peak / float(full_scale),
+            "clipped_fraction": clipped / float(max(len(samples), 1))}
+
+
+def measure_spec(spec, sample_rate):
+    """The measurements of a stimulus spec synthesized at sample_rate, as measure_wav's of a 16-bit mono WAV"""
+    try:
+        samples = synthesize(spec, sample_rate)
+    except ValueError as error:
+        return {"error": str(error)}
+    return {"channels": 1, "sample_width": 2, "sample_rate": sample_rate, "duration": len(samples) / float(sample_rate),
+            "peak": float(np.abs(samples).max()) if len(samples) else 0,
+            "clipped_fraction": np.count_nonzero(np.abs(samples) >= 1) / float(max(len(samples), 1))}
+
+
+def evaluate(measurements, sample_rate, channels, min_duration, max_duration, max_clipped_fraction):
+    """Returns (errors, warnings) for one file's measurements"""
+    if "error" in measurements:
+        return [measurements["error"]], []
+    errors = []
+    warnings = []
+    if measurements["duration"] < min_duration:
+        errors.append("too short (%.3f s)" % measurements["duration"])
+    elif measurements["duration"] > max_duration:
+        warnings.append("long (%.1f s)" % measurements["duration"])
+    if measurements["channels"] not in channels:
+        errors.append("%d channels" % measurements["channels"])
+    if sample_rate is not None and measurements["sample_rate"] != sample_rate:
+        warnings.append("%d Hz, will be resampled" % measurements["sample_rate"])
+    if measurements["clipped_fraction"] > max_clipped_fraction:
+        warnings.append("%.2f%% of samples clipped" % (100 * measurements["clipped_fraction"]))
+    return errors, warnings
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE_NAME) as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_cache(cache):
+    try:
+        with open(CACHE_FILE_NAME, 'w') as cache_file:
+            json.dump(cache, cache_file)
+    except IOError:
+        pass
+
+
+def preflight(sources, sample_rate=44100, channels=(1, 2), min_duration=0.05, max_duration=60,
+              max_clipped_fraction=0.001, processes=None):
+    """
+    Checks every WAV in sources (file names, stimulus folders and stimulus specs), prints a summary report and
+    returns True if no file has errors. Warnings are reported but do not fail the preflight.
+    """
+    paths = []
+    snrs = {}
+    hashes = {}
+    errors = {}
+    synthesized = {}  # spec -> measurements
+    pool = multiprocessing.Pool(processes)
+    try:
+        for source in sources:
+            if is_spec(source):
+                paths.append(source)
+                synthesized[source] = measure_spec(source, 44100 if sample_rate is None else sample_rate)
+            elif os.path.isdir(source):
+                # Hashes of unchanged files come from the manifest cache; the others are hashed in the pool
+                manifest = StimulusManifest(source, pool.map)
+                for stimulus in manifest.stimuli:
+                    paths.append(stimulus.path)
+                    snrs[stimulus.path] = stimulus.snr
+                    hashes[stimulus.path] = stimulus.hash
+                for path, message in manifest.errors:
+                    paths.append(path)
+                    errors[path] = [message]
+                if not manifest.stimuli and not manifest.errors:
+                    paths.append(source)
+                    errors[source] = ["no .wav files in folder"]
+            elif not os.path.isfile(source):
+                paths.append(source)
+                errors[source] = ["file not found"]
+            else:
+                paths.append(source)
+
+        to_hash = [path for path in paths if path not in hashes and path not in errors and path not in synthesized]
+        hashes.update(zip(to_hash, pool.map(file_hash, to_hash)))
+
+        cache = load_cache()
+        to_measure = sorted(set(path for path in hashes if hashes[path] not in cache))
+        for path, measurements in zip(to_measure, pool.map(measure_wav, to_measure)):
+            cache[hashes[path]] = measurements
+    finally:
+        pool.close()
+        pool.join()
+    if to_measure:
+        save_cache(cache)
+
+    print "Preflight: %d files (%d decoded, %d unchanged since the last check)%s" % \
+          (len(paths) - len(synthesized), len(to_measure), len(hashes) - len(to_measure),
+           " and %d synthesized stimuli" % len(synthesized) if synthesized else "")
+    error_count = 0
+    warning_count = 0
+    for path in paths:
+        if path in errors:
+            file_errors, file_warnings = errors[path], []
+            details = ""
+        else:
+            measurements = synthesized[path] if path in synthesized else cache[hashes[path]]
+            file_errors, file_warnings = evaluate(measurements, sample_rate, channels, min_duration, max_duration,
+                                                  max_clipped_fraction)
+            details = "" if "error" in measurements else \
+                "%5d Hz %d ch %7.2f s peak %4.2f" % (measurements["sample_rate"], measurements["channels"],
+                                                      measurements["duration"], measurements["peak"])
+            if snrs.get(path) is not None:
+                details += " SNR/dB %d" % snrs[path]
+        status = "ERROR " + "; ".join(file_errors) if file_errors else \
+            ("WARNING " + "; ".join(file_warnings) if file_warnings else "OK")
+        print "  %-40s %-45s %s" % (path if path in synthesized else os.path.basename(path), details, status)
+        error_count += bool(file_errors)
+        warning_count += bool(file_warnings) and not file_errors
+    print "%d OK, %d with warnings, %d with errors" % (len(paths) - error_count - warning_count, warning_count,
+                                                        error_count)
+    return error_count == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if preflight(sys.argv[1:]) else 1)
@@ -0,0 +1,254 @@
+"""
+Declarative session definitions.
+A protocol file (JSON) holds one session definition, or a list of them (one per booth), e.g.
+{"session_id": "bird1_190428", "protocol": "go_nogo", "delay": 60,
+ "parameters": {"go_sound": "2000HZ_TONE.wav", "nogo_sound": "3000HZ_TONE.wav", "wn_sound": "GNG_WN.wav",
+                "probability": 0.5, "duration": 39600}}
+"parameters" are the keyword arguments of the Booth paradigm method named by "protocol". Optional keys:
+    "delay": seconds to wait before the session starts
+    "subject" and "days" (instead of "session_id"): repeat the session daily at the same time for that many days,
+        as subject_YYMMDD (see Booth_schedule.py)
+    "manual_start": with "days", start each day's session "delay" s after enter is pressed (injection protocols)
+    "schedule_file": where daily sessions are planned; <subject>_schedule.json by default, so a subject's plan only
+        ever runs its own sessions. When a session is aborted, the rest of its plan is cancelled.
+    "pins", "audio_device", "audio_output", "audio_frequency", "audio_buffer", "debounce_time" and "advance_to": as in
+        Booth_multi.py
+Every definition is checked (parameter names, types and ranges) and all stimuli are preflighted once, before
+anything starts. Booth_driver.py launches a protocol file without any prompts:
+    sudo python Booth_driver.py sessions.json
+and this file only checks one:
+    python Booth_protocol.py sessions.json
+"""
+import inspect
+import json
+import sys
+from datetime import datetime, timedelta
+from Booth import Booth
+from Booth_audio import OUTPUTS
+from Booth_metrics import make_rules
+from Booth_multi import PROTOCOLS, check_booths, run_booths
+from Booth_preflight import preflight
+from Booth_schedule import SessionSchedule, plan_daily, run_schedule, run_planned_session, sleep_until
+from Booth_trials import TrialSchedule
+
+DEFINITION_KEYS = ("session_id", "subject", "days", "manual_start", "schedule_file", "delay", "protocol",
+                   "parameters", "advance_to") + Booth.SETTINGS
+PROBABILITIES = ("probability", "classical_probability", "operant_probability")
+DURATIONS = ("duration", "max_trial_duration", "max_response_time", "response_time", "reward_time", "null_time",
+             "punishment_null_time", "delay_time")
+COUNTS = ("block_size", "max_run", "classical_conditioning_trial_cap", "operant_conditioning_trial_cap")
+SOUNDS = ("go_sound", "nogo_sound", "wn_sound", "go_path", "nogo_path")
+RESPONSE_WINDOWS = ("onset", "offset", "delay")
+# Parameters the paradigms no longer take, with what replaced them
+REMOVED_PARAMETERS = {"punishment_time": "false alarms are punished with punishment_null_time s of lights out"}
+# The probability and block size (or trial cap) of each trial schedule a paradigm draws (see Booth_trials.py)
+SCHEDULES = {"go_nogo": [("probability", "block_size")],
+             "scene_discrimination": [("probability", "block_size")],
+             "classical_to_operant_conditioning": [("classical_probability", "classical_conditioning_trial_cap"),
+                                                   ("operant_probability", "operant_conditioning_trial_cap")]}
+
+
+def is_number(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+
+def is_count(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool) and value > 0
+
+
+def check_parameters(protocol, parameters):
+    """Returns a list of problems with parameters for the Booth paradigm protocol"""
+    arguments = inspect.getargspec(getattr(Booth, protocol))
+    names = [name for name in arguments.args[1:] if name != "resume"]
+    required = arguments.args[1:len(arguments.args) - len(arguments.defaults or ())]
+    problems = [name + " is no longer a parameter: " + REMOVED_PARAMETERS[name] if name in REMOVED_PARAMETERS else
+                "unknown parameter " + name for name in sorted(parameters) if name not in names]
+    problems += ["missing parameter " + name for name in required if name not in parameters]
+    for name, value in sorted(parameters.items()):
+        if value is None or name not in names:
+            continue  # the paradigm's default, or already a problem
+        if name in PROBABILITIES and not (is_number(value) and 0 <= value <= 1):
+            problems.append(name + " must be a probability between 0 and 1")
+        elif name in DURATIONS and not (is_number(value) and value >= 0):
+            problems.append(name + " must be a number of seconds >= 0")
+        elif name in COUNTS and not is_count(value):
+            problems.append(name + " must be a whole number > 0")
+        elif name in SOUNDS and not isinstance(value, basestring):
+            problems.append(name + " must be a file or folder name")
+        elif name == "iti_range" and not (isinstance(value, (list, tuple)) and len(value) == 2 and
+                                          all(is_number(bound) and bound >= 0 for bound in value) and
+                                          value[0] <= value[1]):
+            problems.append("iti_range must be [shortest, longest] in seconds")
+        elif name == "response_window" and value not in RESPONSE_WINDOWS:
+            problems.append("response_window must be one of " + ", ".join(RESPONSE_WINDOWS))
+        elif name == "rules":
+            try:
+                make_rules(value)
+            except (ValueError, TypeError) as error:
+                problems.append("rules: " + str(error))
+    if not problems:  # can the trial schedules be drawn (e.g. with max_run)?
+        values = dict(zip(reversed(arguments.args), reversed(arguments.defaults or ())))
+        values.update(parameters)
+        for probability_name, size_name in SCHEDULES.get(protocol, ()):
+            try:
+                TrialSchedule(["go"], ["nogo"], values[probability_name], block_size=values[size_name],
+                              max_run=values.get("max_run"))
+            except ValueError as error:
+                problems.append(str(error))
+    return problems
+
+
+def definition_name(definition):
+    return definition.get("session_id") or definition.get("subject") or "unnamed session"
+
+
+def check_definition(definition):
+    """Returns a list of problems with one session definition"""
+    problems = ["unknown key " + key for key in sorted(definition) if key not in DEFINITION_KEYS]
+    if "days" in definition:
+        if not definition.get("subject"):
+            problems.append("daily sessions need a subject (their session ids are subject_YYMMDD)")
+        if "session_id" in definition:
+            problems.append("daily sessions get their session ids from the schedule; give a subject instead")
+        if not is_count(definition["days"]):
+            problems.append("days must be a whole number > 0")
+    elif not definition.get("session_id"):
+        problems.append("missing session_id")
+    for key in ("manual_start", "schedule_file"):
+        if key in definition and "days" not in definition:
+            problems.append(key + " only applies to daily sessions")
+    if not (is_number(definition.get("delay", 0)) and definition.get("delay", 0) >= 0):
+        problems.append("delay must be a number of seconds >= 0")
+    for pin_name in definition.get("pins", {}):
+        if pin_name not in Booth.PIN_NAMES:
+            problems.append("unknown pin " + pin_name + "; expected one of " + ", ".join(Booth.PIN_NAMES))
+    if definition.get("audio_output", "stream") not in OUTPUTS:
+        problems.append("audio_output must be one of " + ", ".join(OUTPUTS))
+    for key in ("audio_frequency", "audio_buffer"):
+        if key in definition and not is_count(definition[key]):
+            problems.append(key + " must be a whole number > 0")
+    if not (is_number(definition.get("debounce_time", 0)) and definition.get("debounce_time", 0) >= 0):
+        problems.append("debounce_time must be a number of seconds >= 0")
+    stage = definition
+    while stage is not None:
+        if stage.get("protocol") not in PROTOCOLS:
+            problems.append("protocol must be one of " + ", ".join(PROTOCOLS))
+        else:
+            problems += [stage["protocol"] + ": " + problem
+                         for problem in check_parameters(stage["protocol"], stage.get("parameters", {}))]
+        stage = stage.get("advance_to")
+    return problems
+
+
+def check_definitions(definitions):
+    """Returns a list of problems with a protocol file's definitions, each prefixed with its session's name"""
+    problems = []
+    for definition in definitions:
+        problems += [definition_name(definition) + ": " + problem for problem in check_definition(definition)]
+    if len(definitions) > 1 and not problems:
+        booths = [booth_definition(definition) for definition in definitions]
+        try:  # several booths on one Pi: distinct names and pins
+            check_booths(booths)
+        except ValueError as error:
+            problems.append(str(error))
+        schedule_files = [booth["schedule_file"] for booth in booths if "schedule_file" in booth]
+        if len(set(schedule_files)) < len(schedule_files):
+            problems.append("Daily booths need a schedule_file each; their processes would overwrite a shared one")
+    return problems
+
+
+def definition_sounds(definition):
+    sounds = []
+    stage = definition
+    while stage is not None:
+        sounds += [value for name, value in sorted(stage.get("parameters", {}).items())
+                   if name in SOUNDS and value is not None]
+        stage = stage.get("advance_to")
+    return sounds
+
+
+def load_definitions(file_name):
+    """Returns the list of session definitions in a protocol file"""
+    with open(file_name) as protocol_file:
+        definitions = json.load(protocol_file)
+    return definitions if isinstance(definitions, list) else [definitions]
+
+
+def prepare(definitions):
+    """Checks definitions and preflights all their stimuli at once; prints what is wrong and returns True if nothing"""
+    problems = check_definitions(definitions)
+    for problem in problems:
+        print problem
+    if problems:
+        return False
+    sounds = sorted(set(sound for definition in definitions for sound in definition_sounds(definition)))
+    return not sounds or preflight(sounds)
+
+
+def booth_definition(definition):
+    """
+    definition as one of several booths: with the session_id Booth_multi.py identifies booths by (the subject, for
+    daily sessions) and, for daily sessions, its schedule file (see schedule_file_for)
+    """
+    booth = dict(definition)
+    if "days" in definition:
+        booth.setdefault("session_id", definition.get("subject"))
+        booth.setdefault("schedule_file", schedule_file_for(definition))
+    return booth
+
+
+def schedule_file_for(definition):
+    """The schedule file of a daily definition: its schedule_file, or <subject>_schedule.json"""
+    return definition.get("schedule_file", str(definition.get("subject")) + "_schedule.json")
+
+
+def launch_one(definition, control=None):
+    """
+    Runs one prepared definition to the end: after its delay, or as a daily schedule. If a daily session is aborted
+    (or Ctrl-C), the sessions planned after it are cancelled, so a later launch does not run them.
+    Without a control, one is served on <session id or subject>.sock for the session.
+    """
+    from Booth_control import SessionControl, ControlServer
+
+    control_server = None
+    if control is None:
+        control = SessionControl()
+        control_server = ControlServer(control, definition_name(definition) + ".sock")
+    try:
+        delay = definition.get("delay", 0)
+        if "days" in definition:
+            planned = plan_daily(definition["subject"], definition["protocol"], definition.get("parameters", {}),
+                                 datetime.now() + timedelta(seconds=delay), definition["days"],
+                                 manual_delay=delay if definition.get("manual_start") else None)
+            for session in planned:
+                session.update((key, definition[key]) for key in Booth.SETTINGS + ("advance_to",)
+                               if key in definition)
+            schedule = SessionSchedule(schedule_file_for(definition))
+            schedule.add(planned)  # raises PlanConflict if the subject already has a session planned on one of the days
+            try:
+                run_schedule(schedule, control)
+            except BaseException:
+                schedule.cancel(planned)
+                raise
+        else:
+            if delay:
+                sleep_until(datetime.now() + timedelta(seconds=delay), control, report_interval=1)
+            run_planned_session(definition, control)
+    finally:
+        if control_server is not None:
+            control_server.close()
+
+
+def launch(definitions, control=None):
+    """Runs prepared definitions: one in this process (under control, if given), several at once, a process each"""
+    if len(definitions) == 1:
+        launch_one(definitions[0], control)
+    else:
+        run_booths([booth_definition(definition) for definition in definitions], target=launch_one)
+
+
+if __name__ == "__main__":
+    if prepare(load_definitions(sys.argv[1])):
+        print sys.argv[1] + " is ready to run"
+    else:
+        sys.exit(1)
@@ -0,0 +1,221 @@
+"""
+Persistent wall-clock schedule of sessions.
+Planned sessions are kept in a JSON file, each with its subject, session id, protocol, parameters and start time
+(local wall-clock time). Every session is started at its start time, with the scheduler asleep in between, and its
+status is written back to the file as it changes. A schedule therefore outlives the process: after a crash or a
+reboot, run it again (e.g. from /etc/rc.local) and it carries on with the next planned session:
+    sudo python Booth_schedule.py schedule.json
+Daily repetitions (see Booth_driver.py) are planned up front with plan_daily, so each day's session id comes from its
+date in the schedule.
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from Booth_journal import RESUMABLE_PARADIGMS
+
+SCHEDULE_FILE = "schedule.json"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# A session left "running" is one the scheduler was killed during. The next run resumes it from its journal (see
+# Booth_journal.py) if it can, and marks it "interrupted" otherwise
+# A "cancelled" session was still planned when an earlier session of its plan was aborted
+STATUSES = ("planned", "running", "done", "aborted", "interrupted", "missed", "cancelled")
+
+
+class PlanConflict(ValueError):
+    """Raised when sessions added to a schedule have the session id of one already in it"""
+    pass
+
+
+def session_id_for(subject, start):
+    return subject + "_" + start.strftime('%y%m%d')
+
+
+def start_time(session):
+    return datetime.strptime(session["start"], TIME_FORMAT)
+
+
+def plan_daily(subject, protocol, parameters, first_start, days, manual_delay=None):
+    """
+    Returns days planned sessions of protocol, one a day at the wall-clock time of first_start (a datetime).
+    With manual_delay, each day's session instead starts manual_delay s after the operator presses enter on the day
+    (for injection protocols).
+    """
+    sessions = []
+    for day in range(days):
+        start = first_start + timedelta(days=day)  # naive local times keep the time of day across DST changes
+        session = {"subject": subject, "session_id": session_id_for(subject, start), "protocol": protocol,
+                   "parameters": parameters, "start": start.strftime(TIME_FORMAT), "status": "planned"}
+        if manual_delay is not None:
+            session["manual_delay"] = manual_delay
+        sessions.append(session)
+    return sessions
+
+
+class SessionSchedule:
+    def __init__(self, file_name=SCHEDULE_FILE):
+        """Loads file_name, if it exists; every change is saved to it at once"""
+        self.file_name = file_name
+        self.sessions = []
+        if os.path.exists(file_name):
+            with open(file_name) as schedule_file:
+                self.sessions = json.load(schedule_file)
+
+    def save(self):
+        # Written to a temporary file and renamed over the old one, so a crash mid-write cannot corrupt the schedule
+        temporary_file_name = self.file_name + ".tmp"
+        with open(temporary_file_name, 'w') as schedule_file:
+            json.dump(self.sessions, schedule_file, indent=1, sort_keys=True)
+            schedule_file.flush()
+            os.fsync(schedule_file.fileno())
+        os.rename(temporary_file_name, self.file_name)
+
+    def add(self, sessions):
+        session_ids = set(session["session_id"] for session in self.sessions)
+        for session in sessions:
+            if session["session_id"] in session_ids:
+                raise PlanConflict("Session id " + session["session_id"] + " is already in " + self.file_name)
+            session_ids.add(session["session_id"])
+        self.sessions.extend(sessions)
+        self.sessions.sort(key=lambda session: session["start"])
+        self.save()
+
+    def cancel(self, sessions):
+        """Marks those of sessions that are still planned cancelled"""
+        session_ids = set(session["session_id"] for session in sessions)
+        for session in self.sessions:
+            if session["session_id"] in session_ids and session["status"] == "planned":
+                self.set_status(session, "cancelled")
+
+    def next_session(self):
+        """The planned session with the earliest start time, or None if there is none left"""
+        for session in self.sessions:
+            if session["status"] == "planned":
+                return session
+        return None
+
+    def set_status(self, session, status):
+        session["status"] = status
+        session["updated"] = datetime.now().strftime(TIME_FORMAT)
+        self.save()
+
+    def recover(self):
+        """
+        Returns the sessions a killed scheduler left running that can be resumed: those of a resumable protocol
+        with no later session already due. The others are marked interrupted.
+        """
+        next_session = self.next_session()
+        later_due = next_session is not None and start_time(next_session) <= datetime.now()
+        resumable = []
+        for session in self.sessions:
+            if session["status"] == "running":
+                if session["protocol"] in RESUMABLE_PARADIGMS and not later_due:
+                    resumable.append(session)
+                else:
+                    self.set_status(session, "interrupted")
+        return resumable
+
+
+def sleep_until(start, control=None, report_interval=60):
+    """
+    Sleeps until start (a wall-clock datetime), printing the time left every report_interval s. The clock is read
+    again after every slice, so a clock set at boot (NTP) or changed meanwhile is followed.
+    """
+    while True:
+        remaining = (start - datetime.now()).total_seconds()
+        if remaining <= 0:
+            break
+        sys.stdout.write("\rNext session in " + str(timedelta(seconds=int(round(remaining)))) + " ")
+        sys.stdout.flush()
+        if control is not None:
+            control.countdown(min(report_interval, remaining))  # raises SessionAborted if aborted
+        else:
+            time.sleep(min(report_interval, remaining))
+    if control is not None:
+        control.end_countdown()
+    sys.stdout.write("\n")
+
+
+def run_planned_session(session, control=None, resume=False):
+    """
+    Runs one planned session to the end (and on through its "advance_to" stages, as in Booth_multi.py), on its
+    "pins" if it has them and this Pi's default pins otherwise, and with its other Booth.SETTINGS; resume continues
+    its first stage from its journal
+    """
+    from Booth import Booth
+    from Booth_multi import booth_settings
+
+    booth = Booth(session["session_id"], **booth_settings(session))
+    if control is not None:
+        control.attach(booth)
+    stage = session
+    result = None
+    try:
+        while stage is not None:
+            parameters = dict(stage.get("parameters", {}))
+            if resume and stage is session:
+                parameters["resume"] = True
+            result = getattr(booth, stage["protocol"])(**parameters)
+            stage = stage.get("advance_to") if result == "advance" else None
+        return result
+    finally:
+        booth.close()
+        if control is not None:
+            control.detach()
+        if session.get("pins"):  # only this booth's pins; other booths may share the Pi
+            booth.gpio.cleanup([getattr(booth, pin_name) for pin_name in Booth.PIN_NAMES])
+        else:
+            booth.gpio.cleanup()
+
+
+def run_schedule(schedule, control=None, run_session=run_planned_session, max_lateness=3600):
+    """
+    Resumes the sessions a killed scheduler left running, then runs the planned sessions of schedule in start order,
+    each with run_session(session, control) (run_session(session, control, resume=True) to resume).
+    A session that can no longer start within max_lateness s of its start time (the Pi was off) is marked missed.
+    An abort or Ctrl-C marks the session in progress aborted and is raised again; the sessions after it stay planned.
+    """
+    for session in schedule.recover():
+        print "Resuming " + session["session_id"]
+        run_scheduled(schedule, session, control, run_session, resume=True)
+    while True:
+        session = schedule.next_session()
+        if session is None:
+            return
+        if "manual_delay" in session:
+            raw_input("Press enter to start the " + str(session["manual_delay"]) + " s timer for " +
+                      session["session_id"] + "...")
+            sleep_until(datetime.now() + timedelta(seconds=session["manual_delay"]), control)
+        elif (datetime.now() - start_time(session)).total_seconds() > max_lateness:
+            print session["session_id"] + " missed its start time (" + session["start"] + ")"
+            schedule.set_status(session, "missed")
+            continue
+        else:
+            print session["session_id"] + ": " + session["protocol"] + " at " + session["start"]
+            sleep_until(start_time(session), control)
+        run_scheduled(schedule, session, control, run_session)
+
+
+def run_scheduled(schedule, session, control, run_session, resume=False):
+    schedule.set_status(session, "running")
+    try:
+        if resume:
+            run_session(session, control, resume=True)
+        else:
+            run_session(session, control)
+    except BaseException:
+        schedule.set_status(session, "aborted")
+        raise
+    schedule.set_status(session, "done")
+
+
+if __name__ == "__main__":
+    from Booth_control import SessionControl, ControlServer
+
+    session_control = SessionControl()
+    control_server = ControlServer(session_control)
+    try:
+        run_schedule(SessionSchedule(sys.argv[1] if len(sys.argv) > 1 else SCHEDULE_FILE), session_control)
+    finally:
+        control_server.close()
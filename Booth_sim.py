@@ -0,0 +1,385 @@
+"""
+Simulated hardware for running Booth code on a machine without a Raspberry Pi.
+SimulatedGPIO mimics the parts of the RPi.GPIO module that Booth uses, so it can be passed anywhere RPi.GPIO is
+expected. Input levels are driven with press()/release(), which fire edge callbacks like RPi.GPIO's event thread.
+
+For whole sessions, simulated_booth() builds a Booth on a VirtualClock, where sleeps and waits return at once and
+only advance the virtual time, with a scriptable VirtualBird pecking the switch. A full session then runs in
+seconds:
+    python Booth_sim.py go_nogo 39600
+"""
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+import wave
+import numpy as np
+from Booth_input import PerchTracker
+from Booth_synth import is_spec, parse_spec
+
+
+class SimulatedGPIO:
+    BOARD = 10
+    BCM = 11
+    IN = 1
+    OUT = 0
+    PUD_UP = 22
+    PUD_DOWN = 21
+    PUD_OFF = 20
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.mode = None
+        self.levels = {}
+        self.directions = {}
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=None, initial=None):
+        self.directions[channel] = direction
+        if direction == self.IN:
+            # Pull-up resistors keep an open switch high
+            self.levels[channel] = 0 if pull_up_down == self.PUD_DOWN else 1
+        else:
+            self.levels[channel] = 0 if initial is None else initial
+
+    def output(self, channel, value):
+        self.levels[channel] = int(value)
+
+    def input(self, channel):
+        return self.levels[channel]
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        if channel in self._callbacks:
+            raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+        self._callbacks[channel] = (edge, [] if callback is None else [callback])
+
+    def add_event_callback(self, channel, callback):
+        self._callbacks[channel][1].append(callback)
+
+    def remove_event_detect(self, channel):
+        self._callbacks.pop(channel, None)
+
+    def cleanup(self, channel=None):
+        if channel is None:
+            self.levels.clear()
+            self.directions.clear()
+            self._callbacks.clear()
+            return
+        for single_channel in (channel if isinstance(channel, (list, tuple)) else [channel]):
+            self.levels.pop(single_channel, None)
+            self.directions.pop(single_channel, None)
+            self._callbacks.pop(single_channel, None)
+
+    """
+    Helpers for driving inputs from a simulation
+    """
+
+    def set_input(self, channel, level):
+        with self._lock:
+            if self.levels.get(channel) == level:
+                return
+            self.levels[channel] = level
+            edge, callbacks = self._callbacks.get(channel, (None, []))
+            if edge is None or (edge == self.FALLING and level == 1) or (edge == self.RISING and level == 0):
+                return
+            for callback in list(callbacks):
+                callback(channel)
+
+    def press(self, channel):
+        """The switch is active low: a peck pulls the pin to 0"""
+        self.set_input(channel, 0)
+
+    def release(self, channel):
+        self.set_input(channel, 1)
+
+
+class VirtualClock:
+    """
+    Drop-in for Booth_timing.SystemClock whose sleeps advance the time instantly.
+    Callbacks set with call_at() run, in deadline order, as the time is advanced past their deadlines.
+    """
+    def __init__(self, start=0.0):
+        self.now = start
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.advance_to(self.now + seconds)
+
+    def advance_to(self, t):
+        while self._heap and self._heap[0][0] <= t:
+            deadline, _, callback = heapq.heappop(self._heap)
+            if callback is not None:
+                self.now = max(self.now, deadline)
+                callback(self.now)
+        self.now = max(self.now, t)
+
+    def sleep_until(self, deadline, spin_time=None):
+        self.advance_to(deadline)
+        return self.now
+
+    def call_at(self, deadline, callback):
+        entry = [deadline, next(self._sequence), callback]
+        if deadline <= self.now:  # already due; there may be no later advance to run it
+            entry[2] = None
+            callback(self.now)
+        else:
+            heapq.heappush(self._heap, entry)
+        return entry
+
+    def cancel(self, entry):
+        entry[2] = None
+
+
+class VirtualBird:
+    def __init__(self, go_sounds=(), nogo_sounds=(), hit_probability=0.8, false_alarm_probability=0.2,
+                 rt_mean=0.6, rt_sd=0.25, initiation_interval=(2, 10), hold_time=0.1, seed=None):
+        """
+        A bird that initiates trials and responds to stimuli, in virtual time.
+        go_sounds and nogo_sounds list the stimulus files (or folders of them) the bird tells apart; any other
+        sound, such as the white noise punishment, is ignored.
+        After a GO (NOGO) stimulus the bird pecks with probability hit_probability (false_alarm_probability),
+        rt_mean +- rt_sd seconds (normally distributed) after the stimulus ends. Otherwise it initiates the next
+        trial after a uniformly drawn initiation_interval. Every peck holds the switch down for hold_time s.
+        """
+        self.go_sounds = set(go_sounds)
+        self.nogo_sounds = set(nogo_sounds)
+        self.hit_probability = hit_probability
+        self.false_alarm_probability = false_alarm_probability
+        self.rt_mean = rt_mean
+        self.rt_sd = rt_sd
+        self.initiation_interval = initiation_interval
+        self.hold_time = hold_time
+        self.random = np.random.RandomState(seed)
+
+        self.press_count = 0
+        self.on_edge = None  # called as on_edge(t, pressed) for every press and release, in time order
+        self.press_start = None
+        self.press_end = None
+        self._counted = False
+        self._next_press_start = None  # set when a response is due after the current press
+        self._schedule_press(self._initiation_delay())
+
+    def _initiation_delay(self):
+        return self.random.uniform(self.initiation_interval[0], self.initiation_interval[1])
+
+    def _schedule_press(self, start):
+        self.press_start = start
+        self.press_end = start + self.hold_time
+        self._counted = False
+
+    def _update(self, t):
+        """Brings the press schedule up to time t"""
+        while True:
+            if not self._counted and self.press_start <= t:
+                self.press_count += 1
+                self._counted = True
+                if self.on_edge is not None:
+                    self.on_edge(self.press_start, True)
+            if self.press_end > t:
+                return
+            if self.on_edge is not None:
+                self.on_edge(self.press_end, False)
+            if self._next_press_start is not None:
+                self._schedule_press(max(self._next_press_start, self.press_end))
+                self._next_press_start = None
+            else:
+                self._schedule_press(self.press_end + self._initiation_delay())
+
+    def _classify(self, sound):
+        for sounds, label in ((self.go_sounds, "go"), (self.nogo_sounds, "nogo")):
+            if sound in sounds or os.path.dirname(sound) in sounds:
+                return label
+        return None
+
+    def is_pressed(self, t):
+        self._update(t)
+        return self.press_start <= t < self.press_end
+
+    def next_press(self, t):
+        """Time of the first moment at or after t when the switch is down"""
+        self._update(t)
+        return max(t, self.press_start)
+
+    def next_release(self, t):
+        """Time of the first moment at or after t when the switch is up"""
+        self._update(t)
+        return self.press_end if self.press_start <= t else t
+
+    def hear(self, sound, onset, duration):
+        label = self._classify(sound)
+        if label is None:
+            return
+        self._update(onset)
+        response_probability = self.hit_probability if label == "go" else self.false_alarm_probability
+        if self.random.uniform() < response_probability:
+            next_start = onset + duration + max(0, self.random.normal(self.rt_mean, self.rt_sd))
+        else:
+            next_start = onset + duration + self._initiation_delay()
+        if self.press_start <= onset:  # still holding the initiating peck
+            self._next_press_start = next_start
+        else:
+            self._schedule_press(next_start)
+
+
+class SimulatedSwitchInput:
+    """Drop-in for Booth_input.SwitchInput reading a VirtualBird on a VirtualClock"""
+    def __init__(self, bird, clock):
+        self.bird = bird
+        self.clock = clock
+        self.event_log = None
+        self._tracker = PerchTracker(clock)
+        bird.on_edge = self._on_edge
+
+    def _on_edge(self, t, pressed):
+        self._tracker.transition(t, pressed)
+        if self.event_log is not None:
+            self.event_log.record(int(t * 1e9), pressed)
+
+    @property
+    def tracker(self):
+        self.bird._update(self.clock.now)
+        return self._tracker
+
+    @property
+    def press_count(self):
+        self.bird._update(self.clock.now)
+        return self.bird.press_count
+
+    def is_pressed(self):
+        return self.bird.is_pressed(self.clock.now)
+
+    def _wait_until(self, event_time, timeout):
+        start_time = self.clock.now
+        if timeout is not None and event_time - start_time >= timeout:
+            # A real wait always takes some time; without this a timeout lost to rounding never moves the clock
+            self.clock.advance_to(start_time + max(timeout, 1e-6))
+            return None
+        self.clock.advance_to(event_time)
+        return event_time - start_time
+
+    def wait_for_press(self, timeout=None):
+        return self._wait_until(self.bird.next_press(self.clock.now), timeout)
+
+    def wait_for_release(self, timeout=None):
+        return self._wait_until(self.bird.next_release(self.clock.now), timeout)
+
+    def close(self):
+        pass
+
+
+class SimulatedPlayback:
+    def __init__(self, clock, onset, length):
+        self.clock = clock
+        self.onset = onset
+        self.expected_offset = onset + length
+        self.offset = None
+
+    def is_playing(self):
+        return self.clock.now < self.expected_offset
+
+    def wait(self):
+        self.clock.advance_to(self.expected_offset)
+        if self.offset is None:
+            self.offset = self.clock.now
+        return self.offset
+
+    def stop(self):
+        self.expected_offset = min(self.expected_offset, self.clock.now)
+
+
+class SimulatedPlayer:
+    """Drop-in for Booth_audio.StimulusPlayer that plays nothing; it only reads each WAV's (or spec's) duration"""
+    def __init__(self, clock, bird=None):
+        self.clock = clock
+        self.bird = bird
+        self.durations = {}
+        self.last_load_time = None
+        self.last_loaded = None
+        self.last_onset = None
+
+    def load(self, sound_file):
+        if sound_file not in self.durations:
+            if is_spec(sound_file):
+                self.durations[sound_file] = parse_spec(sound_file).duration
+            else:
+                wav = wave.open(sound_file, "rb")
+                self.durations[sound_file] = wav.getnframes() / float(wav.getframerate())
+                wav.close()
+        return self.durations[sound_file]
+
+    def preload(self, sound_files):
+        for sound_file in sound_files:
+            self.load(sound_file)
+
+    def map_folder(self, manifest):
+        """Maps nothing: every stimulus is left to preload"""
+        return manifest.paths()
+
+    def mapped_bytes(self):
+        return 0
+
+    def prefetch(self, sound_file):
+        pass
+
+    def play(self, sound_file, block=True):
+        duration = self.load(sound_file)
+        self.last_load_time = 0
+        self.last_loaded = self.last_onset = self.clock.now
+        if self.bird is not None:
+            self.bird.hear(sound_file, self.clock.now, duration)
+        playback = SimulatedPlayback(self.clock, self.clock.now, duration)
+        if block:
+            playback.wait()
+        return playback
+
+    def close(self):
+        pass
+
+
+def simulated_booth(subject_paradigm_id, bird=None, clock=None, **bird_parameters):
+    """
+    Returns a Booth running on a VirtualClock with a VirtualBird (built from bird_parameters if bird is None)
+    pecking its switch.
+    """
+    from Booth import Booth
+
+    if clock is None:
+        clock = VirtualClock()
+    if bird is None:
+        bird = VirtualBird(**bird_parameters)
+    return Booth(subject_paradigm_id, gpio=SimulatedGPIO(), clock=clock,
+                 switch=SimulatedSwitchInput(bird, clock), player=SimulatedPlayer(clock, bird))
+
+
+if __name__ == "__main__":
+    paradigm = sys.argv[1] if len(sys.argv) > 1 else "go_nogo"
+    session_duration = float(sys.argv[2]) if len(sys.argv) > 2 else 39600
+    go_sound, nogo_sound = "2000HZ_TONE.wav", "3000HZ_TONE.wav"
+
+    session = simulated_booth("simulated_" + paradigm, go_sounds=[go_sound], nogo_sounds=[nogo_sound])
+    t0 = time.time()
+    if paradigm == "go_nogo":
+        session.go_nogo(go_sound=go_sound, nogo_sound=nogo_sound, duration=session_duration)
+    elif paradigm == "classical_to_operant_conditioning":
+        session.classical_to_operant_conditioning(go_sound, nogo_sound, "GNG_WN.wav", 0.5, 0.5,
+                                                  max_trial_duration=session_duration)
+    else:
+        getattr(session, paradigm)(duration=session_duration)
+    session.close()
+    print "Simulated %.0f s of %s in %.2f s" % (session.clock.now, paradigm, time.time() - t0)
@@ -0,0 +1,113 @@
+"""
+Stimulus manifests.
+A manifest lists the WAV files of a stimulus folder with everything the paradigms and the driver need about them
+(short name, SNR, duration, sample rate, size and content hash). It is built once per folder and cached on disk in
+the folder, so trials do no filesystem or file name parsing work, and unchanged files are not re-read on later
+sessions.
+"""
+import hashlib
+import json
+import os
+import re
+import wave
+from collections import namedtuple
+from glob import glob
+
+MANIFEST_FILE_NAME = ".stimulus_manifest.json"
+
+Stimulus = namedtuple("Stimulus", ["path", "short_name", "snr", "duration", "sample_rate", "size", "mtime", "hash"])
+
+
+def parse_snr(short_name):
+    """Files are formatted as Song1Pk43(-4)5snr.wav; returns None if short_name does not follow that"""
+    try:
+        return int(re.findall(r'-?\d+', re.split("\)", short_name)[1])[0])
+    except IndexError:
+        return None
+
+
+def file_hash(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as stimulus_file:
+        for chunk in iter(lambda: stimulus_file.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def describe_stimulus(path):
+    """Reads a WAV header and hashes the file; raises wave.Error or IOError for unreadable files"""
+    wav = wave.open(path, 'rb')
+    try:
+        duration = wav.getnframes() / float(wav.getframerate())
+        sample_rate = wav.getframerate()
+    finally:
+        wav.close()
+    short_name = os.path.basename(path)
+    file_stat = os.stat(path)
+    return Stimulus(path, short_name, parse_snr(short_name), duration, sample_rate, file_stat.st_size,
+                    file_stat.st_mtime, file_hash(path))
+
+
+def try_describe_stimulus(path):
+    """describe_stimulus(path), or the message of why path cannot be read (a Pool.map cannot raise for one file)"""
+    try:
+        return describe_stimulus(path)
+    except (wave.Error, EOFError, IOError) as error:
+        return str(error) or type(error).__name__
+
+
+class StimulusManifest:
+    def __init__(self, folder, map_function=map):
+        """
+        Lists folder's WAV files, reusing the cached description of every file whose size and modification time
+        have not changed. Files that cannot be read are left out and listed in self.errors as (path, message).
+        The new and changed files are read and hashed with map_function, e.g. a multiprocessing Pool's map.
+        """
+        self.folder = folder
+        self.errors = []
+
+        cached = {}
+        cache_path = os.path.join(folder, MANIFEST_FILE_NAME)
+        try:
+            with open(cache_path) as cache_file:
+                for entry in json.load(cache_file):
+                    cached[entry["path"]] = Stimulus(**entry)
+        except (IOError, ValueError, TypeError):
+            pass  # no cache yet, or an unreadable one that gets rebuilt
+
+        paths = sorted(glob(folder + r'/*.wav'))
+        to_describe = []
+        for path in paths:
+            file_stat = os.stat(path)
+            stimulus = cached.get(path)
+            if stimulus is None or stimulus.size != file_stat.st_size or stimulus.mtime != file_stat.st_mtime:
+                to_describe.append(path)
+        described = dict(zip(to_describe, map_function(try_describe_stimulus, to_describe)))
+
+        self.stimuli = []
+        for path in paths:
+            stimulus = described[path] if path in described else cached[path]
+            if isinstance(stimulus, basestring):
+                self.errors.append((path, stimulus))
+            else:
+                self.stimuli.append(stimulus)
+        self.by_path = dict((stimulus.path, stimulus) for stimulus in self.stimuli)
+
+        if [cached.get(stimulus.path) for stimulus in self.stimuli] != self.stimuli or len(cached) != len(self.stimuli):
+            self.save(cache_path)
+
+    def save(self, cache_path):
+        try:
+            with open(cache_path, 'w') as cache_file:
+                json.dump([stimulus._asdict() for stimulus in self.stimuli], cache_file, indent=1)
+        except IOError:
+            pass  # read-only stimulus folder; the manifest is just rebuilt next time
+
+    def paths(self):
+        return [stimulus.path for stimulus in self.stimuli]
+
+    def __getitem__(self, path):
+        return self.by_path[path]
+
+    def __len__(self):
+        return len(self.stimuli)
@@ -0,0 +1,194 @@
+"""
+Compact binary store for trial data, written alongside the csv files.
+Each trial is one fixed-width record of a NumPy structured dtype: numbers are stored as numbers (NaN for "NA"), the
+one-hot Hit/Miss/Reject/False_alarm columns as a single outcome code, and strings (trial types, stimulus names) as
+indices into a per-file dictionary.
+<title>.trials holds a short header (with the layout the file was written with) followed by the records, and can be
+memory-mapped with read_trials().
+<title>.strings holds the dictionary, one string per line. Both are append-only and flushed per record, so a killed
+session leaves every completed trial readable.
+Running this file converts a store back to the exact csv layout the paradigm writes:
+    python Booth_store.py subject_YYMMDD_go_nogo.trials [output.csv]
+"""
+import csv
+import json
+import math
+import os
+import struct
+import sys
+import numpy as np
+
+MAGIC = b"BOOTHTRL"
+
+# Field name, kind, csv columns. Kinds: int32/int16 (missing values stored as the type's minimum), float (NaN for
+# "NA"), category (index into the string dictionary), onehot (index of the csv column holding the 1)
+OUTCOME_COLUMNS = ["Hit", "Miss", "Reject", "False_alarm"]
+GO_NOGO_LAYOUT = [("trial_number", "int32", ["Trial_number"]),
+                  ("trial_type", "category", ["Trial_type"]),
+                  ("response_time", "float", ["Response_time_s"]),
+                  ("outcome", "onehot", OUTCOME_COLUMNS),
+                  ("time_from_start", "float", ["Time_from_start"]),
+                  ("stimulus", "category", ["Stimulus"])]
+LAYOUTS = {
+    "go_nogo": GO_NOGO_LAYOUT,
+    "operant_conditioning": GO_NOGO_LAYOUT,
+    "scene": [("trial_number", "int32", ["Trial_number"]),
+              ("trial_type", "category", ["Trial_type"]),
+              ("stimulus", "category", ["Sound_file"]),
+              ("snr", "int16", ["Trial SNR/dB"]),
+              ("response_time", "float", ["Response_time_s"]),
+              ("outcome", "onehot", OUTCOME_COLUMNS),
+              ("time_from_start", "float", ["Time_from_start"])],
+    "classical_conditioning": [("trial_number", "int32", ["Trial_number"]),
+                               ("trial_type", "category", ["Trial_type"]),
+                               ("time_from_start", "float", ["Time_from_start"]),
+                               ("stimulus", "category", ["Stimulus"])],
+}
+
+KIND_DTYPES = {"int32": "<i4", "int16": "<i2", "float": "<f8", "category": "<i4", "onehot": "i1"}
+
+
+def read_header(trials_file_name):
+    """Returns (layout name, layout, header size) of a store"""
+    with open(trials_file_name, 'rb') as trials_file:
+        if trials_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(trials_file_name + " is not a trial store")
+        header_length, = struct.unpack('<I', trials_file.read(4))
+        header = json.loads(trials_file.read(header_length).decode())
+    layout = [tuple(field) for field in header["fields"]] if "fields" in header else LAYOUTS[header["layout"]]
+    return header["layout"], layout, len(MAGIC) + 4 + header_length
+
+
+def layout_dtype(layout):
+    return np.dtype([(name, KIND_DTYPES[kind]) for name, kind, _ in layout])
+
+
+def layout_header(layout):
+    return [column for _, _, columns in layout for column in columns]
+
+
+def missing_int(kind):
+    return np.iinfo(KIND_DTYPES[kind]).min
+
+
+def layout_for_title(title):
+    """Returns the layout of a paradigm's csv title (which ends in _<layout name>), or None if it has none"""
+    for layout_name in LAYOUTS:
+        if title.endswith('_' + layout_name):
+            return layout_name
+    return None
+
+
+class TrialStore:
+    def __init__(self, title, layout_name):
+        """
+        Opens (or continues) title.trials and title.strings for rows of the layout LAYOUTS[layout_name].
+        Raises ValueError if title.trials exists with a different layout.
+        """
+        self.layout = LAYOUTS[layout_name]
+        self.dtype = layout_dtype(self.layout)
+        self.header = layout_header(self.layout)
+        self.trials_file_name = title + '.trials'
+        self.strings_file_name = title + '.strings'
+
+        self.strings = {}
+        if os.path.exists(self.strings_file_name):
+            with open(self.strings_file_name) as strings_file:
+                for index, line in enumerate(strings_file):
+                    self.strings[line.rstrip('\n')] = index
+
+        is_new = not os.path.exists(self.trials_file_name) or os.path.getsize(self.trials_file_name) == 0
+        if not is_new:
+            _, layout, header_size = read_header(self.trials_file_name)
+            if layout != self.layout:
+                raise ValueError(self.trials_file_name + " was written with a different " + layout_name + " layout")
+        self._trials_file = open(self.trials_file_name, 'ab')
+        self._strings_file = open(self.strings_file_name, 'a')
+        if is_new:
+            header = json.dumps({"layout": layout_name, "fields": self.layout}).encode()
+            self._trials_file.write(MAGIC + struct.pack('<I', len(header)) + header)
+            self._trials_file.flush()
+        else:  # drop a half-written record left by a killed session, so new records stay aligned
+            record_count = (os.path.getsize(self.trials_file_name) - header_size) // self.dtype.itemsize
+            self._trials_file.truncate(header_size + record_count * self.dtype.itemsize)
+
+    def _string_index(self, value):
+        value = str(value)
+        if value not in self.strings:
+            # The dictionary entry reaches the disk before any record that uses it
+            self.strings[value] = len(self.strings)
+            self._strings_file.write(value + '\n')
+            self._strings_file.flush()
+        return self.strings[value]
+
+    def append(self, row):
+        """Appends one csv row of this store's layout; the header row is skipped"""
+        if list(row) == self.header:
+            return
+        record = np.zeros(1, dtype=self.dtype)
+        column = 0
+        for name, kind, columns in self.layout:
+            values = row[column:column + len(columns)]
+            column += len(columns)
+            if kind == "onehot":
+                record[name] = list(values).index(1)
+            elif kind == "category":
+                record[name] = self._string_index(values[0])
+            elif kind == "float":
+                record[name] = np.nan if values[0] == "NA" else values[0]
+            else:
+                record[name] = missing_int(kind) if values[0] is None or values[0] == "" else values[0]
+        self._trials_file.write(record.tostring())
+        self._trials_file.flush()
+
+    def close(self):
+        self._trials_file.close()
+        self._strings_file.close()
+
+
+def read_trials(trials_file_name):
+    """
+    Returns (layout, records, strings): records is a read-only memory map of every complete record in
+    trials_file_name and strings the dictionary its category fields index into.
+    """
+    _, layout, offset = read_header(trials_file_name)
+    dtype = layout_dtype(layout)
+    record_count = (os.path.getsize(trials_file_name) - offset) // dtype.itemsize  # drops a half-written record
+    if record_count == 0:
+        records = np.zeros(0, dtype=dtype)
+    else:
+        records = np.memmap(trials_file_name, dtype=dtype, mode='r', offset=offset, shape=(record_count,))
+    with open(trials_file_name[:-len('.trials')] + '.strings') as strings_file:
+        strings = [line.rstrip('\n') for line in strings_file]
+    return layout, records, strings
+
+
+def records_to_rows(layout, records, strings):
+    """Yields the csv rows, header first, exactly as the paradigm wrote them"""
+    yield layout_header(layout)
+    for record in records:
+        row = []
+        for name, kind, columns in layout:
+            value = record[name]
+            if kind == "onehot":
+                row += [1 if index == value else 0 for index in range(len(columns))]
+            elif kind == "category":
+                row.append(strings[value])
+            elif kind == "float":
+                row.append("NA" if math.isnan(value) else float(value))
+            else:
+                row.append(None if value == missing_int(kind) else int(value))
+        yield row
+
+
+def convert_to_csv(trials_file_name, csv_file_name=None):
+    if csv_file_name is None:
+        csv_file_name = trials_file_name[:-len('.trials')] + '.csv'
+    with open(csv_file_name, 'w') as csv_file:
+        writer = csv.writer(csv_file, delimiter=',')
+        for row in records_to_rows(*read_trials(trials_file_name)):
+            writer.writerow(row)
+
+
+if __name__ == "__main__":
+    convert_to_csv(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
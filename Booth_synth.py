@@ -0,0 +1,104 @@
+"""
+Synthesized stimuli.
+Wherever a paradigm takes a sound file name it also takes a stimulus spec, a short text that is synthesized with
+NumPy when the session starts (StimulusPlayer.preload) and played from memory like any other stimulus:
+    tone 2000Hz                 pure tone
+    sweep 2000-4000Hz 0.5s      linear frequency sweep
+    noise 2s -17dB              white noise
+    noise 1-8kHz                band-limited noise
+Optional parts, in any order after the kind: duration ("0.5s", 2 s by default like the *HZ_TONE.wav files), RMS level
+re full scale ("-20dB", -28 dB by default, the level of the *HZ_TONE.wav files) and the length of the raised-cosine
+onset and offset ramps ("5ms", 10 ms by default). Noise is seeded from its spec, so a spec always sounds the same.
+"""
+import re
+import zlib
+from collections import namedtuple
+import numpy as np
+
+SPEC_KINDS = ("tone", "sweep", "noise")
+DEFAULT_DURATION = 2
+DEFAULT_LEVEL = -28
+DEFAULT_RAMP = 0.01
+
+StimulusSpec = namedtuple("StimulusSpec", ["kind", "low", "high", "duration", "level", "ramp"])
+
+FREQUENCY_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)(?:-(\d+(?:\.\d+)?))?(k?)Hz$')
+DURATION_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)s$')
+LEVEL_PATTERN = re.compile(r'^(-?\d+(?:\.\d+)?)dB$')
+RAMP_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)ms$')
+
+
+def is_spec(sound):
+    """Whether sound (a paradigm's sound parameter) is a stimulus spec rather than a file name"""
+    return not sound.lower().endswith(".wav") and sound.split(" ", 1)[0] in SPEC_KINDS
+
+
+def parse_spec(spec):
+    """Returns the StimulusSpec of spec; raises ValueError if it is malformed"""
+    tokens = spec.split()
+    if not tokens or tokens[0] not in SPEC_KINDS:
+        raise ValueError(spec + ": a stimulus spec starts with one of " + ", ".join(SPEC_KINDS))
+    low = high = None
+    duration, level, ramp = DEFAULT_DURATION, DEFAULT_LEVEL, DEFAULT_RAMP
+    for token in tokens[1:]:
+        frequency = FREQUENCY_PATTERN.match(token)
+        if frequency is not None:
+            scale = 1000.0 if frequency.group(3) else 1.0
+            low = float(frequency.group(1)) * scale
+            high = None if frequency.group(2) is None else float(frequency.group(2)) * scale
+        elif DURATION_PATTERN.match(token):
+            duration = float(DURATION_PATTERN.match(token).group(1))
+        elif LEVEL_PATTERN.match(token):
+            level = float(LEVEL_PATTERN.match(token).group(1))
+        elif RAMP_PATTERN.match(token):
+            ramp = float(RAMP_PATTERN.match(token).group(1)) / 1000
+        else:
+            raise ValueError(spec + ": cannot read " + repr(token))
+    if tokens[0] == "tone" and (low is None or high is not None):
+        raise ValueError(spec + ": a tone needs one frequency, e.g. tone 2000Hz")
+    if tokens[0] == "sweep" and high is None:
+        raise ValueError(spec + ": a sweep needs a frequency range, e.g. sweep 2000-4000Hz")
+    if tokens[0] == "noise" and low is not None and high is None:
+        raise ValueError(spec + ": band-limited noise needs a frequency range, e.g. noise 1-8kHz")
+    if high is not None and high < low:
+        raise ValueError(spec + ": the frequency range goes from low to high")
+    if duration <= 0:
+        raise ValueError(spec + ": the duration must be > 0")
+    return StimulusSpec(tokens[0], low, high, duration, level, ramp)
+
+
+def spec_label(sound):
+    """sound without its .wav extension, or a spec with _ for spaces, for use in file names"""
+    return sound.replace(" ", "_") if is_spec(sound) else sound[:-4]
+
+
+def synthesize(spec, sample_rate=44100):
+    """Returns the samples (floats within +-1) of a stimulus spec at sample_rate; raises ValueError if malformed"""
+    parsed = parse_spec(spec)
+    top = parsed.low if parsed.high is None else parsed.high
+    if top is not None and top >= sample_rate / 2.0:
+        raise ValueError(spec + ": frequencies must be below %g Hz at %d Hz" % (sample_rate / 2.0, sample_rate))
+    sample_count = int(round(parsed.duration * sample_rate))
+    times = np.arange(sample_count) / float(sample_rate)
+    if parsed.kind == "tone":
+        samples = np.sin(2 * np.pi * parsed.low * times)
+    elif parsed.kind == "sweep":
+        samples = np.sin(2 * np.pi * (parsed.low * times + (parsed.high - parsed.low) * times ** 2 /
+                                      (2 * parsed.duration)))
+    else:
+        samples = np.random.RandomState(zlib.crc32(spec) & 0xffffffff).standard_normal(sample_count)
+        if parsed.low is not None:  # band-limited: everything outside the band is removed in the spectrum
+            spectrum = np.fft.rfft(samples)
+            frequencies = np.fft.rfftfreq(sample_count, 1.0 / sample_rate)
+            spectrum[(frequencies < parsed.low) | (frequencies > parsed.high)] = 0
+            samples = np.fft.irfft(spectrum, sample_count)
+    rms = np.sqrt(np.mean(samples ** 2))
+    if rms > 0:
+        samples *= 10 ** (parsed.level / 20.0) / rms
+
+    ramp_count = min(int(round(parsed.ramp * sample_rate)), sample_count // 2)
+    if ramp_count:
+        ramp = np.sin(np.pi / 2 * np.arange(ramp_count) / ramp_count) ** 2
+        samples[:ramp_count] *= ramp
+        samples[sample_count - ramp_count:] *= ramp[::-1]
+    return np.clip(samples, -1, 1)
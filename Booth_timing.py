@@ -0,0 +1,310 @@
+"""
+Monotonic clock, deadline scheduler and per-trial timing records for Booth.
+Every paradigm marks the phases of each trial (initiating peck, stimulus load, onset, offset, response, valve
+open/close and step-out) and one row per trial is written to <session>_timing.csv. Running this file on such a csv
+prints the latency distribution of each phase:
+    python Booth_timing.py subject_YYMMDD_timing.csv
+Timed waits (ITIs, reward, null and punishment times) go through a DeadlineScheduler, which waits for absolute
+deadlines instead of chaining sleeps and writes the scheduled and actual time of every wait to <session>_schedule.csv.
+"""
+import atexit
+import csv
+import ctypes
+import ctypes.util
+import heapq
+import itertools
+import sys
+import threading
+import time
+import traceback
+import numpy as np
+
+
+def _clock_gettime(clock_id):
+    """Returns a function reading clock_id through clock_gettime(2), or None if it is not available"""
+    class Timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+
+    def read_clock_ns():
+        timespec = Timespec()
+        clock_gettime(clock_id, ctypes.byref(timespec))
+        return timespec.tv_sec * 1000000000 + timespec.tv_nsec
+    return read_clock_ns
+
+
+# monotonic() returns seconds and monotonic_ns() integer nanoseconds, from a clock that never jumps.
+# Python 2 has neither time.perf_counter nor time.monotonic, so CLOCK_MONOTONIC is read directly there
+if hasattr(time, "perf_counter_ns"):
+    monotonic = time.perf_counter
+    monotonic_ns = time.perf_counter_ns
+else:
+    monotonic_ns = _clock_gettime(1)  # CLOCK_MONOTONIC
+    if monotonic_ns is None:
+        monotonic_ns = lambda: int(time.time() * 1e9)
+
+    def monotonic():
+        return monotonic_ns() * 1e-9
+
+
+class SystemClock:
+    """
+    Real time. Booth reads time and sleeps through a clock object, so that simulations can substitute a virtual
+    one (see Booth_sim.VirtualClock).
+    """
+    @staticmethod
+    def monotonic():
+        return monotonic()
+
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
+    @staticmethod
+    def sleep_until(deadline, spin_time=0.002):
+        """
+        Returns at monotonic time deadline: sleeps until spin_time before it, then spins through the rest, which
+        the scheduler cannot overshoot. Returns the time it woke up.
+        """
+        remaining = deadline - monotonic()
+        if remaining > spin_time:
+            time.sleep(remaining - spin_time)
+        now = monotonic()
+        while now < deadline:
+            now = monotonic()
+        return now
+
+    @staticmethod
+    def call_at(deadline, callback):
+        """Runs callback(t) at monotonic time deadline (t is when it ran) on the timer thread; see TimerThread"""
+        global _timer_thread
+        if _timer_thread is None:
+            _timer_thread = TimerThread()
+        return _timer_thread.call_at(deadline, callback)
+
+    @staticmethod
+    def cancel(entry):
+        _timer_thread.cancel(entry)
+
+
+class TimerThread:
+    def __init__(self, spin_time=0.002):
+        """
+        One daemon thread running callbacks at monotonic deadlines, in deadline order.
+        It waits on a condition until spin_time before the earliest deadline (call_at wakes it when a deadline is
+        added, in case it is earlier) and spins the rest. On Python 2 a timed Condition.wait checks for that wake-up
+        with pauses growing to 50 ms, so a deadline added under 50 ms before it is due can be that late.
+        A callback that raises has its traceback printed and does not stop the others. Should the thread itself
+        fail, it runs every pending callback on its way out, so pulse off-edges (Booth_actuators.py) come early
+        rather than never; stop() does the same.
+        """
+        self.spin_time = spin_time
+        self._stopped = False
+        self._heap = []
+        self._sequence = itertools.count()  # keeps equal deadlines in the order they were added
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def call_at(self, deadline, callback):
+        """Returns an entry that can be passed to cancel()"""
+        entry = [deadline, next(self._sequence), callback]
+        with self._condition:
+            heapq.heappush(self._heap, entry)
+            self._condition.notify()
+        return entry
+
+    def cancel(self, entry):
+        with self._condition:
+            entry[2] = None
+
+    def stop(self):
+        """Runs the pending callbacks now and ends the thread"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    @staticmethod
+    def _call(callback, t):
+        try:
+            callback(t)
+        except Exception:
+            traceback.print_exc()  # a failing callback must not stop the others
+
+    def _run(self):
+        try:
+            while True:
+                with self._condition:
+                    while not self._heap and not self._stopped:
+                        self._condition.wait()
+                    if self._stopped:
+                        return
+                    deadline, _, callback = self._heap[0]
+                    if callback is None:  # cancelled
+                        heapq.heappop(self._heap)
+                        continue
+                    remaining = deadline - monotonic() - self.spin_time
+                    if remaining > 0:
+                        self._condition.wait(remaining)  # until the deadline, or until call_at adds one
+                        continue
+                    heapq.heappop(self._heap)
+                self._call(callback, SystemClock.sleep_until(deadline, self.spin_time))
+        finally:
+            with self._condition:
+                pending = [callback for _, _, callback in sorted(self._heap) if callback is not None]
+                del self._heap[:]
+            for callback in pending:
+                self._call(callback, monotonic())
+
+
+_timer_thread = None  # started on the first SystemClock.call_at
+SYSTEM_CLOCK = SystemClock()
+
+
+@atexit.register
+def stop_timer_thread():
+    """
+    Stops the timer thread before the interpreter tears down its modules under it. Modules importing this one
+    register their exit hooks later, so those run first and can still have their timed calls run.
+    """
+    if _timer_thread is not None:
+        _timer_thread.stop()
+
+
+class TrialTimer:
+    PHASES = ("peck", "load", "onset", "offset", "response", "valve_open", "valve_close", "step_out")
+
+    def __init__(self, write_row, clock=SYSTEM_CLOCK, write_header=None):
+        """
+        write_row(row) writes one row of the timing csv (Booth passes its write_csv for <session>_timing), and
+        write_header(row) its header (write_row by default).
+        Times are written in seconds since the timer was created.
+        """
+        self.write_row = write_row
+        self.write_header = write_row if write_header is None else write_header
+        self.clock = clock
+        self.session_start = clock.monotonic()
+        self.paradigm = None
+        self.trial_number = None
+        self.marks = None  # phase -> time of the trial in progress, None between trials
+        self.header_written = False
+
+    def start_trial(self, paradigm, trial_number, peck_time=None):
+        self.paradigm = paradigm
+        self.trial_number = trial_number
+        self.marks = {}
+        if peck_time is not None:
+            self.marks["peck"] = peck_time
+
+    def mark(self, phase, t=None):
+        """Records when phase happened (now, by default). Marks outside a trial are ignored"""
+        if self.marks is None:
+            return
+        if t is None:
+            t = self.clock.monotonic()
+        self.marks[phase] = t
+
+    def end_trial(self):
+        if self.marks is None:
+            return
+        if not self.header_written:
+            self.write_header(["Trial_number"] + ["Paradigm"] + [phase + "_s" for phase in self.PHASES])
+            self.header_written = True
+        self.write_row([self.trial_number] + [self.paradigm] +
+                       [self.marks[phase] - self.session_start if phase in self.marks else "NA"
+                        for phase in self.PHASES])
+        self.marks = None
+
+
+class DeadlineScheduler:
+    def __init__(self, write_row=None, clock=SYSTEM_CLOCK, spin_time=0.002, write_header=None):
+        """
+        write_row(row), if given, writes one row of the schedule csv (Booth passes its write_csv for
+        <session>_schedule) per wait: the event, its scheduled and actual times in seconds since the scheduler was
+        created, and the error in ms. write_header(row) writes its header (write_row by default).
+        The last spin_time s of every wait are spun rather than slept.
+        """
+        self.write_row = write_row
+        self.write_header = write_row if write_header is None else write_header
+        self.clock = clock
+        self.spin_time = spin_time
+        self.session_start = clock.monotonic()
+        self.header_written = False
+
+    def wait_until(self, deadline, event):
+        """
+        Waits until the monotonic time deadline and returns the actual time. Chaining deadlines (each one computed
+        from the previous deadline, not from the time the last wait returned) keeps overheads from adding up.
+        """
+        actual = self.clock.sleep_until(deadline, self.spin_time)
+        self.record(event, deadline, actual)
+        return actual
+
+    def record(self, event, deadline, actual):
+        """Logs an event timed elsewhere (e.g. an actuator's off-edge) alongside the scheduler's own waits"""
+        if self.write_row is None:
+            return
+        if not self.header_written:
+            self.write_header(["Event"] + ["Scheduled_s"] + ["Actual_s"] + ["Error_ms"])
+            self.header_written = True
+        self.write_row([event] + [deadline - self.session_start] + [actual - self.session_start] +
+                       [(actual - deadline) * 1000])
+
+    def wait(self, duration, event, start=None):
+        """Waits until duration s after start (a monotonic time; now by default) and returns the actual time"""
+        if start is None:
+            start = self.clock.monotonic()
+        return self.wait_until(start + duration, event)
+
+
+"""
+Post-session report
+"""
+
+# Name, first phase, second phase
+INTERVALS = [("peck_to_load", "peck", "load"),
+             ("load_to_onset", "load", "onset"),
+             ("peck_to_onset", "peck", "onset"),
+             ("stimulus", "onset", "offset"),
+             ("offset_to_response", "offset", "response"),
+             ("response_to_valve", "response", "valve_open"),
+             ("valve_open", "valve_open", "valve_close"),
+             ("offset_to_step_out", "offset", "step_out")]
+
+
+def read_timing_csv(file_name):
+    """Returns a dict of phase -> array of times in seconds, with NaN where a trial has no mark"""
+    with open(file_name) as file:
+        rows = list(csv.DictReader(file))
+    return dict((phase, np.array([float(row[phase + "_s"]) if row[phase + "_s"] != "NA" else np.nan
+                                  for row in rows]))
+                for phase in TrialTimer.PHASES)
+
+
+def timing_report(file_name):
+    """Prints n, mean, p50, p95, p99 and max in ms of every interval between trial phases"""
+    marks = read_timing_csv(file_name)
+    print "%-20s %6s %10s %10s %10s %10s %10s" % ("interval (ms)", "n", "mean", "p50", "p95", "p99", "max")
+    for name, first_phase, second_phase in INTERVALS:
+        intervals = (marks[second_phase] - marks[first_phase]) * 1000
+        intervals = intervals[~np.isnan(intervals)]
+        if len(intervals) == 0:
+            print "%-20s %6d" % (name, 0)
+            continue
+        print "%-20s %6d %10.3f %10.3f %10.3f %10.3f %10.3f" % \
+              (name, len(intervals), intervals.mean(), np.percentile(intervals, 50), np.percentile(intervals, 95),
+               np.percentile(intervals, 99), intervals.max())
+
+
+if __name__ == "__main__":
+    for timing_file in sys.argv[1:]:
+        print timing_file
+        timing_report(timing_file)
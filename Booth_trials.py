@@ -0,0 +1,175 @@
+"""
+Precomputed trial schedules.
+A TrialSchedule holds every trial of a paradigm (or phase) before the first one starts, drawn with NumPy from one
+seed: whether it is GO or NOGO, which stimulus it plays, its block, the ITI before it and its outcome times. The
+trial loop (Booth.run_trials) only looks its trial up by number, so a paradigm is a schedule plus a csv layout.
+Drawing is deterministic given the seed, so a schedule is journaled as its seed and settings and rebuilt identically
+on resume (see Booth_journal.py).
+GO/NOGO orders can be drawn:
+    - independently, with probability of GO per trial (sessions that end on time)
+    - exactly: round(probability * block_size) GOs in every block of block_size trials, or in the trials of a
+      phase with a trial cap
+and either way with no more than max_run trials of the same type in a row.
+"""
+from collections import namedtuple
+import numpy as np
+
+TRIAL_DTYPE = np.dtype([("go", "?"), ("stimulus", "<i2"), ("block", "<i4"), ("iti", "<f4"),
+                        ("reward_time", "<f4"), ("punishment_null_time", "<f4"), ("null_time", "<f4")])
+OUTCOME_TIMES = ("reward_time", "punishment_null_time", "null_time")
+
+Trial = namedtuple("Trial", TRIAL_DTYPE.names)
+
+TRIAL_TYPES = ("NOGO", "GO")  # Trial_type column, by Trial.go
+# Hit, Miss, Reject and False_alarm columns of each outcome (see Booth_metrics.OUTCOMES); none without a response
+OUTCOME_COLUMNS = {"hit": [1, 0, 0, 0], "miss": [0, 1, 0, 0], "reject": [0, 0, 1, 0], "false_alarm": [0, 0, 0, 1],
+                   None: []}
+
+
+def can_follow(same_left, other_left, run_length, max_run):
+    """
+    Whether same_left more trials of the type of the current run (run_length trials long) and other_left of the other
+    type can still be ordered with no run longer than max_run
+    """
+    return run_length <= max_run and same_left <= (max_run - run_length) + other_left * max_run and \
+        other_left <= (same_left + 1) * max_run
+
+
+class TrialSchedule:
+    def __init__(self, go_stimuli, nogo_stimuli, probability=0.5, block_size=None, trials=None, max_run=None,
+                 iti_range=None, seed=None, chunk_size=1000, **outcome_times):
+        """
+        go_stimuli and nogo_stimuli are lists of sound files; each type's trials are spread evenly over its stimuli.
+        trials is the number of trials to draw up front (a trial cap), drawn as one exact block if block_size is None.
+        Without it, trials are drawn a block (or chunk_size independent trials) at a time as the session needs them,
+        from the same random stream, so the schedule does not depend on when that happens.
+        iti_range draws a uniform ITI before every trial; outcome_times (see OUTCOME_TIMES) are given to every trial.
+        """
+        if probability < 0 or probability > 1:
+            raise ValueError("probability must be between 0 and 1")
+        self.stimuli = list(go_stimuli) + list(nogo_stimuli)
+        self.go_count = len(go_stimuli)
+        self.nogo_count = len(nogo_stimuli)
+        self.probability = probability
+        self.block_size = block_size if block_size is not None or trials is None else trials
+        self.max_run = max_run
+        self.iti_range = iti_range
+        self.chunk_size = chunk_size
+        self.outcome_times = dict((name, outcome_times.get(name) or 0) for name in OUTCOME_TIMES)
+        unknown = [name for name in outcome_times if name not in OUTCOME_TIMES]
+        if unknown:
+            raise ValueError("Unknown outcome times " + ", ".join(unknown))
+        if self.block_size is not None:
+            block_go = int(round(probability * self.block_size))
+            self.block_counts = (block_go, self.block_size - block_go)
+            if (block_go and not self.go_count) or (self.block_size - block_go and not self.nogo_count):
+                raise ValueError("A block needs both GO and NOGO stimuli")
+            if max_run is not None and max(self.block_counts) > max_run * min(self.block_counts):
+                raise ValueError("Blocks of %d GO and %d NOGO trials cannot keep runs to %d" %
+                                 (self.block_counts + (max_run,)))
+        elif max_run is not None and not 0 < probability < 1:
+            raise ValueError("max_run needs both GO and NOGO trials")
+
+        self.seed = np.random.randint(2 ** 31) if seed is None else seed
+        self._random = np.random.RandomState(self.seed)
+        self._run_go = None  # type and length of the run the last drawn trial ends
+        self._run_length = 0
+        self._blocks = 0
+        self.trials = np.zeros(0, dtype=TRIAL_DTYPE)
+        self._rows = []  # the trials as Trials of Python values, so looking one up allocates nothing
+        if trials is not None:
+            self.extend(trials)
+
+    def settings(self):
+        """What the schedule is rebuilt from: TrialSchedule(**settings) draws the same trials"""
+        settings = {"go_stimuli": self.stimuli[:self.go_count], "nogo_stimuli": self.stimuli[self.go_count:],
+                    "probability": self.probability, "block_size": self.block_size, "max_run": self.max_run,
+                    "iti_range": self.iti_range, "seed": self.seed, "chunk_size": self.chunk_size}
+        settings.update(self.outcome_times)
+        return settings
+
+    def _independent_order(self, size):
+        go = self._random.random_sample(size) < self.probability
+        if self.max_run is not None:
+            for index in range(size):
+                if go[index] == self._run_go and self._run_length == self.max_run:
+                    go[index] = not go[index]
+                self._run_length = self._run_length + 1 if go[index] == self._run_go else 1
+                self._run_go = go[index]
+        return go
+
+    def _exact_order(self, go_left, nogo_left):
+        if self.max_run is None:
+            return self._random.permutation(np.arange(go_left + nogo_left) < go_left)
+        # Drawn one at a time in proportion to what is left (a shuffle), but never into a run that leaves the rest
+        # of the block impossible to order
+        go = np.zeros(go_left + nogo_left, dtype=bool)
+        uniforms = self._random.random_sample(len(go))
+        for index in range(len(go)):
+            choice = uniforms[index] * (go_left + nogo_left) < go_left
+            for is_go in (choice, not choice):
+                same_left, other_left = (go_left, nogo_left) if is_go else (nogo_left, go_left)
+                run_length = self._run_length + 1 if is_go == self._run_go else 1
+                if same_left and can_follow(same_left - 1, other_left, run_length, self.max_run):
+                    break
+            else:
+                raise ValueError("No order of this block keeps runs to %d" % self.max_run)
+            go[index] = is_go
+            self._run_go, self._run_length = is_go, run_length
+            if is_go:
+                go_left -= 1
+            else:
+                nogo_left -= 1
+        return go
+
+    def _spread(self, count, first, stimulus_count):
+        """count stimulus indices, each of the stimulus_count stimuli from first on as often as possible, shuffled"""
+        return first + self._random.permutation(np.resize(np.arange(stimulus_count), count))
+
+    def extend(self, count):
+        """Draws at least count more trials (whole blocks)"""
+        chunks = []
+        drawn = 0
+        while drawn < count:
+            if self.block_size is None:
+                go = self._independent_order(self.chunk_size)
+            else:
+                go = self._exact_order(*self.block_counts)
+                self._blocks += 1
+            chunk = np.zeros(len(go), dtype=TRIAL_DTYPE)
+            chunk["go"] = go
+            chunk["block"] = self._blocks  # 0 for independent trials
+            go_trials = np.flatnonzero(go)
+            nogo_trials = np.flatnonzero(~go)
+            if len(go_trials):
+                chunk["stimulus"][go_trials] = self._spread(len(go_trials), 0, self.go_count)
+            if len(nogo_trials):
+                chunk["stimulus"][nogo_trials] = self._spread(len(nogo_trials), self.go_count, self.nogo_count)
+            if self.iti_range is not None:
+                chunk["iti"] = self._random.uniform(self.iti_range[0], self.iti_range[1], len(go))
+            for name, value in self.outcome_times.items():
+                chunk[name] = value
+            chunks.append(chunk)
+            drawn += len(go)
+        self.trials = np.concatenate([self.trials] + chunks)
+        for chunk in chunks:
+            self._rows.extend(Trial._make(row) for row in chunk.tolist())
+
+    def __len__(self):
+        return len(self._rows)
+
+    def trial(self, trial_number):
+        """
+        Trial trial_number (from 1), drawn first if the session has outlived the schedule so far
+        """
+        while trial_number > len(self._rows):
+            self.extend(trial_number - len(self._rows))
+        return self._rows[trial_number - 1]
+
+    def stimulus(self, trial):
+        return self.stimuli[trial.stimulus]
+
+    def counts(self, trials=None):
+        """GO and NOGO trials among the first trials (all drawn so far by default)"""
+        go = self.trials["go"][:trials]
+        return int(np.count_nonzero(go)), int(len(go) - np.count_nonzero(go))
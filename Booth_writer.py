@@ -0,0 +1,118 @@
+"""
+Session-scoped CSV writer for trial data.
+The file stays open for the whole session and rows are written by a background thread, so writing a trial row
+does no file I/O in the paradigm's timed path. The same thread can also append each row to a binary TrialStore.
+"""
+import atexit
+import csv
+import os
+import threading
+import time
+import Queue
+
+_CLOSE = object()  # queue marker that stops the writer thread
+_open_writers = set()
+
+
+class TrialWriter:
+    def __init__(self, file_name, flush_every_rows=1, flush_every_seconds=None, fsync=False, max_queued_rows=1024,
+                 store=None):
+        """
+        Rows are flushed to disk after every flush_every_rows rows and/or once the oldest unflushed row is
+        flush_every_seconds old; set either one to None to disable it.
+        With fsync=True every flush also waits for the data to reach the SD card.
+        write() blocks only if max_queued_rows rows are waiting to be written.
+        store is an optional Booth_store.TrialStore that receives every row as well; it is closed with the writer.
+        An error writing a row or flushing is printed and the writer carries on with the next row; a store that fails
+        is closed and dropped, and the csv keeps being written.
+        """
+        self.file_name = file_name
+        self.flush_every_rows = flush_every_rows
+        self.flush_every_seconds = flush_every_seconds
+        self.fsync = fsync
+        self.store = store
+
+        self._file = open(file_name, 'a')
+        self._writer = csv.writer(self._file, delimiter=',')
+        self._queue = Queue.Queue(maxsize=max_queued_rows)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        _open_writers.add(self)
+
+    def write(self, row):
+        self._queue.put(row)
+
+    def _flush(self):
+        try:
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except (IOError, OSError) as error:
+            print "Could not flush " + self.file_name + ": " + str(error)
+
+    def _write_row(self, row):
+        try:
+            self._writer.writerow(row)
+        except (IOError, OSError, csv.Error) as error:
+            print "Could not write a row to " + self.file_name + ": " + str(error)
+        if self.store is not None:
+            try:
+                self.store.append(row)
+            except Exception as error:  # the csv still has the row
+                print "Not keeping the binary store of " + self.file_name + " any more: " + str(error)
+                self._close_store()
+
+    def _close_store(self):
+        store, self.store = self.store, None
+        try:
+            store.close()
+        except (IOError, OSError) as error:
+            print "Could not close the binary store of " + self.file_name + ": " + str(error)
+
+    def _run(self):
+        unflushed_rows = 0
+        first_unflushed_time = None
+        while True:
+            if unflushed_rows and self.flush_every_seconds is not None:
+                timeout = max(0, first_unflushed_time + self.flush_every_seconds - time.time())
+            else:
+                timeout = None  # nothing pending on a timer, sleep until the next row
+            try:
+                row = self._queue.get(timeout=timeout)
+            except Queue.Empty:
+                row = None
+
+            if row is _CLOSE:
+                break
+            if row is not None:
+                self._write_row(row)
+                if not unflushed_rows:
+                    first_unflushed_time = time.time()
+                unflushed_rows += 1
+
+            if unflushed_rows and \
+                    ((self.flush_every_rows is not None and unflushed_rows >= self.flush_every_rows) or
+                     (self.flush_every_seconds is not None and
+                      time.time() - first_unflushed_time >= self.flush_every_seconds)):
+                self._flush()
+                unflushed_rows = 0
+
+        self._flush()
+        self._file.close()
+        if self.store is not None:
+            self._close_store()
+
+    def close(self):
+        """Writes out every queued row and closes the file"""
+        if self not in _open_writers:
+            return
+        _open_writers.discard(self)
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+
+@atexit.register
+def close_all_writers():
+    for writer in list(_open_writers):
+        writer.close()
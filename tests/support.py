@@ -0,0 +1,82 @@
+"""
+Shared helpers for the tests. Sessions write their files to the working directory, so every SessionTestCase runs in
+a temporary folder of its own, holding a GO tone, a NOGO tone, a white noise and a GO and a NOGO folder of songs.
+Run the tests from the repository folder as: python -m unittest discover tests
+"""
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import wave
+import numpy as np
+
+# The tests change directory, so the repository is put on the path by name rather than as the working directory
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+GO_SOUND = "go.wav"
+NOGO_SOUND = "nogo.wav"
+WN_SOUND = "wn.wav"
+# scene_discrimination's stimulus folders, and the SNRs of the songs in each
+GO_FOLDER = "go"
+NOGO_FOLDER = "nogo"
+SCENE_SNRS = (-3, 0, 5)
+
+
+def write_wav(file_name, samples, sample_rate=44100):
+    """Writes float samples (within +-1) as a mono 16-bit WAV"""
+    wav = wave.open(file_name, "wb")
+    wav.setnchannels(1)
+    wav.setsampwidth(2)
+    wav.setframerate(sample_rate)
+    wav.writeframes((np.asarray(samples) * 16383).astype(np.int16).tostring())
+    wav.close()
+
+
+def write_tone(file_name, frequency, duration=0.5, sample_rate=44100):
+    write_wav(file_name, np.sin(2 * np.pi * frequency * np.arange(int(duration * sample_rate)) / sample_rate),
+              sample_rate)
+
+
+def read_rows(file_name):
+    """The rows of a csv file, header first"""
+    with open(file_name) as csv_file:
+        return list(csv.reader(csv_file))
+
+
+class Crash(Exception):
+    """Stands for the process dying"""
+    pass
+
+
+def crash_after(booth, trial_count):
+    """Makes booth raise Crash once trial_count trials have been journaled"""
+    record_outcome = booth.record_outcome
+    journaled = [0]
+
+    def record(*arguments, **keywords):
+        record_outcome(*arguments, **keywords)
+        journaled[0] += 1
+        if journaled[0] == trial_count:
+            raise Crash()
+    booth.record_outcome = record
+
+
+class SessionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.working_directory = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        write_tone(GO_SOUND, 2000)
+        write_tone(NOGO_SOUND, 3000)
+        write_wav(WN_SOUND, np.random.RandomState(0).uniform(-1, 1, 22050))
+        for folder, frequency in ((GO_FOLDER, 1000), (NOGO_FOLDER, 1500)):
+            os.mkdir(folder)
+            for song, snr in enumerate(SCENE_SNRS, 1):
+                write_tone(os.path.join(folder, "Song%dPk43(-4)%dsnr.wav" % (song, snr)), frequency * song, 0.2)
+
+    def tearDown(self):
+        os.chdir(self.working_directory)
+        shutil.rmtree(self.folder)
@@ -0,0 +1,69 @@
+import csv
+import unittest
+import numpy as np
+from tests.support import SessionTestCase, GO_SOUND, NOGO_SOUND, WN_SOUND, read_rows
+from Booth_database import connect, import_csv, query_trials
+from Booth_sim import simulated_booth
+
+SESSION_CSV = "birdA_261001_go_nogo.csv"
+
+
+def write_rows(file_name, rows):
+    with open(file_name, "wb") as csv_file:
+        csv.writer(csv_file).writerows(rows)
+
+
+class DatabaseTest(SessionTestCase):
+    def setUp(self):
+        SessionTestCase.setUp(self)
+        booth = simulated_booth("birdA_261001", go_sounds=[GO_SOUND], nogo_sounds=[NOGO_SOUND], seed=2)
+        booth.DATABASE = "live.db"
+        try:
+            booth.go_nogo(GO_SOUND, NOGO_SOUND, WN_SOUND, probability=0.5, duration=600)
+        finally:
+            booth.close()
+        self.rows = read_rows(SESSION_CSV)
+
+    def import_rows(self, rows, file_name=SESSION_CSV):
+        write_rows(file_name, rows)
+        connection = connect("imported.db")
+        try:
+            return import_csv(connection, file_name)
+        finally:
+            connection.close()
+
+    def test_imported_trials_equal_live_trials(self):
+        trial_count, problems = self.import_rows(self.rows)
+        self.assertEqual((trial_count, problems), (len(self.rows) - 1, []))
+        live = query_trials("live.db")
+        imported = query_trials("imported.db")
+        self.assertEqual(len(live), len(self.rows) - 1)
+        for name in live.dtype.names:
+            if name != "date":  # live sessions are dated by the day they ran, imports by the file's
+                np.testing.assert_array_equal(live[name], imported[name], name)
+
+    def test_columns_are_found_by_the_files_header(self):
+        # an older layout: no Stimulus column, and columns (Stimulus_pecks) the current layout does not have
+        header = self.rows[0]
+        order = [header.index(column) for column in header if column != "Stimulus"]
+        rows = [[row[index] for index in order] + ["0"] for row in self.rows]
+        rows[0][-1] = "Stimulus_pecks"
+        trial_count, problems = self.import_rows(rows)
+        self.assertEqual((trial_count, problems), (len(self.rows) - 1, []))
+        live = query_trials("live.db")
+        imported = query_trials("imported.db")
+        self.assertTrue(all(stimulus is None for stimulus in imported["stimulus"]))
+        for name in ("trial_number", "trial_type", "response_time", "outcome", "time_from_start"):
+            np.testing.assert_array_equal(live[name], imported[name], name)
+
+    def test_unreadable_rows_and_files_are_reported(self):
+        rows = self.rows[:3] + [self.rows[0], self.rows[3][:-2], ["x"] + self.rows[4][1:]] + self.rows[5:]
+        trial_count, problems = self.import_rows(rows)
+        self.assertEqual(trial_count, len(self.rows) - 3)
+        self.assertEqual([line_number for line_number, _ in problems], [5, 6])
+        trial_count, problems = self.import_rows([["Time_from_start"], ["1.0"]], "birdA_261002_go_nogo.csv")
+        self.assertEqual((trial_count, len(problems)), (0, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from tests.support import SessionTestCase, GO_SOUND, NOGO_SOUND, WN_SOUND, read_rows
+from Booth_sim import simulated_booth
+
+
+class OnsetWindowTest(SessionTestCase):
+    def run_session(self, response_window, false_alarm_probability):
+        booth = simulated_booth("onset", go_sounds=[GO_SOUND], nogo_sounds=[NOGO_SOUND], hit_probability=1,
+                                false_alarm_probability=false_alarm_probability, seed=1)
+        try:
+            booth.go_nogo(GO_SOUND, NOGO_SOUND, WN_SOUND, probability=0.5, duration=600,
+                          response_window=response_window)
+        finally:
+            booth.close()
+        rows = read_rows("onset_go_nogo.csv")
+        return [dict(zip(rows[0], row)) for row in rows[1:]]
+
+    def test_held_initiating_peck_is_not_a_response(self):
+        trials = self.run_session("onset", false_alarm_probability=0)
+        nogo = [trial for trial in trials if trial["Trial_type"] == "NOGO"]
+        self.assertTrue(nogo)
+        self.assertTrue(all(trial["Reject"] == "1" for trial in nogo))
+        response_times = [float(trial["Response_time_s"]) for trial in trials if trial["Response_time_s"] != "NA"]
+        self.assertTrue(response_times)
+        self.assertTrue(all(response_time > 0 for response_time in response_times))
+
+    def test_onset_window_still_takes_responses(self):
+        trials = self.run_session("onset", false_alarm_probability=1)
+        self.assertTrue(any(trial["False_alarm"] == "1" for trial in trials))
+        self.assertTrue(any(trial["Hit"] == "1" for trial in trials))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import glob
+import os
+import unittest
+from tests.support import SessionTestCase, Crash, crash_after, read_rows, GO_SOUND, NOGO_SOUND, WN_SOUND, \
+    GO_FOLDER, NOGO_FOLDER
+from Booth_journal import read_journal
+from Booth_sim import simulated_booth
+from Booth_trials import TrialSchedule, TRIAL_TYPES
+
+SESSION_ID = "birdA_261001"
+
+
+class ResumeTest(SessionTestCase):
+    def run_crashed(self, paradigm, trial_count, **parameters):
+        """Runs paradigm until trial_count trials are journaled, then resumes it in a new Booth to the end"""
+        booth = simulated_booth(SESSION_ID, go_sounds=[GO_SOUND, GO_FOLDER], nogo_sounds=[NOGO_SOUND, NOGO_FOLDER],
+                                seed=3)
+        crash_after(booth, trial_count)
+        try:
+            self.assertRaises(Crash, getattr(booth, paradigm), **parameters)
+        finally:
+            booth.close()
+        booth = simulated_booth(SESSION_ID, go_sounds=[GO_SOUND, GO_FOLDER], nogo_sounds=[NOGO_SOUND, NOGO_FOLDER],
+                                seed=4)
+        try:
+            getattr(booth, paradigm)(resume=True, **parameters)
+        finally:
+            booth.close()
+        return read_journal(SESSION_ID + ".journal")
+
+    def trials(self, csv_name):
+        """The trial rows of a csv, as dicts; the resumed run continues the csv under its one header"""
+        rows = read_rows(csv_name)
+        self.assertEqual(rows[0][0], "Trial_number")
+        self.assertFalse(rows[0] in rows[1:])
+        return [dict(zip(rows[0], row)) for row in rows[1:]]
+
+    def assert_follows_schedule(self, journal, phase, trials):
+        """
+        trials are numbered 1, 2, ... once each and have the types of the phase's journaled schedule, which is returned
+        """
+        schedules = [record for record in journal if record["type"] == "schedule" and record["phase"] == phase]
+        self.assertEqual(len(schedules), 1)  # the resumed run rebuilt it rather than drawing a new one
+        schedule = TrialSchedule(**schedules[0]["settings"])
+        self.assertEqual([int(trial["Trial_number"]) for trial in trials], range(1, len(trials) + 1))
+        self.assertEqual([trial["Trial_type"] for trial in trials],
+                         [TRIAL_TYPES[schedule.trial(number).go] for number in range(1, len(trials) + 1)])
+        times = [float(trial["Time_from_start"]) for trial in trials]
+        self.assertEqual(times, sorted(times))  # the session time carries on from the crash
+        return schedule
+
+    def test_go_nogo(self):
+        journal = self.run_crashed("go_nogo", 7, go_sound=GO_SOUND, nogo_sound=NOGO_SOUND, wn_sound=WN_SOUND,
+                                   duration=900, block_size=10, max_run=3)
+        self.assertEqual([record["type"] for record in journal if record["type"] in ("start", "end")],
+                         ["start", "end"])
+        trials = self.trials(SESSION_ID + "_go_nogo.csv")
+        self.assertTrue(len(trials) > 7)
+        self.assert_follows_schedule(journal, "go_nogo", trials)
+
+    def test_scene_discrimination_in_the_middle_of_a_block(self):
+        journal = self.run_crashed("scene_discrimination", 5, go_path=GO_FOLDER, nogo_path=NOGO_FOLDER,
+                                   wn_sound=WN_SOUND, block_size=8, duration=900)
+        trials = self.trials(SESSION_ID + "_scene.csv")
+        self.assertTrue(len(trials) > 8)
+        schedule = self.assert_follows_schedule(journal, "scene", trials)
+        self.assertEqual([trial["Sound_file"] for trial in trials],
+                         [os.path.basename(schedule.stimulus(schedule.trial(number)))
+                          for number in range(1, len(trials) + 1)])
+
+    def test_classical_to_operant_conditioning_in_its_operant_phase(self):
+        journal = self.run_crashed("classical_to_operant_conditioning", 9, go_sound=GO_SOUND, nogo_sound=NOGO_SOUND,
+                                   wn_sound=WN_SOUND, classical_probability=0.5, operant_probability=0.5,
+                                   classical_conditioning_trial_cap=6, operant_conditioning_trial_cap=10,
+                                   iti_range=(5, 10))
+        classical, = glob.glob("*_classical_conditioning.csv")
+        operant, = glob.glob("*_operant_conditioning.csv")
+        self.assertEqual(len(self.trials(classical)), 6)  # not run again
+        self.assertEqual(len(self.trials(operant)), 10)
+        self.assert_follows_schedule(journal, "operant_conditioning", self.trials(operant))
+
+    def test_paradigm_without_a_journal_leaves_none(self):
+        booth = simulated_booth(SESSION_ID, seed=5)
+        try:
+            booth.shaping(duration=300)
+        finally:
+            booth.close()
+        self.assertFalse(os.path.exists(SESSION_ID + ".journal"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import glob
+import os
+import unittest
+from tests.support import SessionTestCase, GO_SOUND, NOGO_SOUND, WN_SOUND, GO_FOLDER, NOGO_FOLDER
+from Booth_sim import simulated_booth
+from Booth_store import convert_to_csv, read_trials
+
+
+def read_bytes(file_name):
+    with open(file_name, 'rb') as data_file:
+        return data_file.read()
+
+
+class StoreTest(SessionTestCase):
+    def run_session(self, paradigm, **parameters):
+        booth = simulated_booth("birdA_261001", go_sounds=[GO_SOUND, GO_FOLDER], nogo_sounds=[NOGO_SOUND, NOGO_FOLDER],
+                                seed=7)
+        try:
+            getattr(booth, paradigm)(**parameters)
+        finally:
+            booth.close()
+
+    def assert_round_trip(self, title):
+        """title's store converts back to exactly the csv the session wrote"""
+        convert_to_csv(title + ".trials", "converted.csv")
+        self.assertEqual(read_bytes("converted.csv"), read_bytes(title + ".csv"))
+
+    def test_go_nogo(self):
+        self.run_session("go_nogo", go_sound=GO_SOUND, nogo_sound=NOGO_SOUND, wn_sound=WN_SOUND, duration=900)
+        self.assert_round_trip("birdA_261001_go_nogo")
+
+    def test_scene_discrimination(self):
+        self.run_session("scene_discrimination", go_path=GO_FOLDER, nogo_path=NOGO_FOLDER, wn_sound=WN_SOUND,
+                         block_size=6, duration=900)
+        self.assert_round_trip("birdA_261001_scene")
+
+    def test_classical_to_operant_conditioning(self):
+        self.run_session("classical_to_operant_conditioning", go_sound=GO_SOUND, nogo_sound=NOGO_SOUND,
+                         wn_sound=WN_SOUND, classical_probability=0.5, operant_probability=0.5,
+                         classical_conditioning_trial_cap=6, operant_conditioning_trial_cap=10, iti_range=(5, 10))
+        titles = sorted(name[:-len(".trials")] for name in glob.glob("*.trials"))
+        self.assertEqual([title.rsplit("_", 2)[1:] for title in titles],
+                         [["classical", "conditioning"], ["operant", "conditioning"]])
+        for title in titles:
+            self.assert_round_trip(title)
+
+    def test_half_written_record_is_left_out(self):
+        self.run_session("go_nogo", go_sound=GO_SOUND, nogo_sound=NOGO_SOUND, wn_sound=WN_SOUND, duration=300)
+        trials_file_name = "birdA_261001_go_nogo.trials"
+        _, records, _ = read_trials(trials_file_name)
+        record_count = len(records)
+        del records  # unmaps the file
+        with open(trials_file_name, 'r+b') as trials_file:
+            trials_file.truncate(os.path.getsize(trials_file_name) - 3)
+        _, records, _ = read_trials(trials_file_name)
+        self.assertEqual(len(records), record_count - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import glob
+import itertools
+import unittest
+from tests.support import SessionTestCase, read_rows, GO_SOUND, NOGO_SOUND, WN_SOUND
+from Booth_sim import simulated_booth
+from Booth_trials import TrialSchedule
+
+GO_STIMULI = ["go1.wav", "go2.wav", "go3.wav"]
+NOGO_STIMULI = ["nogo1.wav", "nogo2.wav"]
+
+
+def longest_run(types):
+    return max(len(list(run)) for _, run in itertools.groupby(types))
+
+
+class TrialScheduleTest(unittest.TestCase):
+    def test_blocks_are_exact(self):
+        schedule = TrialSchedule(GO_STIMULI, NOGO_STIMULI, 0.3, block_size=20, max_run=3, seed=1)
+        trials = [schedule.trial(number) for number in range(1, 201)]
+        for block in range(10):
+            in_block = trials[block * 20:(block + 1) * 20]
+            self.assertEqual([trial.block for trial in in_block], [block + 1] * 20)
+            self.assertEqual(sum(trial.go for trial in in_block), 6)
+            go_stimuli = [schedule.stimulus(trial) for trial in in_block if trial.go]
+            nogo_stimuli = [schedule.stimulus(trial) for trial in in_block if not trial.go]
+            # each type spread evenly over its stimuli
+            self.assertEqual([go_stimuli.count(stimulus) for stimulus in GO_STIMULI], [2, 2, 2])
+            self.assertEqual([nogo_stimuli.count(stimulus) for stimulus in NOGO_STIMULI], [7, 7])
+        self.assertTrue(longest_run([trial.go for trial in trials]) <= 3)  # also across blocks
+
+    def test_independent_trials_keep_runs_to_max_run(self):
+        schedule = TrialSchedule(GO_STIMULI, NOGO_STIMULI, 0.8, max_run=2, seed=2, chunk_size=100)
+        types = [schedule.trial(number).go for number in range(1, 1001)]
+        self.assertTrue(longest_run(types) <= 2)
+
+    def test_trial_cap_is_one_exact_block(self):
+        schedule = TrialSchedule(GO_STIMULI, NOGO_STIMULI, 0.5, trials=30, seed=3)
+        self.assertEqual(len(schedule), 30)
+        self.assertEqual(schedule.counts(), (15, 15))
+
+    def test_rebuilt_from_its_settings(self):
+        for settings in ({"block_size": 12, "max_run": 2}, {"iti_range": (30, 60)}):
+            schedule = TrialSchedule(GO_STIMULI, NOGO_STIMULI, 0.4, seed=4, chunk_size=50, reward_time=2, **settings)
+            for count in (1, 7, 60, 130):  # drawn as a session would need them
+                schedule.trial(count)
+            rebuilt = TrialSchedule(**schedule.settings())
+            self.assertEqual([rebuilt.trial(number) for number in range(130, 0, -1)],
+                             [schedule.trial(number) for number in range(130, 0, -1)])
+        self.assertTrue(all(30 <= schedule.trial(number).iti <= 60 and schedule.trial(number).reward_time == 2
+                            for number in range(1, len(schedule) + 1)))
+
+    def test_impossible_settings_are_refused(self):
+        self.assertRaises(ValueError, TrialSchedule, GO_STIMULI, NOGO_STIMULI, 0.9, block_size=10, max_run=2)
+        self.assertRaises(ValueError, TrialSchedule, GO_STIMULI, [], 0.5, block_size=10)
+        self.assertRaises(ValueError, TrialSchedule, GO_STIMULI, NOGO_STIMULI, 1, max_run=3)
+        self.assertRaises(ValueError, TrialSchedule, GO_STIMULI, NOGO_STIMULI, 1.5)
+
+
+class SessionScheduleTest(SessionTestCase):
+    def test_go_nogo_plays_exact_blocks(self):
+        booth = simulated_booth("birdA_261001", go_sounds=[GO_SOUND], nogo_sounds=[NOGO_SOUND], seed=5)
+        try:
+            booth.go_nogo(GO_SOUND, NOGO_SOUND, WN_SOUND, probability=0.25, duration=1800, block_size=8, max_run=4)
+        finally:
+            booth.close()
+        rows = read_rows("birdA_261001_go_nogo.csv")
+        trials = [dict(zip(rows[0], row)) for row in rows[1:]]
+        types = [trial["Trial_type"] for trial in trials]
+        self.assertTrue(len(types) >= 32)
+        for block in range(len(types) // 8):
+            self.assertEqual(types[block * 8:(block + 1) * 8].count("GO"), 2)
+        self.assertTrue(longest_run(types) <= 4)
+        for trial in trials:
+            self.assertEqual(trial["Stimulus"], GO_SOUND if trial["Trial_type"] == "GO" else NOGO_SOUND)
+
+    def test_classical_to_operant_conditioning_caps_its_phases(self):
+        booth = simulated_booth("birdA_261001", go_sounds=[GO_SOUND], nogo_sounds=[NOGO_SOUND], seed=6)
+        try:
+            booth.classical_to_operant_conditioning(GO_SOUND, NOGO_SOUND, WN_SOUND, 0.5, 0.3,
+                                                    classical_conditioning_trial_cap=8,
+                                                    operant_conditioning_trial_cap=10, iti_range=(5, 10))
+        finally:
+            booth.close()
+        classical, = glob.glob("*_classical_conditioning.csv")
+        operant, = glob.glob("*_operant_conditioning.csv")
+        self.assertEqual([row[1] for row in read_rows(classical)[1:]].count("GO"), 4)
+        self.assertEqual([row[1] for row in read_rows(operant)[1:]].count("GO"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
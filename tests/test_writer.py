@@ -0,0 +1,36 @@
+import unittest
+from tests.support import SessionTestCase, read_rows
+from Booth_writer import TrialWriter
+
+
+class FailingStore:
+    """A Booth_store.TrialStore whose appends fail after the first"""
+    def __init__(self):
+        self.rows = []
+        self.closed = False
+
+    def append(self, row):
+        if self.rows:
+            raise ValueError("disk full")
+        self.rows.append(row)
+
+    def close(self):
+        self.closed = True
+
+
+class TrialWriterTest(SessionTestCase):
+    def test_failing_store_does_not_stop_the_csv(self):
+        store = FailingStore()
+        writer = TrialWriter("trials.csv", max_queued_rows=2, store=store)
+        rows = [[number, "GO", 0.5] for number in range(1, 21)]
+        for row in rows:
+            writer.write(row)  # would block for good once the queue filled if the thread had died
+        writer.close()
+        self.assertEqual(read_rows("trials.csv"), [[str(value) for value in row] for row in rows])
+        self.assertEqual(store.rows, rows[:1])
+        self.assertTrue(store.closed)
+        self.assertTrue(writer.store is None)
+
+
+if __name__ == "__main__":
+    unittest.main()